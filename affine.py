@@ -2,50 +2,112 @@
 
 import utils
 import cipher
+import triage
 import unittest
-import fractions
+import math
+import collections
+import functools
+
+np = utils.lazyImport('numpy')
+
+_multipliers = [a for a in range(1, utils.ALPHABET_SIZE) if math.gcd(a, utils.ALPHABET_SIZE) == 1]  # Every a genKeys gives
+
+KeySchedule = collections.namedtuple('KeySchedule', ['encryptTable', 'decryptTable', 'encryptBytesTable', 'decryptBytesTable'])
+
+# The same letter mapping as a str translate table, for bytes
+def bytesTable(table):
+	return bytes.maketrans(utils.LOWER_ALPHABET.encode(), utils.LOWER_ALPHABET.translate(table).encode())
+
+# Keys get reused a lot (every message in a batch, and the winner of every crack), so compiled ones are kept around
+@functools.lru_cache(maxsize=128)
+def compileKey(key):
+	"""Builds the str and bytes translation tables for a key.  The decrypt tables are None if a has no inverse"""
+	(a,b) = key
+
+	encryptTable = utils.letterMapTable(a, b)
+	encryptBytesTable = bytesTable(encryptTable)
+
+	try:
+		aInv = utils.multInverse(a, utils.ALPHABET_SIZE)
+	except ValueError:
+		return KeySchedule(encryptTable, None, encryptBytesTable, None)  # Can still encrypt, just never decrypt
+
+	decryptTable = utils.letterMapTable(aInv, (-aInv*b) % utils.ALPHABET_SIZE)  # aInv*(x-b)
+	decryptBytesTable = bytesTable(decryptTable)
+
+	return KeySchedule(encryptTable, decryptTable, encryptBytesTable, decryptBytesTable)
 
 class Affine(cipher.AbstractBruteForceCipher):
 
+	# Works on str or bytes-like, the output type follows the input
 	def encrypt(self, plaintext, key):
-		(a,b) = key
-		ciphertext = ''
-
-		lowera = ord('a')
-		for c in plaintext:
-			if utils.isAlpha(c):
-				x = ord(c)-lowera
-				y = (a*x+b) % utils.ALPHABET_SIZE
-				ciphertext += chr(lowera+y)
-			else:
-				ciphertext += c
+		schedule = compileKey(tuple(key))
 
-		return ciphertext
+		if isinstance(plaintext, str):
+			return plaintext.translate(schedule.encryptTable)
+		return bytes(plaintext).translate(schedule.encryptBytesTable)
 
 	def decrypt(self, ciphertext, key):
-		(a,b) = key
-		plaintext = ''
-
-		lowera = ord('a')
-		for c in ciphertext:
-			if utils.isAlpha(c):
-				x = ord(c)-lowera
-				y = (utils.multInverse(a, utils.ALPHABET_SIZE)*(x-b)) % utils.ALPHABET_SIZE
-				plaintext += chr(lowera+y)
-			else:
-				plaintext += c
+		return self.decryptMany([ciphertext], key)[0]
+
+	def decryptMany(self, ciphertexts, key):
+		"""Decrypts every ciphertext with the same key, only compiling the key once"""
+		schedule = compileKey(tuple(key))
+		if schedule.decryptTable == None:
+			(a,_) = key
+			raise ValueError('%d^-1 mod %d cannot be found' % (a, utils.ALPHABET_SIZE))
+
+		ciphertexts = [utils.textOf(c) for c in ciphertexts]
+		return [c.translate(schedule.decryptTable) if isinstance(c, str) else bytes(c).translate(schedule.decryptBytesTable) for c in ciphertexts]
 
-		return plaintext	
+	def decryptTables(self, keys):
+		return self.decryptBatch(np.arange(256, dtype=np.uint8), keys)  # Decrypting every byte value gives the table
+
+	def decryptBatch(self, codes, keys):
+		keys = np.array(keys, dtype=np.int32)
+		aInvs = np.array([utils.multInverse(a, utils.ALPHABET_SIZE) for a in keys[:,0]], dtype=np.int32)
+		bs = keys[:,1]
+
+		x = codes.astype(np.int32) - ord('a')
+		isAlpha = (x >= 0) & (x < utils.ALPHABET_SIZE)
+
+		y = (aInvs[:,None]*(x[None,:]-bs[:,None])) % utils.ALPHABET_SIZE + ord('a')
+
+		return np.where(isAlpha, y, codes).astype(np.uint8)
 
 	def genKeys(self):  # Can't really unit test this effectively...
 		for a in range(1, utils.ALPHABET_SIZE):
-			if fractions.gcd(a, utils.ALPHABET_SIZE) == 1:
+			if math.gcd(a, utils.ALPHABET_SIZE) == 1:
 				for b in range(1, utils.ALPHABET_SIZE):
 					yield (a,b)	
 
+	# Same order as genKeys (a then b), so key i is worked out straight from i
+	def genKeyRange(self, start, end=None):
+		numBs = utils.ALPHABET_SIZE-1
+		end = self.countKeys() if end == None else min(end, self.countKeys())
+		return ((_multipliers[i // numBs], 1 + i % numBs) for i in range(start, end))
+
+	def countKeys(self):
+		return len(_multipliers)*(utils.ALPHABET_SIZE-1)
+
 	def crack(self, ciphertext):
 		return super().bruteForce(ciphertext)
 
+	def isPermutation(self):
+		return True
+
+	# Substituting letters keeps the plaintext's letter coincidence just as it was
+	def triage(self, stats):
+		reason = triage.unprintableReason(stats)
+		if reason != None:
+			return (triage.RULED_OUT, reason)
+		if stats.ioc != None and stats.ioc < triage.POLYALPHABETIC_IOC:
+			return (triage.RULED_OUT, 'letter coincidence %.2f is too low for one substitution' % stats.ioc)
+		if stats.ioc != None and stats.ioc >= triage.MONOALPHABETIC_IOC:
+			return (triage.LIKELY, 'letter coincidence %.2f' % stats.ioc)
+
+		return (triage.POSSIBLE, None)
+
 	def getNameOfCipher(self, key=None):
 		if key == None:
 			return 'Affine'
@@ -82,10 +144,50 @@ class AffineTest(unittest.TestCase):
 		self.assertEqual(self.affineInstance.decrypt('bBd', (1,1)), 'aBc')
 		self.assertEqual(self.affineInstance.decrypt('ihhwvc swfrcp', (5,8)), 'affine cipher')
 
+	def test_decryptMany(self):
+		self.assertEqual(self.affineInstance.decryptMany(['ihhwvc swfrcp', 'bBd', ''], (5,8)), ['affine cipher', 'jBz', ''])
+		self.assertEqual(self.affineInstance.decryptMany([b'ihhwvc swfrcp', bytearray(b'x\xff')], (5,8)), [b'affine cipher', b'd\xff'])
+		with self.assertRaises(ValueError):
+			self.affineInstance.decrypt('abc', (13,1))
+
+	def test_compileKey(self):
+		self.assertIs(compileKey((7,13)), compileKey((7,13)))
+		self.assertEqual(self.affineInstance.encrypt('abc', [1,1]), 'bcd')  # Lists still work as keys
+		self.assertIsNone(compileKey((13,1)).decryptTable)
+		self.assertEqual(self.affineInstance.encrypt(b'affine cipher', (5,8)), b'ihhwvc swfrcp')
+
 	def test_identity(self):
 		self.assertEqual(self.affineInstance.encrypt(self.affineInstance.decrypt('random text hi there! zzz', (7,13)), (7,13)), 'random text hi there! zzz')
 		self.assertEqual(self.affineInstance.encrypt(self.affineInstance.decrypt('random text hi there! zzz', (7,13)), (7,13)), 'random text hi there! zzz')
 
+	def test_decryptBatch(self):
+		ciphertext = 'ihhwvc swfrcp, 123 ZZ'
+		keys = list(self.affineInstance.genKeys())
+		plaintexts = self.affineInstance.decryptBatch(utils.textToCodes(ciphertext), keys)
+		self.assertEqual(plaintexts.shape, (len(keys), len(ciphertext)))
+		for key, row in zip(keys, plaintexts):
+			self.assertEqual(utils.codesToText(row), self.affineInstance.decrypt(ciphertext, key))
+
+	def test_genKeyRange(self):
+		keys = list(self.affineInstance.genKeys())
+		self.assertEqual(self.affineInstance.countKeys(), len(keys))
+		self.assertEqual(list(self.affineInstance.genKeyRange(0)), keys)
+		self.assertEqual(list(self.affineInstance.genKeyRange(30, 60)), keys[30:60])
+
+	def test_decryptTables(self):
+		keys = [(1,1), (7,13), (25,25)]
+		tables = self.affineInstance.decryptTables(keys)
+		ciphertext = 'ihhwvc swfrcp, 123 ZZ'
+		for key, table in zip(keys, tables):
+			self.assertEqual(''.join(chr(table[ord(c)]) for c in ciphertext), self.affineInstance.decrypt(ciphertext, key))
+
+	def test_scoreKeys(self):
+		ciphertext = 'qeb nrfzh yoltk clu grjmp lsbo qeb ixwv ald'
+		keys = list(self.affineInstance.genKeys())
+		batched = self.affineInstance.scoreKeys(ciphertext, keys)
+		for key, chi2 in zip(keys, batched):
+			self.assertAlmostEqual(chi2, self.affineInstance.scoreKey(ciphertext, key))
+
 	def test_crack(self):
 		# Regular Affine
 		ciphertext = 'lrekmepqocpcboygywppehfiwpfzyqgdzergypwfywecyojeqcmyegfgypwfcymjyfgfmfgwpqgdzergpgffzeyciedbcgpfehfbefferqcpjeepqrodfexfwcpowpewlyetercbxgllerepfqgdzerfehfbefferyxedepxgpswpgfydwygfgwpgpfzeieyycse'
@@ -110,3 +212,18 @@ class AffineTest(unittest.TestCase):
 		maybePlaintext = self.affineInstance.decrypt(ciphertext, key)
 		self.assertEqual(key, (utils.ALPHABET_SIZE-1,utils.ALPHABET_SIZE-1))				
 		self.assertEqual(plaintext, maybePlaintext)
+
+	def test_incrementalCracker(self):
+		ciphertext = 'lrekmepqocpcboygywppehfiwpfzyqgdzergypwfywecyojeqcmyegfgypwfcymjyfgfmfgwpqgdzergpgffzeyciedbcgpfehfbefferqcpjeepqrodfexfwcpowpewlyetercbxgllerepfqgdzerfehfbefferyxedepxgpswpgfydwygfgwpgpfzeieyycse'
+		cracker = self.affineInstance.incrementalCracker()
+		for i in range(0, len(ciphertext), 50):
+			cracker.feed(ciphertext[i:i+50].upper())  # Lowercased like crack does
+			self.assertEqual(cracker.bestRanked(3), self.affineInstance.crackRanked(ciphertext[:i+50], 3))
+		self.assertEqual(cracker.best(), self.affineInstance.crack(ciphertext))
+		self.assertEqual(self.affineInstance.incrementalCracker().best(), self.affineInstance.crack(''))
+
+	def test_bruteForceWorkers(self):
+		keys = list(self.affineInstance.genKeys())
+		for workers in [1, 2, 5]:  # Every key ties on text without letters, so it's down to the order of genKeys
+			self.assertEqual(self.affineInstance.bruteForceRanked('123 456', 0.0, 3, workers=workers), [(key, 0.0) for key in keys[:3]])
+		self.assertEqual(self.affineInstance.countKeys(), len(keys))
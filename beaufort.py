@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import polyalphabetic
+import unittest
+
+
+# Ciphertext letter is key-plaintext, so encrypting and decrypting are the same thing
+class Beaufort(polyalphabetic.Polyalphabetic):
+
+	def encryptMap(self, shift):
+		return (-1, shift)
+
+	def decryptMap(self, shift):
+		return (-1, shift)
+
+	def getNameOfCipher(self, key=None):
+		if key != None and len(key) == 1:
+			return 'Atbash (Beaufort)' if key == 'z' else 'Beaufort'
+		else:
+			return 'Beaufort'
+
+	def usage(self):
+		print('Key must be a lower-case string')
+
+
+# Ciphertext letter is plaintext-key, i.e. Vigenere with encryption and decryption swapped
+class VariantBeaufort(polyalphabetic.Polyalphabetic):
+
+	def encryptMap(self, shift):
+		return (1, -shift)
+
+	def decryptMap(self, shift):
+		return (1, shift)
+
+	def getNameOfCipher(self, key=None):
+		return 'Variant Beaufort'
+
+	def usage(self):
+		print('Key must be a lower-case string')
+
+
+class BeaufortTest(unittest.TestCase):
+
+	def setUp(self):
+		self.beaufortInstance = Beaufort()
+		self.variantInstance = VariantBeaufort()
+
+	def test_encrypt(self):
+		self.assertEqual(self.beaufortInstance.encrypt('defend the east wall', 'fortification'), 'ckmpvc pvw piwu jogi')
+		self.assertEqual(self.beaufortInstance.encrypt('abc', 'z'), 'zyx')
+		self.assertEqual(self.variantInstance.encrypt('abc', 'b'), 'zab')
+
+	def test_decrypt(self):
+		self.assertEqual(self.beaufortInstance.decrypt('ckmpvc pvw piwu jogi', 'fortification'), 'defend the east wall')
+		self.assertEqual(self.variantInstance.decrypt('zab', 'b'), 'abc')
+
+	def test_identity(self):
+		text = 'hello there!'
+		key = 'key'
+
+		self.assertEqual(self.beaufortInstance.decrypt(self.beaufortInstance.encrypt(text, key), key), text)
+		self.assertEqual(self.variantInstance.decrypt(self.variantInstance.encrypt(text, key), key), text)
+		self.assertEqual(self.variantInstance.encrypt(self.variantInstance.decrypt(text, key), key), text)
+
+	def test_crack(self):
+		plaintext = 'cryptographyisthepracticeandstudyoftechniquesforsecurecommunicationinthepresenceofthirdpartiescalledadversariesmoregenerallyitisaboutconstructingandanalyzingprotocolsthatovercometheinfluenceofadversariesandwhicharerelatedtovariousaspectsininformationsecuritysuchasdataconfidentialitydataintegrityauthenticationandnonrepudiationmoderncryptographyintersectsthedisciplinesofmathematicscomputerscienceandelectricalengineeringmoderncryptographyisheavilybasedonmathematicaltheoryandcomputersciencepracticecryptographicalgorithmsaredesignedaroundcomputationalhardnessassumptionsmakingsuchalgorithmshardtobreakinpracticebyanyadversary'
+
+		for instance in [self.beaufortInstance, self.variantInstance]:
+			ciphertext = instance.encrypt(plaintext, 'surveil')
+			(key, _) = instance.crack(ciphertext)
+			self.assertEqual(key, 'surveil')
+			self.assertEqual(instance.decrypt(ciphertext, key), plaintext)
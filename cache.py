@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+# Cache of crack results.  The same ciphertexts keep coming through, and so do the same keys on different messages, so
+# results are kept by a hash of (scorer version, cipher, normalized ciphertext) in memory (LRU) and in sqlite on disk,
+# which is what lets several worker processes share it.  Keys are stored as python literals (repr / literal_eval, like
+# decrypt.py -k).  Keys that cracked something convincingly are also remembered per cipher, and tried before a full crack
+
+import ast
+import collections
+import hashlib
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import utils
+
+MAX_MEMORY_ENTRIES = 4096
+MAX_DISK_ENTRIES = 1000000
+MAX_KNOWN_KEYS = 16  # Per cipher, most recently successful first
+EVICT_EVERY = 256  # Writes between trimming the disk tables
+BUSY_TIMEOUT = 30.0  # Seconds to wait for another process's write
+
+# A known key is only taken (and a key only remembered) if what it decrypts to is this sure to be English (see
+# utils.plaintextConfidence), over at least this many letters.  Short texts fit plenty of wrong keys well enough, and a
+# wrong key that gets taken is cached and remembered, so it has to be well clear
+KNOWN_KEY_CONFIDENCE = 0.99
+MIN_KNOWN_KEY_LETTERS = 60
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (digest TEXT PRIMARY KEY, key TEXT, chi2 REAL, cipher TEXT, used REAL);
+CREATE INDEX IF NOT EXISTS resultsUsed ON results (used);
+CREATE TABLE IF NOT EXISTS knownKeys (cipher TEXT, key TEXT, used REAL, PRIMARY KEY (cipher, key));
+'''
+
+# Anything that changes the answer crack gives is part of the name: the class, and its settings (Lcg's parameters...)
+def cipherName(cipher):
+    settings = sorted((name, value) for (name, value) in vars(cipher).items() if name != 'workers')
+    return type(cipher).__name__ + (repr(settings) if settings else '')
+
+def normalize(cipher, ciphertext):
+    ciphertext = utils.textOf(ciphertext)
+    return ciphertext.lower() if cipher.onlyLowerCase() else ciphertext
+
+def digest(cipher, ciphertext):
+    hasher = hashlib.sha256()
+    for part in [str(utils.SCORER_VERSION), utils.EXPECTED_FREQS_FILE, cipherName(cipher), normalize(cipher, ciphertext)]:
+        hasher.update(part.encode('utf-8', errors='surrogatepass'))
+        hasher.update(b'\0')
+
+    return hasher.hexdigest()
+
+# text is prepared, and lowered if the cipher only sees lower case
+def isConvincing(cipher, text, key, chi2):
+    return sum(text.letterCounts) >= MIN_KNOWN_KEY_LETTERS and cipher.confidence(text, key, chi2) >= KNOWN_KEY_CONFIDENCE
+
+_processCaches = {}  # (path, settings...) -> this process's ResultCache for them
+
+# The one ResultCache this process has for path (and the same settings).  A pickled cache is sent with every task a
+# worker gets, so this is what keeps the worker's memory entries and its connection from one task to the next rather
+# than starting afresh (and leaving a connection open) each time.  The tables were already set up by whoever made the
+# cache that was pickled, so that isn't done again
+def processCache(path=None, maxMemoryEntries=MAX_MEMORY_ENTRIES, maxDiskEntries=MAX_DISK_ENTRIES, maxKnownKeys=MAX_KNOWN_KEYS):
+    settings = (path, maxMemoryEntries, maxDiskEntries, maxKnownKeys)
+    resultCache = _processCaches.get(settings)
+    if resultCache == None:
+        resultCache = ResultCache.__new__(ResultCache)
+        resultCache.setUp(*settings)
+        _processCaches[settings] = resultCache
+
+    return resultCache
+
+class ResultCache:
+    """path None keeps it all in memory.  Can be pickled to worker processes, where it comes back as that process's
+    cache for the same path (see processCache)"""
+
+    def __init__(self, path=None, maxMemoryEntries=MAX_MEMORY_ENTRIES, maxDiskEntries=MAX_DISK_ENTRIES, maxKnownKeys=MAX_KNOWN_KEYS):
+        self.setUp(path, maxMemoryEntries, maxDiskEntries, maxKnownKeys)
+
+        # The tables and WAL mode are set up here, once.  Switching to WAL doesn't wait for other connections like
+        # everything else does, so workers all doing it at the same time would fail
+        connection = self.connect()
+        if connection != None:
+            connection.execute('PRAGMA journal_mode=WAL')  # Readers don't wait on writers
+            connection.executescript(_SCHEMA)
+
+    def setUp(self, path, maxMemoryEntries, maxDiskEntries, maxKnownKeys):
+        self.path = path
+        self.maxMemoryEntries = maxMemoryEntries
+        self.maxDiskEntries = maxDiskEntries
+        self.maxKnownKeys = maxKnownKeys
+
+        self.memory = collections.OrderedDict()  # digest -> (key, chi2, cipher name), least recently used first
+        self.known = {}  # cipher name -> [key literal], when there's no disk
+        self.connection = None
+        self.connectionPid = None
+        self.writes = 0
+
+    def __reduce__(self):  # Only the settings go, not the entries or the connection
+        return (processCache, (self.path, self.maxMemoryEntries, self.maxDiskEntries, self.maxKnownKeys))
+
+    def connect(self):
+        if self.path == None:
+            return None
+
+        if self.connectionPid != os.getpid():  # Connections can't be shared with a forked process
+            self.connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            self.connectionPid = os.getpid()
+
+        return self.connection
+
+    def close(self):
+        if self.connection != None and self.connectionPid == os.getpid():
+            self.connection.close()
+        self.connection = None
+        self.connectionPid = None
+
+    def get(self, cipher, ciphertext):
+        """The cached (key, chi2) of cracking ciphertext with cipher, or None"""
+        entryDigest = digest(cipher, ciphertext)
+
+        entry = self.memory.get(entryDigest)
+        if entry == None:
+            connection = self.connect()
+            if connection == None:
+                return None
+
+            row = connection.execute('SELECT key, chi2, cipher FROM results WHERE digest = ?', (entryDigest,)).fetchone()
+            if row == None:
+                return None
+
+            entry = (ast.literal_eval(row[0]), row[1], row[2])
+            connection.execute('UPDATE results SET used = ? WHERE digest = ?', (time.time(), entryDigest))
+            self.remember(entryDigest, entry)
+        else:
+            self.memory.move_to_end(entryDigest)
+
+        return entry[:2]
+
+    def put(self, cipher, ciphertext, key, chi2):
+        entryDigest = digest(cipher, ciphertext)
+        entry = (key, float(chi2), cipherName(cipher))
+        self.remember(entryDigest, entry)
+
+        connection = self.connect()
+        if connection != None:
+            connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)', (entryDigest, repr(key), entry[1], entry[2], time.time()))
+            self.wrote(connection)
+
+    def remember(self, entryDigest, entry):
+        self.memory[entryDigest] = entry
+        self.memory.move_to_end(entryDigest)
+        while len(self.memory) > self.maxMemoryEntries:
+            self.memory.popitem(last=False)
+
+    def knownKeys(self, cipher):
+        """Keys that recently cracked something for this cipher, most recent first"""
+        name = cipherName(cipher)
+
+        connection = self.connect()
+        if connection == None:
+            literals = self.known.get(name, [])
+        else:
+            rows = connection.execute('SELECT key FROM knownKeys WHERE cipher = ? ORDER BY used DESC LIMIT ?', (name, self.maxKnownKeys))
+            literals = [row[0] for row in rows]
+
+        return [ast.literal_eval(literal) for literal in literals]
+
+    def rememberKey(self, cipher, key):
+        name = cipherName(cipher)
+        literal = repr(key)
+
+        connection = self.connect()
+        if connection == None:
+            literals = [literal] + [other for other in self.known.get(name, []) if other != literal]
+            self.known[name] = literals[:self.maxKnownKeys]
+        else:
+            connection.execute('INSERT OR REPLACE INTO knownKeys VALUES (?, ?, ?)', (name, literal, time.time()))
+            self.wrote(connection)
+
+    # Every so often the least recently used go, so the tables stay within their limits
+    def wrote(self, connection):
+        self.writes += 1
+        if self.writes % EVICT_EVERY != 0:
+            return
+
+        self.evict(connection)
+
+    def evict(self, connection=None):
+        if connection == None:
+            connection = self.connect()
+            if connection == None:
+                return
+
+        connection.execute('DELETE FROM results WHERE digest IN (SELECT digest FROM results ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.maxDiskEntries,))
+        connection.execute('''DELETE FROM knownKeys WHERE rowid IN (SELECT rowid FROM (SELECT rowid,
+                              ROW_NUMBER() OVER (PARTITION BY cipher ORDER BY used DESC) AS position FROM knownKeys) WHERE position > ?)''', (self.maxKnownKeys,))
+
+    def crack(self, cipher, ciphertext):
+        """cipher.crack(ciphertext), from the cache if it's been seen, or with a recently successful key if one is
+        convincing enough.  Only convincing answers of a full crack get remembered as known keys"""
+        cached = self.get(cipher, ciphertext)
+        if cached != None:
+            return cached
+
+        text = utils.prepare(ciphertext)
+        if cipher.onlyLowerCase():
+            text = text.lowered()
+
+        for key in self.knownKeys(cipher):
+            try:
+                chi2 = cipher.scoreKey(text, key, cipher.minReadRate)
+            except (ValueError, TypeError):  # The key doesn't fit this text (or cipher settings) any more
+                continue
+
+            if isConvincing(cipher, text, key, chi2):
+                self.put(cipher, ciphertext, key, chi2)
+                self.rememberKey(cipher, key)
+                return (key, chi2)
+
+        (key, chi2) = cipher.crack(text)
+        self.put(cipher, ciphertext, key, chi2)
+        if key != None and isConvincing(cipher, text, key, chi2):
+            self.rememberKey(cipher, key)
+
+        return (key, chi2)
+
+
+class CacheTest(unittest.TestCase):
+
+    def test_digest(self):
+        import affine
+        import lcg
+
+        self.assertEqual(digest(affine.Affine(), 'ABC'), digest(affine.Affine(), 'abc'))  # Affine only sees lower case
+        self.assertNotEqual(digest(affine.Affine(), 'abc'), digest(lcg.Lcg(), 'abc'))
+        self.assertNotEqual(digest(lcg.Lcg(), 'abc'), digest(lcg.Lcg(seedBits=8), 'abc'))
+
+    def test_isConvincing(self):
+        import polyalphabetic
+        import vigenere
+
+        vigenereInstance = vigenere.Vigenere()
+        text = utils.prepare(vigenereInstance.encrypt(polyalphabetic.PolyalphabeticTest.plaintext, 'lemon'))
+
+        def convincing(key):
+            return isConvincing(vigenereInstance, text, key, vigenereInstance.scoreKey(text, key))
+
+        self.assertTrue(convincing('lemon'))
+        self.assertFalse(convincing('lemoa'))
+
+    def test_resultCache(self):
+        import affine
+        import pickle
+
+        affineInstance = affine.Affine()
+        ciphertext = 'lrekmepqocpcboygywppehfiwpfzyqgdzergypwfywecyojeqcmyegfgypwfcymjyfgfmfgwpqgdzergpgffzeyciedbcgpfehfbefferqcpjeepqrodfexfwcpowpewlyetercbxgllerepfqgdzerfehfbefferyxedepxgpswpgfydwygfgwpgpfzeieyycse'
+        expected = affineInstance.crack(ciphertext)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.sqlite')
+
+            cache = ResultCache(path, maxMemoryEntries=1, maxDiskEntries=2)
+            self.assertIsNone(cache.get(affineInstance, ciphertext))
+            self.assertEqual(cache.crack(affineInstance, ciphertext), expected)
+            self.assertEqual(cache.get(affineInstance, ciphertext.upper()), expected)
+            self.assertEqual(cache.knownKeys(affineInstance), [(7,2)])
+
+            # Another process (or a pickled copy) sees the same results from disk
+            other = pickle.loads(pickle.dumps(cache))
+            self.assertEqual(len(other.memory), 0)
+            self.assertEqual(other.get(affineInstance, ciphertext), expected)
+            self.assertIs(pickle.loads(pickle.dumps(cache)), other)  # Every task a worker gets shares the one cache
+            self.assertEqual(len(other.memory), 1)
+
+            # A new message under the same key is cracked with the known key, and comes out the same as a full crack
+            message = affineInstance.encrypt('frequency analysis is not so easy when the text is short, but this is long enough for it', (7,2))
+            self.assertEqual(cache.crack(affineInstance, message), affineInstance.crack(message))
+
+            for i in range(3):
+                cache.put(affineInstance, 'text %d' % i, (1,i), 1.0)
+            self.assertEqual(len(cache.memory), 1)
+            cache.evict()
+            self.assertEqual(cache.connect().execute('SELECT COUNT(*) FROM results').fetchone()[0], 2)
+            self.assertEqual(cache.get(affineInstance, 'text 2'), ((1,2), 1.0))
+            self.assertIsNone(cache.get(affineInstance, 'text 0'))
+
+            cache.close()
+            other.close()
+
+        memoryOnly = ResultCache()
+        self.assertEqual(memoryOnly.crack(affineInstance, ciphertext), expected)
+        self.assertEqual(memoryOnly.knownKeys(affineInstance), [(7,2)])
+
+        # A short message fits the known key well enough, but not well enough to skip cracking it (or to remember)
+        memoryOnly.rememberKey(affineInstance, (5,7))
+        message = affineInstance.encrypt('hello there lets see if this works', (1,3))
+        self.assertEqual(memoryOnly.crack(affineInstance, message), affineInstance.crack(message))
+        self.assertNotIn((1,3), memoryOnly.knownKeys(affineInstance))
@@ -1,10 +1,20 @@
 #!/usr/bin/env python3
 
 from abc import ABC, abstractmethod
+import itertools
 import utils
+import triage
+
+np = utils.lazyImport('numpy')
+
+SHARDS_PER_WORKER = 4  # More shards than workers, so one slow shard doesn't leave the rest idle
+ACCEPT_BATCH_KEYS = 64  # Keys per batch when a sweep can stop early, so it isn't all one batch anyway
 
 class AbstractCipher(ABC):
 
+	minReadRate = 0.0  # See scoreKey
+	cascade = None  # A scoring.Cascade to rank the best keys again with, None to go on chi2 alone
+
 	@abstractmethod
 	def encrypt(self, plaintext, key):
 		"""Encrypts text given key"""
@@ -30,37 +40,354 @@ class AbstractCipher(ABC):
 		return True  # By default
 		"""Returns boolean, whether it can only be lower case (e.g. Vigenere), or anything (xor)"""
 
+	def isPermutation(self):
+		return False  # By default
+		"""Returns boolean, whether every key just permutes the byte alphabet (e.g. Affine, xor), see decryptTables"""
+
+	def crackRanked(self, ciphertext, top=2):
+		"""Like crack, but gives a list of up to top (key, chi2), best first.  The gap between the first two says how
+		sure the crack is.  By default there's only the one answer"""
+		return [self.crack(ciphertext)]
+
+	def isPositionIndependent(self):
+		return True  # By default
+		"""Returns boolean, whether any piece of the ciphertext can be decrypted on its own with the key (not when the key depends on the position, e.g. Vigenere)"""
+
+	def incrementalCracker(self):
+		"""Returns an IncrementalCracker, for ciphertext that arrives a chunk at a time"""
+		return IncrementalCracker(self)
+
+	def rerank(self, ciphertext, ranked, top):
+		"""ranked is [(key, chi2)] best first, which self.cascade (if there is one) orders again.  Cut down to top"""
+		if self.cascade == None:
+			return ranked[:top]
+
+		text = utils.textOf(ciphertext)
+		return self.cascade.rerank(ranked, lambda candidate: self.decrypt(text, candidate[0]))[:top]
+
+	def rankWidth(self, top):
+		"""How many keys to rank by chi2 to end up with top, the cascade needs more to choose from"""
+		return top if self.cascade == None else max(top, self.cascade.width)
+
+	def triage(self, stats):
+		"""Whether this cipher could have made a ciphertext with these TextStats, going on them alone (see triage.py).
+		Returns (verdict, reason), the reason being None or a few words on why"""
+		return (triage.POSSIBLE, None)
+
+	def scoreKey(self, ciphertext, key, minReadRate=0.0, model=None):
+		"""The chi2 crack would give key on this ciphertext.  Only brute force ciphers use minReadRate"""
+		return utils.calcChiSquared(self.decrypt(utils.textOf(ciphertext), key), model)
+
+	def confidence(self, ciphertext, key, chi2):
+		"""utils.plaintextConfidence of what key decrypts ciphertext to, 0 if there's no key (chi2 is inf, nothing was
+		readable)"""
+		if chi2 == float('inf'):
+			return 0.0
+
+		text = utils.textOf(ciphertext)
+		if self.onlyLowerCase():
+			text = text.lower()
+		return utils.plaintextConfidence(self.decrypt(text, key))
+
+	def encryptChunks(self, chunks, key):
+		"""Encrypts an iterable of chunks, yielding the output a chunk at a time.  Ciphers that carry state from one
+		char to the next (key position, PRF state...) have to override this"""
+		for chunk in chunks:
+			yield self.encrypt(chunk, key)
+
+	def decryptChunks(self, chunks, key):
+		"""Decrypts an iterable of chunks, yielding the output a chunk at a time"""
+		for chunk in chunks:
+			yield self.decrypt(chunk, key)
+
+	def decryptFile(self, infile, outfile, key, chunkSize=utils.CHUNK_SIZE):
+		"""Decrypts a binary file object (or mmap) into a binary file object, never holding more than a chunk"""
+		chunks = utils.readChunks(infile, chunkSize)
+
+		if self.onlyLowerCase():  # Text ciphers get one char per byte, so anything they don't touch comes out unchanged
+			for chunk in self.decryptChunks((chunk.lower().decode('latin-1') for chunk in chunks), key):
+				outfile.write(chunk.encode('latin-1'))
+		else:
+			for chunk in self.decryptChunks(chunks, key):
+				outfile.write(chunk)
+
 
 class AbstractBruteForceCipher(AbstractCipher):
 
+	batchCells = 1 << 22  # Upper bound on keys*length for one batched decrypt, keeps the matrix to a few MB
+	minReadRate = 0.4  # What crack uses, subclasses may be less strict
+	workers = 1  # How many processes bruteForce splits the keys between
+	halving = False  # Whether keys are weeded out on ever longer prefixes first, see rankHalving
+	halvingPrefix = 64  # Chars the first round of halving scores on
+	acceptConfidence = None  # Stop trying keys once one is at least this sure (see confidence), None tries them all
+
 	def bruteForce(self, ciphertext, minReadRate=0.4):
 		"""Brute forces all the keys provided by SubClass.  minReadRate enforces minimum rate of readable chars"""
 
-		bestKey = None
-		lowestChi2 = 100000
+		ranked = self.bruteForceRanked(ciphertext, minReadRate, 1)
+		if len(ranked) == 0:
+			return (None, float('inf'))  # Nothing was readable
 
-		if self.onlyLowerCase():
-			ciphertext = ciphertext.lower()
+		return ranked[0]
+
+	def bruteForceRanked(self, ciphertext, minReadRate=0.4, top=2, histogram=None, workers=None):
+		"""Same as bruteForce, but returns the top best (key, chi2), best first.  Ties go to whichever key genKeys gave first.
+		Permutation ciphers can be given the (lowercased) ciphertext's histogram instead of the ciphertext.  With more
+		than one worker (self.workers by default) the keys are split into shards, see rankShards.  With a cascade the
+		best are ranked again (not from just a histogram though), see rerank"""
+
+		if workers == None:
+			workers = self.workers
+
+		if histogram is None:
+			ciphertext = utils.prepare(ciphertext)  # Every batch of keys then works from the same codes and counts
+			if self.onlyLowerCase():
+				ciphertext = ciphertext.lowered()
+
+			if self.isPermutation():  # Counting once is all we need, every key is then scored from the histogram
+				histogram = ciphertext.histogram
+
+		if workers > 1:
+			import multiprocessing  # Here rather than at the top, it's slow to import and most runs don't need it
+			if multiprocessing.current_process().daemon:  # Pool workers can't start pools of their own
+				workers = 1
+
+		width = top if ciphertext is None else self.rankWidth(top)  # Only the histogram, so there's nothing to rerank
+		if workers > 1:
+			best = self.rankShards(ciphertext, minReadRate, width, histogram, workers)
+		else:
+			best = self.rankKeyRange(ciphertext, minReadRate, width, histogram)
+
+		ranked = [(key, chi2) for (chi2, _, key) in best]
+		return ranked if ciphertext is None else self.rerank(ciphertext, ranked, top)
+
+	def rankKeyRange(self, ciphertext, minReadRate=0.4, top=2, histogram=None, start=0, end=None):
+		"""The top (chi2, index in genKeys, key) out of the keys from index start up to end (None for all of them).  With
+		acceptConfidence, it stops after the first batch where the best so far is sure enough"""
+
+		if ciphertext is not None:
+			ciphertext = utils.prepare(ciphertext)
+			if self.halving and histogram is None and not self.isPermutation() and len(ciphertext) > self.halvingPrefix:
+				return self.rankHalving(ciphertext, minReadRate, top, start, end)
+
+		best = []
+		accepting = self.acceptConfidence != None and ciphertext is not None  # Only the histogram, it's one batch anyway
+		checked = None  # The best so far that wasn't sure enough, so it isn't decrypted again
+
+		keys = iter(self.genKeyRange(start, end))  # genKeys and decrypt (or decryptBatch/decryptTables) are the subclass functions
+		batchSize = self.keyBatchSize(ciphertext)
+		if accepting:
+			batchSize = min(batchSize, ACCEPT_BATCH_KEYS)
+
+		index = start
+		while True:
+			batch = list(itertools.islice(keys, batchSize))
+			if len(batch) == 0:
+				break
+
+			scores = np.asarray(self.scoreKeys(ciphertext, batch, minReadRate, histogram), dtype=np.float64)
+			for i in np.argsort(scores, kind='stable')[:top]:  # Only this batch's top few can make the overall top
+				if scores[i] < float('inf'):
+					best.append((float(scores[i]), index+int(i), batch[i]))
+
+			best = sorted(best, key=lambda candidate: candidate[:2])[:top]
+			index += len(batch)
 
-		for key in self.genKeys():  # genKeys and decrypt are the subclass functions
+			if accepting and len(best) > 0 and best[0] != checked:
+				(chi2, _, key) = best[0]
+				if self.confidence(ciphertext, key, chi2) >= self.acceptConfidence:
+					break
+				checked = best[0]
 
-			maybePlaintext = self.decrypt(ciphertext,key)
+		return best
 
-			if minReadRate > 0.0:
-				readPerc = len([c for c in maybePlaintext if utils.isAlpha(c)]) / len(maybePlaintext)
-				if readPerc < minReadRate:
-					continue
+	# Successive halving.  Every key is scored on the first halvingPrefix chars, the worse half dropped (and anything
+	# below minReadRate on them), and what's left scored on twice as many chars, until there are only top keys left or
+	# the prefix is the whole text.  The survivors are then scored on the whole text, so the chi2s are the same as
+	# rankKeyRange gives.  Each round costs about as much as the first, so that's log2(length/halvingPrefix) rounds of
+	# halvingPrefix chars per key instead of the whole text per key.  The right key could in theory be dropped on a prefix
+	# that reads badly, but a wrong key beating it on even a few dozen chars is very rare.  Decrypting a prefix has to
+	# give the plaintext's prefix, which it does for every brute force cipher here
+	def rankHalving(self, ciphertext, minReadRate, top, start=0, end=None):
+		keys = list(self.genKeyRange(start, end))
+		indices = np.arange(start, start+len(keys))
+		length = self.halvingPrefix
 
-			chi2 = utils.calcChiSquared(maybePlaintext)
+		while len(keys) > top and length < len(ciphertext):
+			scores = self.scoreKeysBatched(utils.prepare(ciphertext.text[:length]), keys, minReadRate)
+			order = np.lexsort((indices, scores))  # Ties go to the earlier key, like everywhere else
+			order = order[scores[order] < np.inf]
+			order = order[:max(top, (len(order)+1)//2)]
 
-			if chi2 < lowestChi2:
-				bestKey = key 
-				lowestChi2 = chi2
+			keys = [keys[i] for i in order]
+			indices = indices[order]
+			length *= 2
 
-		#print(utils.calcTrigraphFitness(self.decrypt(ciphertext, bestKey)))		
+		scores = self.scoreKeysBatched(ciphertext, keys, minReadRate)
+		best = [(float(scores[i]), int(indices[i]), keys[i]) for i in range(len(keys)) if scores[i] < float('inf')]
+		return sorted(best, key=lambda candidate: candidate[:2])[:top]
 
-		return (bestKey, lowestChi2)
+	def scoreKeysBatched(self, ciphertext, keys, minReadRate):
+		"""scoreKeys on any number of keys, keyBatchSize at a time.  Gives a float64 array"""
+		batchSize = self.keyBatchSize(ciphertext)
+		scores = [np.asarray(self.scoreKeys(ciphertext, keys[i:i+batchSize], minReadRate), dtype=np.float64) for i in range(0, len(keys), batchSize)]
+		return np.concatenate(scores) if scores else np.zeros(0)
+
+	# The keys are cut into contiguous shards by genKeys index, each shard is ranked in a worker process and the shard
+	# tops merged.  Ties are broken on the genKeys index just like in one process, so the answer is the same whatever
+	# the number of workers.  The ciphertext goes into shared memory once rather than being pickled for every shard
+	# (permutation ciphers only need the histogram, which is tiny)
+	def rankShards(self, ciphertext, minReadRate, top, histogram, workers):
+		import multiprocessing
+		from multiprocessing import shared_memory
+
+		numKeys = self.countKeys()
+		numShards = max(1, min(numKeys, workers*SHARDS_PER_WORKER))
+		bounds = [numKeys*i//numShards for i in range(numShards+1)]
+
+		memory = None
+		length = 0
+		if histogram is None:
+			encoded = utils.textOf(ciphertext).encode('utf-8')
+			length = len(encoded)
+			memory = shared_memory.SharedMemory(create=True, size=max(1, length))
+			memory.buf[:length] = encoded
+
+		try:
+			memoryName = None if memory is None else memory.name
+			tasks = [(self, memoryName, length, minReadRate, top, histogram, bounds[i], bounds[i+1]) for i in range(numShards)]
+			with multiprocessing.Pool(min(workers, numShards)) as pool:
+				shards = pool.starmap(_rankShard, tasks)
+		finally:
+			if memory is not None:
+				memory.close()
+				memory.unlink()
+
+		return sorted(itertools.chain.from_iterable(shards), key=lambda candidate: candidate[:2])[:top]
+
+	def crackRanked(self, ciphertext, top=2):
+		return self.bruteForceRanked(ciphertext, self.minReadRate, top)
+
+	def incrementalCracker(self):
+		if self.isPermutation() and self.cascade == None:  # A cascade needs the text
+			return HistogramCracker(self)
+		return IncrementalCracker(self)
+
+	def keyBatchSize(self, ciphertext):
+		"""How many keys scoreKeys gets at a time"""
+		if self.isPermutation():
+			return max(1, self.batchCells // 256)
+		return max(1, self.batchCells // max(1, len(ciphertext)))
+
+	def scoreKeys(self, ciphertext, keys, minReadRate=0.4, histogram=None):
+		"""Returns the chi-squared of decrypting with each key, inf if the result is below minReadRate"""
+		if self.isPermutation():
+			if histogram == None:
+				histogram = utils.prepare(ciphertext).histogram
+			return utils.calcChiSquaredFromTables(histogram, self.decryptTables(keys), minReadRate).tolist()
+
+		prepared = utils.prepare(ciphertext)
+		codes = prepared.codes
+		if codes is not None and len(codes) > 0:
+			plaintexts = self.decryptBatch(codes, keys)
+			if plaintexts is not None:
+				return utils.calcChiSquaredMany(plaintexts, minReadRate).tolist()
+
+		model = utils.getLanguageModel()
+		return [self.scoreKey(prepared.text, key, minReadRate, model) for key in keys]
+
+	def scoreKey(self, ciphertext, key, minReadRate=0.4, model=None):
+		maybePlaintext = self.decrypt(utils.textOf(ciphertext), key)
+
+		if minReadRate > 0.0:
+			readPerc = len([c for c in maybePlaintext if utils.isAlpha(c)]) / len(maybePlaintext)
+			if readPerc < minReadRate:
+				return float('inf')
+
+		return utils.calcChiSquared(maybePlaintext, model)
+
+	def decryptTables(self, keys):
+		"""Only needed if isPermutation.  Gives a (keys x 256) uint8 matrix mapping each ciphertext byte to its plaintext byte"""
+		return None
+
+	def decryptBatch(self, codes, keys):
+		"""Optional.  Decrypts a uint8 array of char codes with every key at once, giving a (keys x length) uint8 matrix.  None means not supported"""
+		return None
 
 	@abstractmethod
 	def genKeys(self):
 		"""Generates all possible keys to be tried"""
+
+	def genKeyRange(self, start, end=None):
+		"""The keys genKeys gives from index start up to end.  This default walks through every key before start, so a
+		shard far into the keys pays for all the ones before it.  Subclasses that can jump straight there should"""
+		return itertools.islice(self.genKeys(), start, end)
+
+	def countKeys(self):
+		"""How many keys genKeys gives"""
+		return sum(1 for _ in self.genKeys())
+
+
+# One shard of rankShards, in a worker process.  The ciphertext is read straight out of the shared memory
+def _rankShard(cipher, memoryName, length, minReadRate, top, histogram, start, end):
+	from multiprocessing import shared_memory
+
+	ciphertext = None
+	if memoryName != None:
+		memory = shared_memory.SharedMemory(name=memoryName)
+		try:
+			ciphertext = utils.prepare(bytes(memory.buf[:length]).decode('utf-8'))
+		finally:
+			memory.close()
+
+	return cipher.rankKeyRange(ciphertext, minReadRate, top, histogram, start, end)
+
+
+class IncrementalCracker:
+	"""Cracks ciphertext that arrives a chunk at a time.  feed it the chunks (str or bytes) as they come, and best()
+	is the same (key, chi2) that crack would give on everything fed so far.  This one just keeps the text and cracks
+	it all again, ciphers that can keep running statistics instead have their own (see incrementalCracker)"""
+
+	def __init__(self, cipher):
+		self.cipher = cipher
+		self.chunks = []
+
+	def feed(self, chunk):
+		if not isinstance(chunk, str):
+			chunk = bytes(chunk).decode('latin-1')  # One char per byte, like decryptFile
+		self.update(chunk)
+
+	def update(self, text):
+		"""Takes in the next piece of ciphertext, always a str"""
+		self.chunks.append(text)
+
+	def best(self):
+		ranked = self.bestRanked(1)
+		if len(ranked) == 0:
+			return (None, float('inf'))  # Like bruteForce when nothing is readable
+
+		return ranked[0]
+
+	def bestRanked(self, top=2):
+		"""Same as the cipher's crackRanked on everything fed so far"""
+		return self.cipher.crackRanked(''.join(self.chunks), top)
+
+
+class HistogramCracker(IncrementalCracker):
+	"""For permutation ciphers the byte histogram is all the brute force looks at, so that's all that's kept"""
+
+	def __init__(self, cipher):
+		super().__init__(cipher)
+		self.histogram = np.zeros(256, dtype=np.int64)
+		self.length = 0
+
+	def update(self, text):
+		if self.cipher.onlyLowerCase():
+			text = text.lower()
+
+		(histogram, length) = utils.calcHistogram(text)
+		self.histogram += histogram
+		self.length += length
+
+	def bestRanked(self, top=2):
+		return self.cipher.bruteForceRanked(None, self.cipher.minReadRate, top, (self.histogram, self.length))
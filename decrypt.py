@@ -1,8 +1,6 @@
 #!/usr/bin/env python3
 
 # TODO
-# Beaufort
-# XOR, RC4, Stream in general
 # Playfair
 # Monoalphabetic
 # Transposition
@@ -12,67 +10,302 @@
 import sys
 import getopt
 import unittest
+import ast
+import contextlib
+import mmap
+import os
+import io
+import tempfile
+import random
+import time
+import json
+import functools
+import importlib
+import subprocess
+import logging
+import math
 
-import nothing
-import affine
-import vigenere
-import xor
+import utils
+import sampling
+import triage
 
  # Would be cool to dynamically update this list
-ciphers = [
-            nothing.Nothing()
-          , affine.Affine()
-          , vigenere.Vigenere()
-          , xor.Xor()  # Ok, I have a real problem.  If it can xor such that none of the characters are valid, then really low chi...
+# Every cipher as module.Class, its name (for -n) is the class name in lower case.  A cipher's module is only imported
+# the first time it's used (see loadCipher), so -h or a decrypt with a known key don't wait for all of them
+CIPHERS = [
+            'nothing.Nothing'
+          , 'affine.Affine'
+          , 'vigenere.Vigenere'
+          , 'beaufort.Beaufort'  # VariantBeaufort isn't listed, it's just Vigenere with the key negated
+          , 'xor.Xor'  # Ok, I have a real problem.  If it can xor such that none of the characters are valid, then really low chi...
           ] 
 
+# Only cracked with -x, every crack would otherwise sweep 65536 LCG seeds and 256 RC4 keystreams made in python.  They
+# can always be used by name (-n)
+SLOW_CIPHERS = [
+                 'rc4.Rc4'
+               , 'lcg.Lcg'
+               ]
+
+_crackSlowCiphers = False  # See useSlowCiphers
+
+_cipherInstances = {}  # module.Class -> the one instance of it
+
+REFERENCE_SIZE = 16384  # How much of the start is used to compare ciphers in findCipherBySampling
+BATCH_CHUNK_SIZE = 16  # Messages handed to a batch worker at a time, they're usually short
+
 def main(argv):
-    ciphertext = ''
+    ciphertext = None
+    filename = None
+    cipherName = None
+    key = None
+    sample = False
+    batch = False
+    keepOrder = False
+    address = None
+    resultCache = None
+    exhaustive = False
+    workers = None
+    budget = None
+    budgets = {}
 
-    if (len(argv) < 2):
+    if (len(argv) < 2 and sys.stdin.isatty()):
         usage()
         sys.exit(2)
 
     try:
-        opts, args = getopt.getopt(argv,"hc:")
+        opts, args = getopt.getopt(argv,"hc:f:n:k:sp:t:j:bor:C:evS:Ha:x")
     except getopt.GetoptError as err:
         print(err)
         usage()
         sys.exit(2)
 
+    if any(opt == '-x' for (opt, _) in opts):  # Before the options below that set up every cipher
+        useSlowCiphers()
+
     for opt, arg in opts:
         if opt == '-h':
             usage()
             sys.exit()
         elif opt == '-c':
             ciphertext = arg
+        elif opt == '-f':
+            filename = arg
+        elif opt == '-n':
+            cipherName = arg
+        elif opt == '-k':
+            key = parseKey(arg)
+        elif opt == '-s':
+            sample = True
+        elif opt == '-b':
+            batch = True
+        elif opt == '-o':
+            keepOrder = True
+        elif opt == '-r':
+            address = arg
+        elif opt == '-e':  # Crack with every cipher, even the ones triage rules out
+            exhaustive = True
+        elif opt == '-v':  # Triage's decisions (and anything else logged) go to stderr
+            logging.basicConfig(level=logging.INFO, format='%(message)s')
+        elif opt == '-S':  # Scorers to rank the best keys by chi2 again with, see scoring.py
+            import scoring
+            try:
+                cascade = scoring.makeCascade(arg)
+            except ValueError as err:
+                print(err)
+                usage()
+                sys.exit(2)
+            for cipher in allCiphers():
+                cipher.cascade = cascade
+        elif opt == '-C':
+            import cache
+            resultCache = cache.ResultCache(arg)
+        elif opt == '-p':
+            workers = optionValue(opt, arg, parseWorkers)
+        elif opt == '-j':  # Brute force ciphers split their keys between this many processes
+            cipherWorkers = optionValue(opt, arg, parseWorkers)
+            for cipher in allCiphers():
+                cipher.workers = cipherWorkers
+        elif opt == '-H':  # Brute force ciphers weed keys out on short prefixes first, see rankHalving
+            for cipher in allCiphers():
+                cipher.halving = True
+        elif opt == '-a':  # Brute force ciphers stop at the first key this sure, see AbstractCipher.confidence
+            acceptConfidence = optionValue(opt, arg, float)
+            for cipher in allCiphers():
+                cipher.acceptConfidence = acceptConfidence
+        elif opt == '-t':  # Either seconds for every cipher, or cipher=seconds for just that one
+            name, _, seconds = arg.rpartition('=')
+            if name:
+                budgets[name.lower()] = optionValue(opt, seconds, parseSeconds)
+            else:
+                budget = optionValue(opt, seconds, parseSeconds)
+
+    if address != None:  # The service does the work, see service.py
+        if ciphertext == None:
+            with openInput(filename) as infile:
+                ciphertext = infile.read().decode('latin-1')
+        sys.exit(remoteDecrypt(address, ciphertext, cipherName, key))
+
+    if key != None:  # Known key, so it's just streamed through the cipher
+        cipher = findCipher(cipherName)
+        if cipher == None:
+            print('Need a known cipher (-n) to decrypt with a key')
+            usage()
+            sys.exit(2)
 
-    findCipherAndDecrypt(ciphertext)
+        if ciphertext != None:
+            print(cipher.decrypt(ciphertext.lower() if cipher.onlyLowerCase() else ciphertext, key))
+        else:
+            with openInput(filename) as infile:
+                cipher.decryptFile(infile, sys.stdout.buffer, key)
+        return
+
+    if batch:  # Every line is its own ciphertext, spread over all the cores unless told otherwise
+        with openInput(filename) as infile:
+            batchDecrypt(infile, sys.stdout, workers if workers != None else os.cpu_count(), keepOrder, resultCache, exhaustive)
+        return
+
+    if sample and ciphertext == None:  # Only a sample is cracked, then the whole input is streamed through the winner
+        with openInput(filename) as infile:
+            data = infile if isinstance(infile, mmap.mmap) else infile.read()
+            (bestCipher, bestKey, _) = findCipherBySampling(data)
+
+            print('Decrypted text:')
+            sys.stdout.flush()
+            bestCipher.decryptFile(io.BytesIO(data) if isinstance(data, bytes) else data, sys.stdout.buffer, bestKey)
+        return
+
+    if ciphertext == None:
+        with openInput(filename) as infile:
+            ciphertext = infile.read().decode('latin-1')
+
+    (_, bestCipher, _, _) = findCipherAndDecrypt(ciphertext, workers if workers != None else 1, budget, budgets, resultCache, exhaustive)
+    if bestCipher == None:
+        sys.exit(1)
 
 def usage():
     print('Usage: ./decrypt.py -c <ciphertext>')
+    print('       ./decrypt.py -f <file>                       (stdin if the file is - or left out)')
+    print('       ./decrypt.py -s [-f <file>]                  (cracks on a sample, for big inputs)')
+    print('       ./decrypt.py -n <cipher> -k <key> [-f <file> | -c <ciphertext>]')
+    print('       ./decrypt.py -p <workers | all> [-t <seconds> | -t <cipher>=<seconds>]... [-f <file> | -c <ciphertext>]')
+    print('                                                    (cracks the ciphers in parallel, any over its budget is given up on)')
+    print('       ./decrypt.py -j <workers | all> ...               (brute force ciphers split their keys between processes)')
+    print('       ./decrypt.py -H ...                               (brute force ciphers halve the keys on longer and longer prefixes)')
+    print('       ./decrypt.py -a <confidence> ...                  (brute force ciphers stop at the first key that sure, 0.99 say)')
+    print('       ./decrypt.py -b [-o] [-p <workers>] [-f <file>]  (a ciphertext per line, or JSON {"id": ..., "ciphertext": ...},')
+    print('                                                    out as JSON lines as they finish, -o for input order)')
+    print('       ./decrypt.py -C <cache file> ...                  (reuses results, and keys that worked before, see cache.py)')
+    print('       ./decrypt.py -e ...                               (cracks with every cipher, none are ruled out by triage.py)')
+    print('       ./decrypt.py -x ...                               (cracks with the slow ciphers too, %s)' % ', '.join(cipherNames(SLOW_CIPHERS)))
+    print('       ./decrypt.py -v ...                               (logs why ciphers were ruled out or tried first)')
+    print('       ./decrypt.py -S <scorer>[,<scorer>]... ...        (ranks the best keys by chi2 again with words or trigrams)')
+    print('       ./decrypt.py -r <address> [-n <cipher> -k <key>] [-f <file> | -c <ciphertext>]')
+    print('                                                    (has a running ./service.py do it)')
+    print('Ciphers are: %s' % ', '.join(cipherNames()))
 
-# Eventually, I'll have to do something in case the entered text is all caps^^^
-# Unit test...^^^
-def findCipherAndDecrypt(ciphertext):
+# An option's value through parse, or the usage and out if it doesn't parse
+def optionValue(opt, arg, parse):
+    try:
+        return parse(arg)
+    except ValueError as err:
+        print('Bad value for %s: %s (%s)' % (opt, arg, err))
+        usage()
+        sys.exit(2)
+
+# -p and -j: how many processes, or all for one per core
+def parseWorkers(arg):
+    workers = os.cpu_count() if arg == 'all' else int(arg)
+    if workers < 1:
+        raise ValueError('need at least one worker')
+    return workers
+
+def parseSeconds(arg):
+    seconds = float(arg)
+    if not seconds >= 0:
+        raise ValueError("can't be negative")
+    return seconds
+
+# Keys are python literals ((5,8), 42, b'\x9c'), anything that isn't one is taken as a string
+def parseKey(arg):
+    try:
+        return ast.literal_eval(arg)
+    except (ValueError, SyntaxError):
+        return arg
+
+def cipherNames(paths=CIPHERS+SLOW_CIPHERS):
+    return [path.rpartition('.')[2].lower() for path in paths]
+
+# Whether the SLOW_CIPHERS get cracked too (-x)
+def useSlowCiphers(use=True):
+    global _crackSlowCiphers
+    _crackSlowCiphers = use
+
+def loadCipher(path):
+    instance = _cipherInstances.get(path)
+    if instance == None:
+        (moduleName, _, className) = path.rpartition('.')
+        instance = getattr(importlib.import_module(moduleName), className)()
+        _cipherInstances[path] = instance
+
+    return instance
+
+# Every cipher that gets cracked, in the order of CIPHERS (then SLOW_CIPHERS with -x)
+def allCiphers():
+    return [loadCipher(path) for path in CIPHERS + (SLOW_CIPHERS if _crackSlowCiphers else [])]
+
+def findCipher(name):
+    if name == None:
+        return None
+
+    for path, cipherName in zip(CIPHERS+SLOW_CIPHERS, cipherNames()):
+        if cipherName == name.lower():
+            return loadCipher(path)
 
-    lowestChi2 = 100000
+    return None
+
+# Binary input, memory mapped when it's a regular file so big files don't have to be read in
+@contextlib.contextmanager
+def openInput(filename):
+    if filename == None or filename == '-':
+        yield sys.stdin.buffer
+        return
+
+    with open(filename, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):  # Empty files and pipes can't be mapped
+            yield f
+            return
+
+        with mapped:
+            yield mapped
+
+# Same idea as findCipherAndDecrypt, for inputs too big to crack (or even hold) in full.  data is a str, bytes or mmap.
+# Each cipher is cracked on a sample, and they're compared on how well they decrypt the start of the input
+def findCipherBySampling(data):
+
+    lowestChi2 = math.inf
     bestCipher = None
     bestKey = None
 
-    print('Decrypting: %s' % ciphertext)
+    reference = sampling.takeSample(data, REFERENCE_SIZE, False)  # Any cipher can decrypt from the start
+
+    print('Decrypting a sample of %d chars (out of %d)' % (len(reference), len(data)))
 
-    print('------------------------------------------------------------------------')
-    print('Type of Cipher                | Key                  | Chi-Squared Value')
-    print('------------------------------------------------------------------------')
+    print('-------------------------------------------------------------------------------------')
+    print('Type of Cipher                | Key                  | Chi-Squared Value | Confidence')
+    print('-------------------------------------------------------------------------------------')
 
-    for cipher in ciphers:
-        processedCiphertext = ciphertext
-        if cipher.onlyLowerCase:  # Can't handle both lower and upper
-            processedCiphertext = processedCiphertext.lower()
+    for cipher in allCiphers():
+        (key, chi2, _) = sampling.sampleCrack(cipher, data)
 
-        key, chi2 = cipher.crack(processedCiphertext)
-        print('%-30s| %-21s| %.4f' % (cipher.getNameOfCipher(key), str(key), chi2))
+        if chi2 < math.inf:  # Otherwise there's no key to decrypt with
+            processedReference = reference.lower() if cipher.onlyLowerCase() else reference
+            chi2 = utils.calcChiSquared(cipher.decrypt(processedReference, key))
+
+        confidence = cipher.confidence(reference, key, chi2)
+        print('%-30s| %-21s| %-18.4f| %.3f' % (cipher.getNameOfCipher(key), str(key), chi2, confidence))
 
         if (chi2 < lowestChi2):
             lowestChi2 = chi2
@@ -80,19 +313,228 @@ def findCipherAndDecrypt(ciphertext):
             bestKey = key 
 
     print('\n')
+    print('----------')
+    print('Best cipher was: %s' % bestCipher.getNameOfCipher(bestKey))
+
+    return (bestCipher, bestKey, lowestChi2)
+
+def crackCipher(cipher, ciphertext, resultCache=None):
+    if resultCache != None:
+        return resultCache.crack(cipher, ciphertext)
+
+    ciphertext = utils.prepare(ciphertext)  # Already done if it came from crackAll
+    if cipher.onlyLowerCase():  # Can't handle both lower and upper
+        ciphertext = ciphertext.lowered()
+
+    return cipher.crack(ciphertext)
+
+# Gives the (key, chi2) of every cipher, in the same order as ciphers.  Ciphers that triage rules out (see triage.py,
+# verdicts are what triage.triage gave if it's already been done) aren't cracked and come back as None, the likely ones
+# are cracked first.  With more than one worker they're cracked in a process pool, and any cipher still going after its
+# budget (seconds, from budgets by name or else budget) is killed and comes back as None too.  Budgets are counted from
+# when everything's handed out, so with fewer workers than ciphers the wait for a worker counts too
+def crackAll(ciphertext, workers=1, budget=None, budgets=None, resultCache=None, exhaustive=False, verdicts=None):
+    ciphers = allCiphers()
+    prepared = utils.prepare(ciphertext)  # The one pass over the text, triage and every cipher share it
+    if verdicts == None:
+        verdicts = triage.triage(ciphers, prepared, exhaustive)
+    order = triage.crackOrder(verdicts)
+
+    results = [None]*len(ciphers)
+    if workers <= 1:
+        for i in order:
+            results[i] = crackCipher(ciphers[i], prepared, resultCache)
+        return results
+
+    if budgets == None:
+        budgets = {}
+    deadlines = [budgets.get(type(cipher).__name__.lower(), budget) for cipher in ciphers]
+    deadlines = [float('inf') if seconds == None else seconds for seconds in deadlines]
+
+    import multiprocessing  # Slow to import, and only needed here
+
+    pool = multiprocessing.Pool(min(workers, len(order)))
+    try:
+        start = time.monotonic()
+        pending = {i: pool.apply_async(crackCipher, (ciphers[i], ciphertext, resultCache)) for i in order}
+
+        for i in sorted(order, key=lambda i: deadlines[i]):  # Soonest deadline first, the rest keep running meanwhile
+            remaining = start + deadlines[i] - time.monotonic()
+            try:
+                results[i] = pending[i].get(None if remaining == float('inf') else max(0.0, remaining))
+            except multiprocessing.TimeoutError:
+                pass
+    finally:
+        pool.terminate()  # Everything left is over its budget
+        pool.join()
+
+    return results
+
+# (bestCipher, bestKey, lowestChi2) out of crackAll's results, ties go to the first cipher.  Given the ciphertext, and
+# ciphers with a cascade (-S), each cipher's winner is ranked again by it too, so chi2 alone doesn't pick between them.
+# bestCipher is None if no cipher found a readable key (or they all timed out)
+def pickBest(results, ciphertext=None):
+    lowestChi2 = math.inf
+    bestCipher = None
+    bestKey = None
+
+    for cipher, result in zip(allCiphers(), results):
+        if result != None and result[1] < lowestChi2:
+            lowestChi2 = result[1]
+            bestCipher = cipher
+            bestKey = result[0]
+
+    cascade = allCiphers()[0].cascade
+    if ciphertext != None and cascade != None and bestCipher != None:
+        candidates = sorted([(cipher,) + tuple(result) for cipher, result in zip(allCiphers(), results) if result != None],
+                            key=lambda candidate: candidate[2])  # Stable, so ties still go to the first cipher
+        (bestCipher, bestKey, lowestChi2) = cascade.rerank(candidates, lambda candidate: decryptWith(candidate[0], ciphertext, candidate[1]))[0]
 
-    processedCiphertext = ciphertext
-    if cipher.onlyLowerCase:  # Can't handle both lower and upper
-        processedCiphertext = processedCiphertext.lower()
+    return (bestCipher, bestKey, lowestChi2)
 
-    plaintext = bestCipher.decrypt(processedCiphertext, bestKey)
+def decryptWith(cipher, ciphertext, key):
+    if cipher.onlyLowerCase():  # Can't handle both lower and upper
+        ciphertext = ciphertext.lower()
+
+    return cipher.decrypt(ciphertext, key)
+
+# Eventually, I'll have to do something in case the entered text is all caps^^^
+# Unit test...^^^
+def findCipherAndDecrypt(ciphertext, workers=1, budget=None, budgets=None, resultCache=None, exhaustive=False):
+
+    print('Decrypting: %s' % ciphertext)
+
+    print('-------------------------------------------------------------------------------------')
+    print('Type of Cipher                | Key                  | Chi-Squared Value | Confidence')
+    print('-------------------------------------------------------------------------------------')
+
+    # Printed once they're all back, so the table is the same whichever finished first
+    verdicts = triage.triage(allCiphers(), ciphertext, exhaustive)
+    results = crackAll(ciphertext, workers, budget, budgets, resultCache, exhaustive, verdicts)
+    for (cipher, verdict, reason), result in zip(verdicts, results):
+        if verdict == triage.RULED_OUT:
+            print('%-30s| %-21s| %s' % (cipher.getNameOfCipher(), 'None', 'Ruled out, %s' % reason))
+            continue
+        if result == None:
+            print('%-30s| %-21s| %s' % (cipher.getNameOfCipher(), 'None', 'Timed out'))
+            continue
+
+        key, chi2 = result
+        print('%-30s| %-21s| %-18.4f| %.3f' % (cipher.getNameOfCipher(key), str(key), chi2, cipher.confidence(ciphertext, key, chi2)))
+
+    (bestCipher, bestKey, lowestChi2) = pickBest(results, ciphertext)
+
+    print('\n')
+
+    if bestCipher == None:
+        cracked = [(cipher, result) for (cipher, verdict, _), result in zip(verdicts, results) if verdict != triage.RULED_OUT]
+        timedOut = [cipher.getNameOfCipher() for (cipher, result) in cracked if result == None]
+        if len(timedOut) == len(cracked):
+            print('No cipher finished within its budget (timed out: %s)' % ', '.join(timedOut))
+        elif timedOut:
+            print('No cipher found a readable key (timed out: %s)' % ', '.join(timedOut))
+        else:
+            print('No cipher found a readable key')
+        return (None, None, None, lowestChi2)
+
+    plaintext = decryptWith(bestCipher, ciphertext, bestKey)
     print('----------')
     print('Best cipher was: %s' % bestCipher.getNameOfCipher(bestKey))
+    print('Confidence: %.3f' % bestCipher.confidence(ciphertext, bestKey, lowestChi2))
     print('Decrypted text:')
     print(plaintext)
 
     return (plaintext, bestCipher, bestKey, lowestChi2)
 
+# Client mode: sends the ciphertext to the service at address to be cracked (or just decrypted when the key is known).
+# Returns the exit code
+def remoteDecrypt(address, ciphertext, cipherName=None, key=None):
+    import service  # Only the client needs it
+
+    if key != None:
+        request = {'op': 'decrypt', 'ciphertext': ciphertext, 'cipher': cipherName, 'key': repr(key)}
+    else:
+        request = {'op': 'crack', 'ciphertext': ciphertext}
+
+    response = service.requestService(address, request)
+    if 'error' in response:
+        print('Error from service: %s' % response['error'])
+        return 1
+
+    if key == None:
+        if response['cipher'] == None:
+            print('No cipher found a readable key')
+            return 1
+        print('Best cipher was: %s' % response['cipher'])
+        print('Key: %s' % response['key'])
+        print('Confidence: %.3f' % response['confidence'])
+        print('Decrypted text:')
+    print(response['plaintext'])
+    return 0
+
+# A line is either JSON with an id and ciphertext, or just the ciphertext (its line number is the id).  Ciphertext
+# lines are decoded like everywhere else (a char per byte) unless they're UTF-8.  Blank lines are skipped
+def readRecords(infile):
+    for lineNumber, line in enumerate(iter(infile.readline, b''), 1):
+        line = line.rstrip(b'\r\n')
+        if len(line) == 0:
+            continue
+
+        if line.startswith(b'{'):
+            try:
+                record = json.loads(line)
+                yield (record.get('id', lineNumber), record['ciphertext'])
+                continue
+            except (ValueError, KeyError):
+                pass  # Just happens to start with a brace
+
+        try:
+            yield (lineNumber, line.decode('utf-8'))
+        except UnicodeDecodeError:
+            yield (lineNumber, line.decode('latin-1'))
+
+# Runs in a batch worker.  Keys are written as python literals, the same as -k takes.  A record that can't be cracked
+# (its JSON ciphertext isn't a string) gets an error result like the service's, the rest of the batch carries on
+def crackRecord(record, resultCache=None, exhaustive=False):
+    (recordId, ciphertext) = record
+    if not isinstance(ciphertext, str):
+        return {'id': recordId, 'error': 'TypeError: ciphertext has to be a string, not %s' % type(ciphertext).__name__}
+
+    start = time.perf_counter()
+
+    (bestCipher, bestKey, lowestChi2) = pickBest(crackAll(ciphertext, resultCache=resultCache, exhaustive=exhaustive), ciphertext)
+    if bestCipher == None:  # No cipher found a readable key
+        return {'id': recordId, 'cipher': None, 'key': None, 'chi2': None, 'confidence': 0.0, 'plaintext': None,
+                'seconds': round(time.perf_counter()-start, 6)}
+    plaintext = decryptWith(bestCipher, ciphertext, bestKey)
+
+    return { 'id': recordId
+           , 'cipher': bestCipher.getNameOfCipher(bestKey)
+           , 'key': None if bestKey == None else repr(bestKey)
+           , 'chi2': lowestChi2
+           , 'confidence': bestCipher.confidence(ciphertext, bestKey, lowestChi2)
+           , 'plaintext': plaintext
+           , 'seconds': round(time.perf_counter()-start, 6)
+           }
+
+# Cracks every record of infile (binary, see readRecords) in a pool of workers, writing a JSON line per result to
+# outfile (text) as each one finishes, or in the order they came in with keepOrder
+def batchDecrypt(infile, outfile, workers=1, keepOrder=False, resultCache=None, exhaustive=False):
+    records = readRecords(infile)
+    crack = functools.partial(crackRecord, resultCache=resultCache, exhaustive=exhaustive)
+
+    if workers <= 1:
+        for result in map(crack, records):
+            outfile.write(json.dumps(result) + '\n')
+        return
+
+    import multiprocessing
+
+    with multiprocessing.Pool(workers) as pool:
+        mapper = pool.imap if keepOrder else pool.imap_unordered
+        for result in mapper(crack, records, BATCH_CHUNK_SIZE):
+            outfile.write(json.dumps(result) + '\n')
+
 if __name__ == '__main__':
     main(sys.argv[1:])
 
@@ -100,7 +542,41 @@ if __name__ == '__main__':
 
 class DecryptTest(unittest.TestCase):    
 
+    def test_parseKey(self):
+        self.assertEqual(parseKey('(5,8)'), (5,8))
+        self.assertEqual(parseKey('42'), 42)
+        self.assertEqual(parseKey("b'\\x9c'"), b'\x9c')
+        self.assertEqual(parseKey('lemon'), 'lemon')
+
+    def test_openInput(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'ciphertext')
+            with open(filename, 'wb') as f:
+                f.write(b'ihhwvc swfrcp')
+
+            outfile = io.BytesIO()
+            with openInput(filename) as infile:
+                findCipher('affine').decryptFile(infile, outfile, (5,8), 4)
+            self.assertEqual(outfile.getvalue(), b'affine cipher')
+
+            open(filename, 'wb').close()
+            with openInput(filename) as infile:
+                self.assertEqual(infile.read(), b'')
+
+    def test_findCipherBySampling(self):
+        import affine
+        plaintext = ' '.join(random.Random(2).choices(sampling.SamplingTest.words, k=40000))
+        ciphertext = affine.Affine().encrypt(plaintext, (5,7))
+
+        (bestCipher, bestKey, _) = findCipherBySampling(ciphertext.encode())
+        self.assertIsInstance(bestCipher, affine.Affine)
+        self.assertEqual(bestKey, (5,7))
+
     def test_findCipherAndDecrypt(self):
+        import affine
+        import nothing
+        import vigenere
+
         tests = [ 
                   ( 'hello there lets see if this gets encrypted or not by affine.'
                   , 'qbkkz yqbob kbyt tbb vg yqvt lbyt buroxeybw zo uzy mx hggvub.'
@@ -123,3 +599,122 @@ class DecryptTest(unittest.TestCase):
             (maybePlaintext, bestCipher, bestKey, _) = findCipherAndDecrypt(ciphertext)
             self.assertIsInstance(bestCipher, cipherClass)
             self.assertEqual((plaintext, key), (maybePlaintext, bestKey))
+
+    def test_crackAll(self):
+        ciphertext = 'qbkkz yqbob kbyt tbb vg yqvt lbyt buroxeybw zo uzy mx hggvub.'
+        self.assertNotIn('lcg', [type(cipher).__name__.lower() for cipher in allCiphers()])
+        self.assertEqual(type(findCipher('lcg')).__name__, 'Lcg')  # Still there by name
+
+        useSlowCiphers()
+        self.addCleanup(useSlowCiphers, False)
+        sequential = crackAll(ciphertext)
+        self.assertEqual(crackAll(ciphertext, 3), sequential)
+
+        lcgIndex = cipherNames().index('lcg')
+        self.assertIsNone(sequential[lcgIndex])  # Far too printable for a keystream, so triage rules it out
+        exhaustive = crackAll(ciphertext, exhaustive=True)
+        self.assertIsNotNone(exhaustive[lcgIndex])
+
+        results = crackAll(ciphertext, 2, 60, {'lcg': 0}, exhaustive=True)  # Not even time to start
+        self.assertIsNone(results[lcgIndex])
+        self.assertEqual(results[:lcgIndex], exhaustive[:lcgIndex])
+
+        (plaintext, bestCipher, bestKey, _) = findCipherAndDecrypt(ciphertext, 2, None, {'lcg': 0})
+        self.assertEqual((plaintext, bestKey), ('hello there lets see if this gets encrypted or not by affine.', (5,7)))
+
+    def test_parseOptions(self):
+        self.assertEqual(parseWorkers('3'), 3)
+        self.assertEqual(parseWorkers('all'), os.cpu_count())
+        self.assertEqual(parseSeconds('0'), 0.0)
+        for (parse, arg) in [(parseWorkers, '0'), (parseWorkers, 'x'), (parseSeconds, '-1'), (parseSeconds, 'nan')]:
+            with self.assertRaises(ValueError):
+                parse(arg)
+
+        with contextlib.redirect_stdout(io.StringIO()) as out, self.assertRaises(SystemExit) as exit:
+            main(['-p', '2', '-t', '0', '-c', 'hello there lets see if this works'])
+        self.assertEqual(exit.exception.code, 1)
+        self.assertIn('timed out: Nothing, Affine', out.getvalue())
+
+    def test_noReadableKey(self):
+        random.seed(8)
+        ciphertext = ''.join(chr(8*random.randrange(32)) for _ in range(400))  # Triage leaves little more than Xor
+        record = crackRecord((1, ciphertext))
+        self.assertEqual(record['cipher'], 'Nothing')  # Still there to fall back on
+
+        self.assertEqual(pickBest([None]*len(allCiphers())), (None, None, math.inf))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(findCipherAndDecrypt(ciphertext, 2, 0)[1], None)  # Everything timed out
+
+    def test_prepared(self):
+        ciphertext = 'Qbkkz yqbob kbyt tbb vg yqvt lbyt buroxeybw zo uzy mx hggvub. Qbkkz!'
+        prepared = utils.prepare(ciphertext)
+        for cipher in allCiphers():
+            text = ciphertext.lower() if cipher.onlyLowerCase() else ciphertext
+            (key, chi2) = cipher.crack(text)
+            self.assertEqual(crackCipher(cipher, prepared), (key, chi2))
+            if key != None:
+                self.assertEqual(cipher.decrypt(utils.prepare(text), key), cipher.decrypt(text, key))
+
+    def test_batchDecrypt(self):
+        infile = io.BytesIO(b'qbkkz yqbob kbyt tbb vg yqvt lbyt buroxeybw zo uzy mx hggvub.\n'
+                            b'\n'
+                            b'{"id": "plain", "ciphertext": "this should just be regular plaintext, and not messed with at all."}\n'
+                            b'{not json, just text}\n'
+                            b'{"id": "bad", "ciphertext": null}\n')
+
+        outfile = io.StringIO()
+        batchDecrypt(infile, outfile, 2, True)
+        results = [json.loads(line) for line in outfile.getvalue().splitlines()]
+
+        self.assertEqual([result['id'] for result in results], [1, 'plain', 4, 'bad'])
+        self.assertIn('string', results[3]['error'])
+        self.assertEqual(results[0]['plaintext'], 'hello there lets see if this gets encrypted or not by affine.')
+        self.assertEqual(parseKey(results[0]['key']), (5,7))
+        self.assertEqual(results[0]['cipher'], 'Affine')
+        self.assertEqual((results[1]['cipher'], results[1]['key']), ('Nothing', None))
+        self.assertGreater(results[0]['confidence'], 0.5)
+        self.assertLess(results[2]['confidence'], 0.5)
+        self.assertEqual(crackRecord((5, '!!!! 1234 ????'))['confidence'], 0.0)
+
+        infile.seek(0)
+        outfile = io.StringIO()
+        batchDecrypt(infile, outfile)
+        self.assertEqual([json.loads(line).get('plaintext') for line in outfile.getvalue().splitlines()], [result.get('plaintext') for result in results])
+
+    def test_resultCache(self):
+        import cache
+        ciphertext = 'qbkkz yqbob kbyt tbb vg yqvt lbyt buroxeybw zo uzy mx hggvub.'
+        with tempfile.TemporaryDirectory() as directory:
+            resultCache = cache.ResultCache(os.path.join(directory, 'cache.sqlite'))
+            self.assertEqual(crackAll(ciphertext, 2, resultCache=resultCache), crackAll(ciphertext))
+
+            # The workers filled the cache on disk (for every cipher triage didn't rule out), so this doesn't crack anything
+            fresh = cache.ResultCache(resultCache.path)
+            verdicts = triage.triage(allCiphers(), ciphertext)
+            self.assertTrue(all((fresh.get(cipher, ciphertext) != None) == (verdict != triage.RULED_OUT) for (cipher, verdict, _) in verdicts))
+            self.assertEqual(findCipherAndDecrypt(ciphertext, resultCache=fresh)[2], (5,7))
+            fresh.close()
+
+    # -h and a decrypt with a known key shouldn't load numpy, scipy or any cipher they don't use
+    def test_startup(self):
+        script = os.path.abspath(__file__)
+        check = ('import sys; sys.argv = %r; import decrypt\n'
+                 'try:\n    decrypt.main(sys.argv[1:])\nexcept SystemExit:\n    pass\n'
+                 'print([name for name in ["numpy.linalg", "scipy", "multiprocessing", "vigenere", "lcg"] if name in sys.modules], file=sys.stderr)')
+
+        def run(*args):
+            result = subprocess.run([sys.executable, '-c', check % ([script] + list(args))], capture_output=True, text=True, cwd=os.path.dirname(script))
+            return (result.stdout, result.stderr.strip().splitlines()[-1])
+
+        (output, loaded) = run('-n', 'affine', '-k', '(5,8)', '-c', 'ihhwvc swfrcp')
+        self.assertEqual((output, loaded), ('affine cipher\n', '[]'))
+        (output, loaded) = run('-h')
+        self.assertIn('vigenere', output)
+        self.assertEqual(loaded, '[]')
+
+        # Importing every cipher doesn't load numpy either (numpy itself is there, but only as lazyImport's stand in)
+        ciphers = ('import sys, importlib, decrypt\n'
+                   'for path in decrypt.CIPHERS + decrypt.SLOW_CIPHERS:\n    importlib.import_module(path.rpartition(".")[0])\n'
+                   'print([name for name in ["numpy.linalg", "scipy"] if name in sys.modules])')
+        result = subprocess.run([sys.executable, '-c', ciphers], capture_output=True, text=True, cwd=os.path.dirname(script))
+        self.assertEqual(result.stdout, '[]\n')
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+import utils
+import unittest
+import stream
+
+np = utils.lazyImport('numpy')
+
+# Linear congruential generator, state -> (multiplier*state + increment) mod 2^modulusBits, and each step gives out
+# the byte at outputShift.  Defaults are the classic C rand().  The seed is the initial state, and for cracking it's
+# assumed to be at most seedBits long
+class Lcg(stream.Stream):
+
+	minReadRate = 0.3  # Same as xor
+	prefixLength = 64  # Seeds are first weeded out on this many bytes,
+	stageLength = 16  # this many at a time
+
+	def __init__(self, multiplier=1103515245, increment=12345, modulusBits=31, outputShift=16, seedBits=16):
+		if not 1 <= modulusBits <= 64 or not 0 <= outputShift <= modulusBits-8:
+			raise ValueError('Need 1 <= modulusBits <= 64 and 0 <= outputShift <= modulusBits-8')
+
+		self.mask = (1 << modulusBits) - 1  # The modulus is a power of two, so wrapping uint64 maths is still right
+		self.multiplier = multiplier & self.mask
+		self.increment = increment & self.mask
+		self.outputShift = outputShift
+		self.seedBits = seedBits
+
+	def encrypt(self, plaintext, key):
+		state = self.initState(key)
+		return super().applyPrf(plaintext, state)
+
+	def decrypt(self, ciphertext, key):
+		return self.encrypt(ciphertext, key)  # Symmetric
+
+	def initState(self, seed):
+		return seed & self.mask
+
+	def prf(self, state):
+		state = (self.multiplier*state + self.increment) & self.mask
+		return ((state >> self.outputShift) & 0xff, state)
+
+	# Stepping k times is itself an affine map, state -> A[k]*state + C[k].  Working out A and C for every k up to n
+	# (by squaring, all k at once) means the keystream of any number of seeds is one vectorized expression
+	def jumpCoefficients(self, n):
+		steps = np.arange(1, n+1, dtype=np.uint64)
+		mask = np.uint64(self.mask)
+
+		A = np.ones(n, dtype=np.uint64)
+		C = np.zeros(n, dtype=np.uint64)
+		(baseA, baseC) = (np.uint64(self.multiplier), np.uint64(self.increment))
+
+		with np.errstate(over='ignore'):
+			for bit in range(n.bit_length()):
+				apply = ((steps >> np.uint64(bit)) & np.uint64(1)).astype(bool)
+				(A, C) = (np.where(apply, (baseA*A) & mask, A), np.where(apply, (baseA*C + baseC) & mask, C))
+				(baseA, baseC) = ((baseA*baseA) & mask, (baseA*baseC + baseC) & mask)
+
+		return (A, C)
+
+	# (seeds x n) matrix of the states after each step, or after the steps coefficients were worked out for
+	def states(self, seeds, n, coefficients=None):
+		(A, C) = coefficients if coefficients != None else self.jumpCoefficients(n)
+		seeds = np.asarray(seeds, dtype=np.uint64) & np.uint64(self.mask)
+
+		with np.errstate(over='ignore'):
+			return (seeds[:,None]*A[None,:] + C[None,:]) & np.uint64(self.mask)
+
+	def keystreamMatrix(self, seeds, n, coefficients=None):
+		return ((self.states(seeds, n, coefficients) >> np.uint64(self.outputShift)) & np.uint64(0xff)).astype(np.uint8)
+
+	def keystream(self, state, n):
+		if n == 0:
+			return (b'', state)
+
+		states = self.states([state], n)[0]
+		return (((states >> np.uint64(self.outputShift)) & np.uint64(0xff)).astype(np.uint8).tobytes(), int(states[-1]))
+
+	def decryptBatch(self, codes, keys):
+		return codes[None,:] ^ self.keystreamMatrix(keys, len(codes))
+
+	def keyBatchSize(self, ciphertext):
+		return max(1, self.batchCells // min(max(1, len(ciphertext)), self.stageLength))
+
+	# Most seeds are thrown out on the prefix, which has to pass minReadRate on its own (a wrong seed gives a letter only
+	# about 10% of the time).  That's done stageLength bytes at a time for all the seeds still in the running, and only
+	# the few that make it through the whole prefix get decrypted and scored in full.  With no minReadRate nothing is
+	# thrown out, and every seed is scored in full
+	def scoreKeys(self, ciphertext, keys, minReadRate=0.4, histogram=None):
+		codes = utils.prepare(ciphertext).codes
+		if codes is None or len(codes) == 0:
+			return super().scoreKeys(ciphertext, keys, minReadRate, histogram)
+
+		seeds = np.asarray(keys, dtype=np.uint64)
+		alive = np.arange(len(keys))
+
+		if minReadRate > 0.0:
+			prefix = codes[:self.prefixLength]
+			(A, C) = self.jumpCoefficients(len(prefix))
+			maxNonLetters = int((1-minReadRate)*len(prefix))
+			nonLetters = np.zeros(len(keys), dtype=np.int64)
+
+			for start in range(0, len(prefix), self.stageLength):
+				stop = min(start+self.stageLength, len(prefix))
+				keystreams = self.keystreamMatrix(seeds[alive], stop-start, (A[start:stop], C[start:stop]))
+				nonLetters[alive] += (((prefix[None,start:stop] ^ keystreams) - np.uint8(ord('a'))) >= utils.ALPHABET_SIZE).sum(axis=1)
+				alive = alive[nonLetters[alive] <= maxNonLetters]
+
+		scores = np.full(len(keys), np.inf)
+		step = max(1, self.batchCells // len(codes))  # However many are left, it's still a few MB at a time
+		for i in range(0, len(alive), step):
+			batch = alive[i:i+step]
+			scores[batch] = utils.calcChiSquaredMany(self.decryptBatch(codes, seeds[batch]), minReadRate)
+
+		return scores
+
+	def genKeys(self):
+		return range(1 << self.seedBits)
+
+	def genKeyRange(self, start, end=None):
+		return range(start, (1 << self.seedBits) if end == None else min(end, 1 << self.seedBits))
+
+	def countKeys(self):
+		return 1 << self.seedBits
+
+	def crack(self, ciphertext):
+		return super().bruteForce(ciphertext, self.minReadRate)
+
+	def getNameOfCipher(self, key=None):
+		return 'LCG (Stream)'
+
+	def usage(self):
+		print('Key is the seed, a number 0-%d' % ((1 << self.seedBits) - 1))
+
+class LcgTest(unittest.TestCase):
+
+	def setUp(self):
+		self.lcgInstance = Lcg()
+
+	def test_keystream(self):
+		state = self.lcgInstance.initState(12345)
+		expected = bytearray()
+		expectedState = state
+		for _ in range(100):
+			(nextByte, expectedState) = self.lcgInstance.prf(expectedState)
+			expected.append(nextByte)
+
+		self.assertEqual(self.lcgInstance.keystream(state, 100), (bytes(expected), expectedState))
+		self.assertEqual(self.lcgInstance.keystream(state, 0), (b'', state))
+
+		# Full 64 bit modulus, where everything wraps
+		knuth = Lcg(6364136223846793005, 1442695040888963407, 64, 56)
+		(nextByte, nextState) = knuth.prf(2**63 + 5)
+		self.assertEqual(knuth.keystream(2**63 + 5, 1), (bytes([nextByte]), nextState))
+
+	def test_identity(self):
+		plaintext = 'some text to encrypt'
+		self.assertEqual(self.lcgInstance.decrypt(self.lcgInstance.encrypt(plaintext, 4321), 4321), plaintext)
+		self.assertEqual(self.lcgInstance.decrypt(self.lcgInstance.encrypt(b'\x00\xff', 4321), 4321), b'\x00\xff')
+
+	def test_decryptBatch(self):
+		ciphertext = 'Some text, to xor!\x00\xff'
+		keys = [0, 1, 999, 65535]
+		plaintexts = self.lcgInstance.decryptBatch(utils.textToCodes(ciphertext), keys)
+		for key, row in zip(keys, plaintexts):
+			self.assertEqual(utils.codesToText(row), self.lcgInstance.decrypt(ciphertext, key))
+
+	def test_crack(self):
+		plaintext = 'this is a reasonably long english sentence, which should be simple to find the key for.'
+		ciphertext = self.lcgInstance.encrypt(plaintext, 51234)
+		(key, _) = self.lcgInstance.crack(ciphertext)
+		self.assertEqual(key, 51234)
+
+	def test_binaryPrefix(self):
+		plaintext = bytes(range(0, 256, 11)) + b'then this is a reasonably long english sentence, which should be simple to find the key for.'
+		ciphertext = self.lcgInstance.encrypt(plaintext, 51234)
+		(key, _) = self.lcgInstance.crack(ciphertext)
+		self.assertEqual(key, 51234)
+
+	def test_bruteForceWorkers(self):
+		plaintext = 'this is a reasonably long english sentence, which should be simple to find the key for.'
+		ciphertext = self.lcgInstance.encrypt(plaintext, 51234)
+		ranked = self.lcgInstance.bruteForceRanked(ciphertext, self.lcgInstance.minReadRate, 5)
+		self.assertEqual(ranked[0][0], 51234)
+		self.assertEqual(self.lcgInstance.bruteForceRanked(ciphertext, self.lcgInstance.minReadRate, 5, workers=3), ranked)
+
+		self.lcgInstance.halving = True  # Each shard halves its own keys
+		self.assertEqual(self.lcgInstance.bruteForceRanked(ciphertext, self.lcgInstance.minReadRate, 1, workers=3), ranked[:1])
+		self.assertEqual(list(self.lcgInstance.genKeyRange(10, 13)), [10, 11, 12])
+		self.assertEqual(self.lcgInstance.genKeyRange(10, 1 << 40), self.lcgInstance.genKeyRange(10))  # Clamped to the seeds there are
+		self.assertEqual(self.lcgInstance.countKeys(), len(self.lcgInstance.genKeys()))
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+
+# Dense n-gram models.  Every one of the 26^n n-grams gets a slot holding its log10 probability, with the floor (for
+# n-grams never seen) already filled in, so scoring a text is index arithmetic (a*676 + b*26 + c for trigrams) and one
+# gather, no dict lookups or logs.  Models are kept in a small binary file that's memory mapped, so loading one costs
+# next to nothing however big n is:
+#   header: magic b'NGRM', version (uint16), n (uint16), floor (float64), all little endian
+#   then:   the 26^n log10 probabilities as little endian float32, the n-gram 'abc' at index a*26^2 + b*26 + c
+# A model can also be built from the usual text format (an n-gram and its count on each line, as practicalcryptography
+# has them), see fromTextFile.  Or trained straight from a corpus, which is what running this does:
+#   ./ngram.py [-n 2,3,4] [-p <workers | all>] [-o <output prefix>] [-f] <corpus file>...
+# Any language (or logs, or whatever the plaintext will look like) works the same way, only its letters a-z count,
+# either case.  The corpora are memory mapped and cut into ranges that are counted in parallel, then the counts are
+# added up (see buildCounts).  It writes <prefix>_<n>grams.bin for each n (english_trigrams.bin and so on, see NGRAM_NAMES)
+# and, for monograms (-n 1, they aren't counted unless asked for), the letter frequencies in the LanguageModel format
+# (see freqsPath).  With the default prefix, everything goes where getNgramModel and getLanguageModel load it from
+
+import functools
+import getopt
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import unittest
+
+import utils
+
+np = utils.lazyImport('numpy')
+
+MAGIC = b'NGRM'
+FORMAT_VERSION = 1
+_header = struct.Struct('<4sHHd')
+
+DEFAULT_PREFIX = 'data/english'
+TRIGRAMS_FILE = 'data/english_trigrams.bin'
+TRIGRAMS_TEXT_FILE = 'data/english_trigrams.txt'  # What TRIGRAMS_FILE is built from, if it's there and the binary isn't
+FLOOR_COUNT = 0.01  # An n-gram never seen counts as this many sightings, same as calcTrigraphFitness always had
+
+BUILD_RANGE_SIZE = 1 << 26  # Bytes of corpus a worker counts at a time
+NGRAM_NAMES = {1: 'monograms', 2: 'bigrams', 3: 'trigrams', 4: 'quadgrams'}
+
+_ngramModels = {}  # filename -> NgramModel, so each file is only mapped once
+
+class NgramModel:
+    """log10 probabilities of every n-gram of lower case letters.  logProbs is a flat float32 array of 26^n, which
+    can be a view straight into a memory mapped file"""
+
+    def __init__(self, n, logProbs, floor, mapped=None):
+        if len(logProbs) != utils.ALPHABET_SIZE**n:
+            raise ValueError('Expected %d log probabilities for %d-grams, got %d' % (utils.ALPHABET_SIZE**n, n, len(logProbs)))
+
+        self.n = n
+        self.logProbs = logProbs
+        self.floor = floor
+        self.mapped = mapped  # Keeps the mmap open for as long as logProbs looks into it
+        self.placeValues = utils.ALPHABET_SIZE**np.arange(n-1, -1, -1, dtype=np.intp)
+
+    @classmethod
+    def fromCounts(cls, counts, floorCount=FLOOR_COUNT):
+        """counts is an array of 26^n counts (the n-gram index as above), or a dict of n-gram -> count"""
+        if isinstance(counts, dict):
+            counts = countsArray(counts)
+
+        counts = np.asarray(counts, dtype=np.float64)
+        n = round(np.log(len(counts))/np.log(utils.ALPHABET_SIZE))
+        total = counts.sum()
+        if total <= 0:
+            raise ValueError('No n-grams were counted')
+
+        floor = float(np.log10(floorCount/total))
+        logProbs = np.full(len(counts), floor, dtype=np.float32)
+        seen = counts > 0
+        logProbs[seen] = np.log10(counts[seen]/total)
+
+        return cls(n, logProbs, floor)
+
+    @classmethod
+    def fromTextFile(cls, filename, floorCount=FLOOR_COUNT):
+        return cls.fromCounts(readCounts(filename), floorCount)
+
+    @classmethod
+    def load(cls, filename):
+        """Maps a model file (see the top), nothing is read until it's used"""
+        with open(filename, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(mapped) < _header.size:
+            raise ValueError('%s is too short to be an n-gram model' % filename)
+        (magic, version, n, floor) = _header.unpack_from(mapped)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('%s is not an n-gram model this can read' % filename)
+
+        logProbs = np.frombuffer(mapped, dtype='<f4', count=utils.ALPHABET_SIZE**n, offset=_header.size)
+        return cls(n, logProbs, floor, mapped)
+
+    def save(self, filename):
+        # Written next to it and then moved over it, so a reader never maps half a file
+        directory = os.path.dirname(os.path.abspath(filename))
+        with tempfile.NamedTemporaryFile('wb', dir=directory, delete=False) as f:
+            f.write(_header.pack(MAGIC, FORMAT_VERSION, self.n, self.floor))
+            f.write(np.asarray(self.logProbs, dtype='<f4').tobytes())
+        os.chmod(f.name, 0o644)  # Temporary files are only readable by their owner
+        os.replace(f.name, filename)
+
+    def indices(self, letters):
+        """Index of every n-gram in a run of letter indices (0 is 'a')"""
+        letters = np.asarray(letters, dtype=np.intp)
+        numNgrams = len(letters)-self.n+1
+        if numNgrams <= 0:
+            return np.zeros(0, dtype=np.intp)
+
+        return sum(letters[i:i+numNgrams]*self.placeValues[i] for i in range(self.n))
+
+    def fitness(self, text):
+        """Average log10 probability per letter of text's n-grams, letters only (and either case).  Higher is more
+        like the language, -inf if text doesn't have n letters"""
+        letters = utils.prepare(text).lowered().letters
+        if len(letters) < self.n:
+            return float('-inf')
+
+        return float(self.logProbs[self.indices(letters)].sum(dtype=np.float64))/len(letters)
+
+    def fitnessMany(self, codes):
+        """fitness of every row of a (rows x length) uint8 matrix of char codes at once, like calcChiSquaredMany"""
+        (numRows, length) = codes.shape
+        if length < self.n:
+            return np.full(numRows, -np.inf)
+
+        isUpper = (codes - np.uint8(ord('A'))) < utils.ALPHABET_SIZE
+        letters = np.where(isUpper, codes + np.uint8(ord('a')-ord('A')), codes) - np.uint8(ord('a'))
+        isLetter = letters < utils.ALPHABET_SIZE
+
+        # Each row's letters are moved to its front (in order), so the n-grams run across whatever was between them
+        # (anything else is made an 'a', it only ever lands in n-grams past the end of the row's letters)
+        order = np.argsort(~isLetter, axis=1, kind='stable')
+        letters = np.take_along_axis(np.where(isLetter, letters, 0), order, axis=1).astype(np.intp)
+        numLetters = isLetter.sum(axis=1)
+
+        numNgrams = length-self.n+1
+        indices = sum(letters[:, i:i+numNgrams]*self.placeValues[i] for i in range(self.n))
+        inRow = np.arange(numNgrams)[None, :] < (numLetters-self.n+1)[:, None]
+
+        totals = np.where(inRow, self.logProbs[indices], 0.0).sum(axis=1, dtype=np.float64)
+        return np.where(numLetters >= self.n, totals/np.maximum(numLetters, 1), -np.inf)
+
+# n-gram -> count as a flat array of 26^n, see the top
+def countsArray(counts):
+    n = len(next(iter(counts)))
+    array = np.zeros(utils.ALPHABET_SIZE**n, dtype=np.float64)
+    for ngram, count in counts.items():
+        if len(ngram) != n or not all(utils.isAlpha(c) for c in ngram):
+            raise ValueError('%r is not a %d-gram of letters' % (ngram, n))
+        array[sum((ord(c)-ord('a'))*utils.ALPHABET_SIZE**(n-1-i) for i, c in enumerate(ngram))] += count
+
+    return array
+
+# With thanks to Practical Cryptography for the format: http://practicalcryptography.com/cryptanalysis/letter-frequencies-various-languages/english-letter-frequencies/
+# Upper case in the file, so it's lowered
+def readCounts(filename):
+    counts = {}
+    with open(filename, 'r') as f:
+        for line in f:
+            split = line.split()
+            if len(split) >= 2:
+                counts[split[0].lower()] = counts.get(split[0].lower(), 0) + int(split[1])
+
+    return counts
+
+# Maps the model the first time it's asked for.  If there's no binary yet but there is the text version next to it
+# (TRIGRAMS_TEXT_FILE for TRIGRAMS_FILE), the binary is built from that once and saved
+def getNgramModel(filename=TRIGRAMS_FILE, textFilename=None):
+    model = _ngramModels.get(filename)
+    if model == None:
+        path = utils.dataPath(filename)
+        if textFilename == None and filename == TRIGRAMS_FILE:
+            textFilename = TRIGRAMS_TEXT_FILE
+
+        if not os.path.exists(path) and textFilename != None and os.path.exists(utils.dataPath(textFilename)):
+            NgramModel.fromTextFile(utils.dataPath(textFilename)).save(path)
+
+        model = NgramModel.load(path)
+        _ngramModels[filename] = model
+
+    return model
+
+def main(argv):
+    ns = [2, 3, 4]  # Monograms would replace the letter frequencies every crack is scored on, so only when asked
+    workers = os.cpu_count()
+    prefix = utils.dataPath(DEFAULT_PREFIX)  # Where getNgramModel looks, wherever this is run from
+    overwrite = False
+
+    try:
+        opts, args = getopt.getopt(argv, "hn:p:o:f")
+    except getopt.GetoptError as err:
+        print(err)
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit()
+        elif opt == '-n':
+            ns = sorted(set(int(n) for n in arg.split(',')))
+        elif opt == '-p':
+            workers = int(arg) if arg != 'all' else os.cpu_count()
+        elif opt == '-o':
+            prefix = arg
+        elif opt == '-f':
+            overwrite = True
+
+    if len(args) == 0:
+        usage()
+        sys.exit(2)
+
+    existing = [path for path in modelPaths(prefix, ns) if os.path.exists(path)]
+    if existing and not overwrite:  # Found out before all the counting, not after
+        print('%s already exists, -f to overwrite' % ', '.join(existing))
+        sys.exit(2)
+
+    for path in writeModels(buildCounts(args, ns, workers), prefix, overwrite):
+        print('Wrote %s' % path)
+
+def usage():
+    print('Usage: ./ngram.py [-n <sizes, 2,3,4 by default>] [-p <workers | all>] [-o <output prefix>] [-f] <corpus file>...')
+    print('Writes <prefix>_<n>grams.bin for each n (prefix is data/english by default), and the letter frequencies for -n 1')
+    print('(%s by default, the ones every crack is scored on, otherwise <prefix>AlphaFreqs.txt)' % utils.EXPECTED_FREQS_FILE)
+    print('Files that are already there are left alone unless there\'s -f')
+
+# Lower case letter index of every byte, 255 for anything that isn't a letter
+@functools.lru_cache(maxsize=1)
+def letterIndices():
+    indices = np.full(256, 255, dtype=np.uint8)
+    for alphabet in [utils.LOWER_ALPHABET, utils.LOWER_ALPHABET.upper()]:
+        indices[np.frombuffer(alphabet.encode(), dtype=np.uint8)] = np.arange(utils.ALPHABET_SIZE)
+    return indices
+
+def lettersOf(data):
+    codes = letterIndices()[np.frombuffer(data, dtype=np.uint8)]
+    return codes[codes < utils.ALPHABET_SIZE].astype(np.intp)
+
+# Adds the n-grams of letters starting at positions first up to (not including) end to counts
+def addNgrams(counts, letters, n, first, end):
+    end = min(end, len(letters)-n+1)
+    if end <= first:
+        return
+
+    indices = sum(letters[first+i:end+i]*utils.ALPHABET_SIZE**(n-1-i) for i in range(n))
+    counts += np.bincount(indices, minlength=len(counts))
+
+def countRange(path, start, end, ns):
+    """The counts (n -> 26^n array) of the n-grams that start in bytes start up to end of the file.  Like the scorers,
+    n-grams run across anything that isn't a letter, so the ones starting near end are finished off with the letters
+    after it (and the range before this one finishes off its own the same way, so none are counted twice)"""
+    counts = {n: np.zeros(utils.ALPHABET_SIZE**n, dtype=np.int64) for n in ns}
+    overlap = max(ns)-1
+    carry = np.zeros(0, dtype=np.intp)  # The last few letters, whose n-grams haven't all been seen yet
+
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for blockStart in range(start, end, utils.CHUNK_SIZE):
+                letters = np.concatenate((carry, lettersOf(mapped[blockStart:min(end, blockStart+utils.CHUNK_SIZE)])))
+                for n in ns:  # Only the n-grams that end in this block are new
+                    addNgrams(counts[n], letters, n, max(0, len(carry)-n+1), len(letters))
+                carry = letters[max(0, len(letters)-overlap):]
+
+            lookahead = np.zeros(0, dtype=np.intp)
+            position = end
+            while len(lookahead) < overlap and position < len(mapped):
+                lookahead = np.concatenate((lookahead, lettersOf(mapped[position:position+4096])))
+                position += 4096
+
+    letters = np.concatenate((carry, lookahead[:overlap]))
+    for n in ns:  # The ones that start in the carry and end after it
+        addNgrams(counts[n], letters, n, max(0, len(carry)-n+1), len(carry))
+
+    return counts
+
+def _countRange(task):
+    return countRange(*task)
+
+def buildCounts(paths, ns=(1, 2, 3, 4), workers=1, rangeSize=BUILD_RANGE_SIZE):
+    """Counts the n-grams of every corpus file for each n in ns, giving n -> a flat array of 26^n counts (the index is
+    the same as NgramModel's).  Each file is cut into ranges, the ranges counted in parallel and the counts added up.
+    n-grams don't run from one file into the next"""
+    tasks = []
+    for path in paths:
+        size = os.path.getsize(path)
+        tasks += [(path, start, min(size, start+rangeSize), tuple(ns)) for start in range(0, size, rangeSize)]
+
+    totals = {n: np.zeros(utils.ALPHABET_SIZE**n, dtype=np.int64) for n in ns}
+    def add(counts):
+        for n in ns:
+            totals[n] += counts[n]
+
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            add(_countRange(task))
+        return totals
+
+    import multiprocessing  # Slow to import, and only needed here
+
+    with multiprocessing.Pool(min(workers, len(tasks))) as pool:
+        for counts in pool.imap_unordered(_countRange, tasks):
+            add(counts)
+
+    return totals
+
+def modelPath(prefix, n):
+    return '%s_%s.bin' % (prefix, NGRAM_NAMES.get(n, '%dgrams' % n))
+
+# Where the monogram frequencies for prefix go.  The default prefix's are the ones getLanguageModel loads
+def freqsPath(prefix):
+    if prefix == utils.dataPath(DEFAULT_PREFIX):
+        return utils.dataPath(utils.EXPECTED_FREQS_FILE)
+    return prefix + 'AlphaFreqs.txt'
+
+# Every file writeModels writes for these n, in the order it writes them
+def modelPaths(prefix, ns):
+    paths = []
+    for n in sorted(ns):
+        paths.append(modelPath(prefix, n))
+        if n == 1:
+            paths.append(freqsPath(prefix))
+
+    return paths
+
+def writeModels(counts, prefix, overwrite=False):
+    """Saves an NgramModel for every n in counts (see modelPath), plus the monogram frequencies in the
+    LanguageModel format (see freqsPath).  Returns the paths written.  Unless overwrite, raises FileExistsError (before writing
+    anything) if any of them is already there"""
+    if not overwrite:
+        for path in modelPaths(prefix, counts):
+            if os.path.exists(path):
+                raise FileExistsError('%s already exists' % path)
+
+    paths = []
+    for n in sorted(counts):
+        if counts[n].sum() == 0:
+            raise ValueError('The corpus has no %d-grams' % n)
+
+        NgramModel.fromCounts(counts[n]).save(modelPath(prefix, n))
+        paths.append(modelPath(prefix, n))
+
+        if n == 1:  # Letters that never turned up get the same floor as n-grams, the chi-squared can't take a 0
+            freqs = np.maximum(counts[n], FLOOR_COUNT)/counts[n].sum()
+            with open(freqsPath(prefix), 'w') as f:
+                f.write(''.join('%s %.6g\n' % (c, freq) for c, freq in zip(utils.LOWER_ALPHABET, freqs)))
+            paths.append(freqsPath(prefix))
+
+    return paths
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
+
+
+
+class NgramTest(unittest.TestCase):
+
+    counts = {'the': 100, 'her': 40, 'ere': 30, 'hel': 10, 'ell': 10, 'llo': 10}
+
+    def test_fitness(self):
+        model = NgramModel.fromCounts(self.counts)
+        self.assertEqual(model.n, 3)
+        self.assertAlmostEqual(model.floor, np.log10(FLOOR_COUNT/200), 5)
+
+        # Same as the old dict lookup per position
+        text = 'Hello, there!'
+        letters = 'hellothere'
+        expected = sum(np.log10(self.counts[letters[i:i+3]]/200) if letters[i:i+3] in self.counts else model.floor for i in range(len(letters)-2))/len(letters)
+        self.assertAlmostEqual(model.fitness(text), expected, 5)
+        self.assertEqual(model.fitness('ab!'), float('-inf'))
+
+        texts = ['Hello, there!', 'zzzz zzzz zzz', 'a b          ']
+        codes = np.array([utils.textToCodes(text) for text in texts])
+        fitness = model.fitnessMany(codes)
+        for i, text in enumerate(texts):
+            self.assertAlmostEqual(fitness[i], model.fitness(text), 5)
+
+    def test_buildCounts(self):
+        text = 'The quick brown fox\njumps over the lazy dog.  THE END, x y z!'
+        letters = ''.join(c for c in text.lower() if utils.isAlpha(c))
+
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in ['a.txt', 'b.txt']]
+            for path in paths:
+                with open(path, 'w') as f:
+                    f.write(text)
+
+            # Ranges of a few bytes, so n-grams keep running over the edges (and over ranges without enough letters)
+            for (workers, rangeSize) in [(1, 1 << 20), (1, 3), (2, 7)]:
+                counts = buildCounts(paths, [1, 3, 4], workers, rangeSize)
+                for n in [1, 3, 4]:
+                    expected = {}
+                    for i in range(len(letters)-n+1):
+                        expected[letters[i:i+n]] = expected.get(letters[i:i+n], 0) + 2  # Once per file
+                    self.assertEqual(counts[n].tolist(), countsArray(expected).astype(np.int64).tolist())
+
+            prefix = os.path.join(directory, 'test')
+            written = writeModels(buildCounts(paths, [1, 3]), prefix)
+            self.assertEqual(written, [modelPath(prefix, 1), prefix + 'AlphaFreqs.txt', modelPath(prefix, 3)])
+            self.assertEqual(modelPaths(prefix, [3, 1]), written)
+            with self.assertRaises(FileExistsError):
+                writeModels(buildCounts(paths, [3]), prefix)
+            self.assertEqual(writeModels(buildCounts(paths, [3]), prefix, overwrite=True), [modelPath(prefix, 3)])
+            self.assertEqual(modelPath(prefix, 3), prefix + '_trigrams.bin')
+            self.assertEqual(modelPath(utils.dataPath(DEFAULT_PREFIX), 3), utils.dataPath(TRIGRAMS_FILE))
+            self.assertEqual(freqsPath(utils.dataPath(DEFAULT_PREFIX)), utils.dataPath(utils.EXPECTED_FREQS_FILE))
+
+            model = utils.LanguageModel.fromFile(prefix + 'AlphaFreqs.txt')
+            self.assertLess(model.chiSquared(utils.calcCounts(letters)), 1e-3)
+            numTrigrams = 2*(len(letters)-2)
+            self.assertAlmostEqual(NgramModel.load(modelPath(prefix, 3)).fitness('the'), np.log10(6/numTrigrams)/3, 5)  # 'the' three times a file
+
+    def test_saveAndLoad(self):
+        model = NgramModel.fromCounts(self.counts)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'trigrams.bin')
+            model.save(filename)
+            self.assertEqual(os.path.getsize(filename), _header.size + 4*utils.ALPHABET_SIZE**3)
+
+            loaded = NgramModel.load(filename)
+            self.assertEqual((loaded.n, loaded.floor), (model.n, model.floor))
+            self.assertEqual(loaded.logProbs.tolist(), model.logProbs.tolist())
+            self.assertEqual(loaded.fitness('hello there'), model.fitness('hello there'))
+
+            textFilename = os.path.join(directory, 'trigrams.txt')
+            with open(textFilename, 'w') as f:
+                f.write(''.join('%s %d\n' % (ngram.upper(), count) for ngram, count in self.counts.items()))
+            self.assertEqual(NgramModel.fromTextFile(textFilename).logProbs.tolist(), model.logProbs.tolist())
+
+            with self.assertRaises(ValueError):
+                NgramModel.load(textFilename)
@@ -2,6 +2,7 @@
 
 import utils
 import cipher
+import triage
 import unittest
 
 class Nothing(cipher.AbstractCipher):
@@ -10,13 +11,21 @@ class Nothing(cipher.AbstractCipher):
 		return plaintext
 
 	def decrypt(self, ciphertext, key):
-		return ciphertext	
+		return utils.textOf(ciphertext)	
 
 	def crack(self, ciphertext):
 		chi2 = utils.calcChiSquared(ciphertext)
 
 		return (None, chi2)
 
+	def incrementalCracker(self):
+		return NothingCracker(self)
+
+	def triage(self, stats):
+		"""Never ruled out.  Its chi2 is always finite, so whatever the other ciphers make of the text, there's a result
+		to fall back on"""
+		return (triage.POSSIBLE, None)
+
 	def getNameOfCipher(self, key=None):
 		return 'Nothing'
 
@@ -24,6 +33,20 @@ class Nothing(cipher.AbstractCipher):
 		print('Key is ignored.  Sees if plaintext')
 
 
+# The letter counts are all crack needs
+class NothingCracker(cipher.IncrementalCracker):
+
+	def __init__(self, cipher):
+		super().__init__(cipher)
+		self.counts = [0]*utils.ALPHABET_SIZE
+
+	def update(self, text):
+		self.counts = [total+count for total, count in zip(self.counts, utils.calcCounts(text))]
+
+	def bestRanked(self, top=2):
+		return [(None, utils.getLanguageModel().chiSquared(self.counts))]
+
+
 class NothingTest(unittest.TestCase):
 
 	def setUp(self):
@@ -34,3 +57,9 @@ class NothingTest(unittest.TestCase):
 
 	def test_decrypt(self):
 		self.assertEqual(self.nothingInstance.decrypt('abc', (1,1)), 'abc')
+
+	def test_incrementalCracker(self):
+		cracker = self.nothingInstance.incrementalCracker()
+		for chunk in ['the quick ', b'brown fox', '', ' jumps']:
+			cracker.feed(chunk)
+		self.assertEqual(cracker.best(), self.nothingInstance.crack('the quick brown fox jumps'))
@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+
+# Shared engine for ciphers that shift every keylen-th letter by the same key letter (Vigenere, Beaufort, ...)
+
+from abc import abstractmethod
+import re
+import utils
+import cipher
+import triage
+import unittest
+
+np = utils.lazyImport('numpy')
+
+KEY_LENGTH_UPPER_BOUND = 20  # Unlikely that higher? ^^^ 
+MIN_COLUMN_LETTERS = 20  # With fewer letters per column than this, picking the best shift per column just overfits the chi-squared
+
+_nonAlphaRuns = re.compile('[^a-z]+')
+
+# Only the letters take part in the key, everything else is just carried along
+def alphaStream(text):
+	return _nonAlphaRuns.sub('', text)
+
+def letterCodes(letters):
+	return np.frombuffer(letters.encode('ascii'), dtype=np.uint8).astype(np.intp) - ord('a')
+
+# (keyLen x 26) letter counts of each key column, all counted in a single pass.  start is the column of the first letter
+def columnCounts(codes, keyLen, start=0):
+	columns = (np.arange(len(codes)) + start) % keyLen
+	return np.bincount(columns*utils.ALPHABET_SIZE + codes, minlength=keyLen*utils.ALPHABET_SIZE).reshape(keyLen, utils.ALPHABET_SIZE)
+
+# The key lengths rankKeyLengths tries for this many letters
+def keyLengthsToTry(numLetters, keyLengthUpperBound):
+	return np.arange(1, max(1, min(keyLengthUpperBound, numLetters)))
+
+# Fewer letters can't pin down as many columns
+def cappedKeyLengthUpperBound(numLetters, keyLengthUpperBound):
+	return min(keyLengthUpperBound, numLetters//MIN_COLUMN_LETTERS + 1)
+
+# Average index of coincidence of the columns, from their counts
+def columnCoincidence(counts):
+	totals = counts.sum(axis=1)
+	pairs = np.maximum(totals*(totals-1), 1)
+	return utils.ALPHABET_SIZE*np.mean((counts*(counts-1)).sum(axis=1)/pairs)
+
+# How sure each column of a decryption is of its shift: the chance its letters were decrypted with the right one of the
+# 26, going on how likely they are under the letter model with each (tempered by ENGLISH_DISPERSION, English's counts
+# spread more than chance's).  counts are the plaintext's columnCounts.  Decrypting a column with another key letter
+# just rotates its plaintext, for Beaufort's reflection too, so the other 25 are the rotations
+def shiftConfidences(counts, model=None):
+	if model == None:
+		model = utils.getLanguageModel()
+
+	logFreqs = np.log(np.frombuffer(model.expectedFreqs, dtype=np.float64))
+	rotated = np.array([np.roll(logFreqs, -shift) for shift in range(utils.ALPHABET_SIZE)])  # rotated[shift, y] is y+shift's
+	likelihoods = counts @ rotated.T / utils.ENGLISH_DISPERSION
+	return np.exp(-np.logaddexp.reduce(likelihoods - likelihoods[:, :1], axis=1))
+
+def rankedKeyLengths(lengths, scores):
+	order = np.argsort(-scores, kind='stable')  # Ties go to the shorter key
+	return [(int(lengths[i]), float(scores[i])) for i in order]
+
+# maps[i] = (a,b) is applied to letters i, i+keylen, i+2*keylen... of text (counting only letters).  Each column is a
+# single translate call, then the columns are interleaved again and the non-alpha chars put back where they were
+def applyColumnMaps(text, maps):
+	letters = alphaStream(text)
+	keylen = len(maps)
+
+	if keylen == 1:
+		mixed = letters.translate(utils.letterMapTable(*maps[0]))
+	else:
+		out = list(letters)
+		for i in range(keylen):
+			out[i::keylen] = letters[i::keylen].translate(utils.letterMapTable(*maps[i]))
+		mixed = ''.join(out)
+
+	if len(letters) == len(text):
+		return mixed  # Nothing to put back
+
+	pieces = []
+	textPos = 0
+	letterPos = 0
+	for run in _nonAlphaRuns.finditer(text):
+		numLetters = run.start()-textPos
+		pieces.append(mixed[letterPos:letterPos+numLetters])
+		pieces.append(run.group())
+		letterPos += numLetters
+		textPos = run.end()
+	pieces.append(mixed[letterPos:])
+
+	return ''.join(pieces)
+
+
+class Polyalphabetic(cipher.AbstractCipher):
+
+	keyLengthUpperBound = KEY_LENGTH_UPPER_BOUND
+	keyLengthMethod = 'coincidence'  # See rankKeyLengths
+
+	@abstractmethod
+	def encryptMap(self, shift):
+		"""Returns (a,b), so that a letter x is encrypted to a*x+b (mod 26) by a key letter with the given shift"""
+
+	@abstractmethod
+	def decryptMap(self, shift):
+		"""Returns (a,b), the inverse of encryptMap"""
+
+	def keyShifts(self, key):
+		if len(key) == 0:  # Every way in goes through here, so none of them get as far as a modulo by zero
+			raise ValueError('The key can\'t be empty')
+		return [ord(k)-ord('a') for k in key]
+
+	def encrypt(self, plaintext, key):
+		return applyColumnMaps(plaintext, [self.encryptMap(shift) for shift in self.keyShifts(key)])
+
+	def decrypt(self, ciphertext, key):
+		return applyColumnMaps(utils.textOf(ciphertext), [self.decryptMap(shift) for shift in self.keyShifts(key)])
+
+	def encryptChunks(self, chunks, key):
+		return self.applyChunks(chunks, [self.encryptMap(shift) for shift in self.keyShifts(key)])
+
+	def decryptChunks(self, chunks, key):
+		return self.applyChunks(chunks, [self.decryptMap(shift) for shift in self.keyShifts(key)])
+
+	# Each chunk starts wherever in the key the letters of the chunks before it left off
+	def applyChunks(self, chunks, maps):
+		keyIndex = 0
+		for chunk in chunks:
+			yield applyColumnMaps(chunk, maps[keyIndex:]+maps[:keyIndex])
+			keyIndex = (keyIndex + len(alphaStream(chunk))) % len(maps)
+
+	def crack(self, ciphertext, keyLengthUpperBound=None):
+		return self.crackRanked(ciphertext, 1, keyLengthUpperBound)[0]
+
+	# The runners up are the best key with a single column swapped for its next best shift.  The columns are what the
+	# crack actually fits, so a runner up's chi2 is the best key's plus how much worse its swapped column fits
+	def crackRanked(self, ciphertext, top=2, keyLengthUpperBound=None):
+		prepared = utils.prepare(ciphertext)
+		codes = prepared.letters.astype(np.intp)  # The key only moves on letters, so the columns are taken from these
+
+		if keyLengthUpperBound == None:
+			keyLengthUpperBound = self.keyLengthUpperBound
+		keyLengthUpperBound = cappedKeyLengthUpperBound(len(codes), keyLengthUpperBound)
+		keyLen = self.findKeyLength(prepared, keyLengthUpperBound, self.keyLengthMethod)
+
+		ranked = self.rankKeys(keyLen, lambda keyLen: columnCounts(codes, keyLen), self.rankWidth(top))
+		return self.rerank(prepared, ranked, top)
+
+	def rankKeys(self, keyLen, countsFor, top=2, model=None):
+		"""The rest of crackRanked once the key length is known.  countsFor(n) gives the columnCounts of the letters for
+		key length n, so it works the same from the text or from counts kept up as it comes in"""
+		if model == None:
+			model = utils.getLanguageModel()
+
+		columns = self.rankShifts(countsFor(keyLen), model)
+		shifts = [ranked[0][0] for ranked in columns]
+
+		refinedLen = len(self.refineKey(shifts))
+		if top > 1 and refinedLen < keyLen:  # Runners up at the longer length would have more freedom to overfit
+			keyLen = refinedLen
+			columns = self.rankShifts(countsFor(keyLen), model)
+			shifts = [ranked[0][0] for ranked in columns]
+
+		key = self.refineKey(''.join(chr(ord('a')+shift) for shift in shifts))
+
+		# Same as the chi2 of the decrypted letters (only they count towards it anyway), but from the column counts
+		sources = self.shiftSources()
+		counts = countsFor(len(key))
+		plainCounts = sum(counts[i, sources[shift]] for i, shift in enumerate(self.keyShifts(key)))
+		chi2 = model.chiSquared(plainCounts.tolist())
+
+		runnersUp = []
+		if top > 1:
+			for i in range(keyLen):
+				if len(columns[i]) > 1:
+					(shift, columnChi2) = columns[i][1]
+					runnerUp = key[:i] + chr(ord('a')+shift) + key[i+1:]
+					runnersUp.append((runnerUp, chi2 + columnChi2-columns[i][0][1]))
+
+		return [(key, chi2)] + sorted(runnersUp, key=lambda candidate: candidate[1])[:top-1]
+
+	# A key with a column wrong still gives mostly English, only one in keyLen letters is shifted, which the letter
+	# counts of the whole text hardly show (one of five wrong can still look 0.95 English).  So every column has to be
+	# sure of its shift as well
+	def confidence(self, ciphertext, key, chi2):
+		confidence = super().confidence(ciphertext, key, chi2)
+		if confidence == 0.0:
+			return 0.0
+
+		letters = alphaStream(self.decrypt(utils.textOf(ciphertext).lower(), key))
+		counts = columnCounts(letterCodes(letters), len(self.keyShifts(key)))
+		return confidence * float(np.prod(shiftConfidences(counts)))
+
+	def isPositionIndependent(self):
+		return False
+
+	def incrementalCracker(self):
+		if self.cascade != None:  # A cascade needs the text
+			return cipher.IncrementalCracker(self)
+		return PolyalphabeticCracker(self)
+
+	# A one letter key is just a shift (or a reflection for Beaufort), which Affine covers, so letters that look
+	# monoalphabetic rule these out
+	def triage(self, stats):
+		reason = triage.unprintableReason(stats)
+		if reason != None:
+			return (triage.RULED_OUT, reason)
+		if stats.ioc != None and stats.ioc >= triage.MONOALPHABETIC_IOC:
+			return (triage.RULED_OUT, 'letter coincidence %.2f is monoalphabetic' % stats.ioc)
+		if stats.period != None:
+			return (triage.LIKELY, 'period %d' % stats.period)
+
+		return (triage.POSSIBLE, None)
+
+	def solveColumns(self, letters, keyLen, model=None):
+		"""For each key column, returns all the shifts ranked as a list of (shift, chi2), best first"""
+		return self.rankShifts(columnCounts(letterCodes(letters), keyLen), model)
+
+	# Decrypting with a shift just permutes the letters, so the plaintext counts are the column counts reindexed
+	def shiftSources(self):
+		"""sources[shift, y] is the ciphertext letter that decrypts to y"""
+		sources = np.empty((utils.ALPHABET_SIZE, utils.ALPHABET_SIZE), dtype=np.intp)
+		x = np.arange(utils.ALPHABET_SIZE)
+		for shift in range(utils.ALPHABET_SIZE):
+			(a,b) = self.decryptMap(shift)
+			sources[shift, (a*x+b) % utils.ALPHABET_SIZE] = x
+
+		return sources
+
+	def rankShifts(self, counts, model=None):
+		"""solveColumns from the columnCounts"""
+		if model == None:
+			model = utils.getLanguageModel()
+
+		keyLen = len(counts)
+		chi2 = model.chiSquaredMany(counts[:, self.shiftSources()].reshape(-1, utils.ALPHABET_SIZE)).reshape(keyLen, utils.ALPHABET_SIZE)
+		order = np.argsort(chi2, axis=1, kind='stable')  # Ties go to the lower shift
+
+		return [[(int(shift), float(chi2[i, shift])) for shift in order[i]] for i in range(keyLen)]
+
+	# It's possible that we found the key to be lemonlemon, but really it should just be lemon.  This function refines it
+	def refineKey(self, maybeRepeatKey):
+		length = len(maybeRepeatKey)
+
+		for i in range(1, length):
+			if length % i == 0:
+				if maybeRepeatKey[0:i]*(length//i) == maybeRepeatKey:
+					return maybeRepeatKey[0:i]  # We don't need to look further, this is the best one
+
+		return maybeRepeatKey  # No refining possible
+
+	def findKeyLength(self, ciphertext, keyLengthUpperBound, method='coincidence'):
+		ranked = self.rankKeyLengths(ciphertext, keyLengthUpperBound, method)
+		if len(ranked) == 0:
+			return 1
+
+		return ranked[0][0]   # This shift gave the highest COI, which implies that it's the keylength
+
+	def rankKeyLengths(self, ciphertext, keyLengthUpperBound=KEY_LENGTH_UPPER_BOUND, method='coincidence'):
+		"""Scores every key length 1 <= keyLen < keyLengthUpperBound, returning [(keyLen, score)] most likely first.
+		method is 'coincidence' (text against itself shifted by keyLen), 'friedman' (average IoC of the columns)
+		or 'kasiski' (how well keyLen divides the distances between repeated trigrams).  A prepared ciphertext is
+		taken to be just its letters, which is what crackRanked wants"""
+		if isinstance(ciphertext, utils.PreparedCiphertext):
+			letters = ciphertext.letters.astype(np.intp)
+			symbols = letters
+		else:
+			letters = letterCodes(alphaStream(ciphertext))
+			symbols = np.frombuffer(ciphertext.encode('utf-32-le'), dtype=np.uint32)
+
+		lengths = keyLengthsToTry(len(symbols), keyLengthUpperBound)
+		if len(lengths) == 0:
+			return []
+
+		if method == 'coincidence':
+			scores = self.coincidenceScores(symbols, lengths)
+		elif method == 'friedman':
+			scores = self.friedmanScores(letters, lengths)
+		elif method == 'kasiski':
+			scores = self.kasiskiScores(letters, lengths)
+		else:
+			raise ValueError('Unknown key length method %s' % method)
+
+		return rankedKeyLengths(lengths, scores)
+
+	# Same value as calcIndexOfCoincidence(text, shiftString(text, keyLen)) for the text's char codes, but for every keyLen at once.  The matches
+	# of each symbol at every shift are its circular autocorrelation, which the FFT gives in O(n log n).  The FFT is
+	# zero padded to a power of two (awkward lengths are very slow), which gives the linear autocorrelation, and the
+	# circular one at shift s is then linear[s] + linear[n-s]
+	def coincidenceScores(self, codes, lengths):
+		n = len(codes)
+		fftLength = 1 << (2*n-1).bit_length()
+
+		summation = np.zeros(len(lengths))
+		for symbol in np.unique(codes):
+			spectrum = np.fft.rfft((codes == symbol).astype(np.float64), fftLength)
+			linear = np.fft.irfft(spectrum*np.conj(spectrum), fftLength)
+			matches = np.rint(linear[lengths] + linear[n-lengths])
+			summation += matches*(matches-1)
+
+		return utils.ALPHABET_SIZE*summation/(n*(n-1))
+
+	# Average index of coincidence of the columns you'd get with each key length, letters only
+	def friedmanScores(self, codes, lengths):
+		return np.array([columnCoincidence(columnCounts(codes, keyLen)) for keyLen in lengths], dtype=np.float64)
+
+	# Repeated trigrams are mostly the same plaintext under the same part of the key, so their distances tend to be
+	# multiples of the key length.  Score is how many times more often keyLen divides them than chance would (1/keyLen), less one
+	def kasiskiScores(self, codes, lengths):
+		if len(codes) < 3:
+			return np.zeros(len(lengths))
+
+		trigrams = codes[:-2]*utils.ALPHABET_SIZE**2 + codes[1:-1]*utils.ALPHABET_SIZE + codes[2:]
+		order = np.argsort(trigrams, kind='stable')  # Positions of equal trigrams end up next to each other, in order
+		repeats = trigrams[order][1:] == trigrams[order][:-1]
+		distances = (order[1:]-order[:-1])[repeats]
+
+		if len(distances) == 0:
+			return np.zeros(len(lengths))
+
+		divisible = (distances[None,:] % lengths[:,None] == 0).sum(axis=1)
+		return divisible/len(distances)*lengths - 1
+
+	# Calculates how many times the lined up characters of the two texts match, then uses the index of coincidence formula
+	def calcIndexOfCoincidence(self, text1, text2):
+		numOccurs = {}  # Dictionary mapping alphabet chars to number of times it matches in the two texts
+		for i in range(len(text1)):
+			c = text1[i]
+			if c == text2[i]:
+				numOccurs[c] = numOccurs.setdefault(c, 0) + 1
+
+		summation = 0.0
+		for x in numOccurs.values():
+			summation += x*(x-1)
+
+		text1Len = len(text1)
+		indexOfCoincidence = utils.ALPHABET_SIZE*summation/(text1Len*(text1Len-1))  # Note this requires that the ciphertext must have multiple characters...
+
+		return indexOfCoincidence
+
+	# This is not rot.  It sends the ith character to the (i+shift)th spot, module len(str)
+	def shiftString(self, inStr, shift):
+		shift = shift % len(inStr)  # in case shift is greater (shouldn't be)
+		return inStr[-shift:]+inStr[:-shift] 
+
+
+class PolyalphabeticCracker(cipher.IncrementalCracker):
+	"""Keeps the column counts for every key length up to the bound, plus whatever the key length method needs, so a
+	chunk costs O(len(chunk)*bound) and best() never looks at the text again.  Gives the same answers as crackRanked"""
+
+	def __init__(self, cipher, keyLengthUpperBound=None):
+		super().__init__(cipher)
+		if keyLengthUpperBound == None:
+			keyLengthUpperBound = cipher.keyLengthUpperBound
+		self.keyLengthUpperBound = keyLengthUpperBound
+		self.method = cipher.keyLengthMethod
+
+		self.lengths = np.arange(1, max(2, keyLengthUpperBound))  # Key length 1 is always needed, it's the fallback
+		self.numLetters = 0
+		self.counts = {keyLen: np.zeros((keyLen, utils.ALPHABET_SIZE), dtype=np.int64) for keyLen in self.lengths}
+
+		self.keep = max(len(self.lengths), 2)
+		self.head = np.zeros(0, dtype=np.intp)  # The first and last few letters, what the wrap around of the
+		self.tail = np.zeros(0, dtype=np.intp)  # circular coincidence and the trigrams across chunks need
+		self.matches = np.zeros((utils.ALPHABET_SIZE, len(self.lengths)+1), dtype=np.int64)  # matches[x, s]: x at i and i-s (linear)
+
+		self.lastSeen = np.full(utils.ALPHABET_SIZE**3, -1, dtype=np.int64)  # Where each trigram last started
+		self.divisible = np.zeros(len(self.lengths), dtype=np.int64)  # How many trigram distances each length divides
+		self.numDistances = 0
+
+		if self.method not in ('coincidence', 'friedman', 'kasiski'):
+			raise ValueError('Unknown key length method %s' % self.method)
+
+	def update(self, text):
+		codes = utils.prepare(text).letters.astype(np.intp)
+		if len(codes) == 0:
+			return
+
+		for keyLen in self.lengths:
+			self.counts[keyLen] += columnCounts(codes, keyLen, self.numLetters % keyLen)
+
+		if self.method == 'coincidence':
+			self.updateMatches(codes)
+		elif self.method == 'kasiski':
+			self.updateTrigrams(codes)
+
+		if len(self.head) < self.keep:
+			self.head = np.concatenate((self.head, codes[:self.keep-len(self.head)]))
+		self.tail = np.concatenate((self.tail, codes))[-self.keep:]
+		self.numLetters += len(codes)
+
+	# Only the pairs ending in the new letters are new, and the ones starting before them are all in the tail
+	def updateMatches(self, codes):
+		joined = np.concatenate((self.tail, codes))
+		for shift in self.lengths:
+			start = max(len(self.tail), shift)
+			if start >= len(joined):
+				continue
+			later = joined[start:]
+			same = later == joined[start-shift:len(joined)-shift]
+			self.matches[:, shift] += np.bincount(later[same], minlength=utils.ALPHABET_SIZE)
+
+	# Same distances as kasiskiScores: between each trigram and the one like it before
+	def updateTrigrams(self, codes):
+		joined = np.concatenate((self.tail[-2:], codes))
+		if len(joined) < 3:
+			return
+
+		trigrams = joined[:-2]*utils.ALPHABET_SIZE**2 + joined[1:-1]*utils.ALPHABET_SIZE + joined[2:]
+		positions = np.arange(len(trigrams)) + self.numLetters - min(2, len(self.tail))
+
+		order = np.argsort(trigrams, kind='stable')
+		trigrams = trigrams[order]
+		positions = positions[order]
+
+		first = np.ones(len(trigrams), dtype=bool)
+		first[1:] = trigrams[1:] != trigrams[:-1]
+		previous = np.empty_like(positions)
+		previous[1:] = positions[:-1]
+		previous[first] = self.lastSeen[trigrams[first]]  # The first in the chunk goes back to the chunks before
+
+		distances = (positions-previous)[previous >= 0]
+		self.divisible += (distances[None,:] % self.lengths[:,None] == 0).sum(axis=1)
+		self.numDistances += len(distances)
+
+		last = np.ones(len(trigrams), dtype=bool)
+		last[:-1] = first[1:]
+		self.lastSeen[trigrams[last]] = positions[last]
+
+	def keyLengthScores(self, lengths):
+		n = self.numLetters
+		if self.method == 'coincidence':
+			summation = np.zeros(len(lengths))
+			for i, shift in enumerate(lengths):
+				wrapped = self.head[:shift] == self.tail[len(self.tail)-shift:]  # i with n-shift+i, for i < shift
+				matches = self.matches[:, shift] + np.bincount(self.head[:shift][wrapped], minlength=utils.ALPHABET_SIZE)
+				summation[i] = (matches*(matches-1)).sum()
+			return utils.ALPHABET_SIZE*summation/(n*(n-1))
+		elif self.method == 'friedman':
+			return np.array([columnCoincidence(self.counts[keyLen]) for keyLen in lengths], dtype=np.float64)
+		else:
+			if n < 3 or self.numDistances == 0:
+				return np.zeros(len(lengths))
+			return self.divisible[:len(lengths)]/self.numDistances*lengths - 1
+
+	def bestRanked(self, top=2):
+		bound = cappedKeyLengthUpperBound(self.numLetters, self.keyLengthUpperBound)
+		lengths = keyLengthsToTry(self.numLetters, bound)
+
+		keyLen = 1
+		if len(lengths) > 0:
+			keyLen = rankedKeyLengths(lengths, self.keyLengthScores(lengths))[0][0]
+
+		return self.cipher.rankKeys(keyLen, self.counts.__getitem__, top)
+
+
+class PolyalphabeticTest(unittest.TestCase):
+
+	plaintext = 'cryptographyisthepracticeandstudyoftechniquesforsecurecommunicationinthepresenceofthirdpartiescalledadversariesmoregenerallyitisaboutconstructingandanalyzingprotocolsthatovercometheinfluenceofadversariesandwhicharerelatedtovariousaspectsininformationsecuritysuchasdataconfidentialitydataintegrityauthenticationandnonrepudiationmoderncryptographyintersectsthedisciplinesofmathematicscomputerscienceandelectricalengineeringmoderncryptographyisheavilybasedonmathematicaltheoryandcomputersciencepracticecryptographicalgorithmsaredesignedaroundcomputationalhardnessassumptionsmakingsuchalgorithmshardtobreakinpracticebyanyadversaryitistheoreticallypossibletobreaksuchasystembutitisinfeasibletodosobyanyknownpracticalmeanscryptologyrelatedtechnologyhasraisedanumberoflegalissuestheelectronicfrontierfoundationwasinvolvedinacaseintheunitedstateswhichquestionedwhetherrequiringsuspectedcriminalstoprovidetheirdecryptionkeystolawenforcementisunconstitutionaltheeffarguedthatthisisaviolationoftherightofnotbeingforcedtoincriminateoneselfasgiveninthefifthamendm'
+
+	def test_solveColumns(self):
+		import vigenere  # Need a concrete cipher
+		vigenereInstance = vigenere.Vigenere()
+
+		plaintext = 'frequencyanalysisonnextmonthscipherisnotsoeasybecauseitisnotasubstitutioncipherinitthesameplaintextlettercanbeencryptedtoanyoneofseveraldifferentciphertextletters'
+		letters = vigenereInstance.encrypt(plaintext, 'key')
+		ranked = vigenereInstance.solveColumns(letters, 3)
+
+		self.assertEqual(len(ranked), 3)
+		self.assertEqual(''.join(chr(ord('a')+column[0][0]) for column in ranked), 'key')
+
+		for i, column in enumerate(ranked):
+			self.assertEqual(sorted(shift for (shift, _) in column), list(range(utils.ALPHABET_SIZE)))
+			self.assertEqual([chi2 for (_, chi2) in column], sorted(chi2 for (_, chi2) in column))
+			for (shift, chi2) in column[:3]:  # Same as decrypting the column and scoring it
+				self.assertAlmostEqual(chi2, utils.calcChiSquared(utils.rot(letters[i::3], -shift)))
+
+	def test_rankKeyLengths(self):
+		import vigenere
+		vigenereInstance = vigenere.Vigenere()
+
+		plaintext = self.plaintext
+		ciphertext = vigenereInstance.encrypt(plaintext, 'averyveryverylongkeythat')
+
+		for method in ['coincidence', 'friedman', 'kasiski']:
+			ranked = vigenereInstance.rankKeyLengths(ciphertext, 100, method)
+			self.assertEqual(len(ranked), 99)
+			self.assertEqual(ranked[0][0] % 24, 0)  # Multiples of the key length do just as well
+			self.assertEqual([score for (_, score) in ranked], sorted((score for (_, score) in ranked), reverse=True))
+
+		# Matches the one-shift-at-a-time calculation
+		scores = dict(vigenereInstance.rankKeyLengths(plaintext, 10))
+		for keyLen in range(1, 10):
+			self.assertAlmostEqual(scores[keyLen], vigenereInstance.calcIndexOfCoincidence(plaintext, vigenereInstance.shiftString(plaintext, keyLen)))
+
+		self.assertEqual(vigenereInstance.rankKeyLengths('ab', 20), [(1, 0.0)])
+		with self.assertRaises(ValueError):
+			vigenereInstance.rankKeyLengths(ciphertext, 20, 'guess')
+
+	def test_incrementalCracker(self):
+		import vigenere
+		import beaufort
+
+		plaintext = self.plaintext
+		for instance in [vigenere.Vigenere(), beaufort.Beaufort()]:
+			ciphertext = instance.encrypt(plaintext[:700] + ', ' + plaintext[700:], 'lemon')
+			for method in ['coincidence', 'friedman', 'kasiski']:
+				instance.keyLengthMethod = method
+				cracker = instance.incrementalCracker()
+				start = 0
+				for size in [0, 1, 2, 5, 33, 90, 300]*10:
+					cracker.feed(ciphertext[start:start+size])
+					start += size
+					if size == 300:  # Every so often, check it matches cracking everything so far
+						self.assertEqual(cracker.bestRanked(3), instance.crackRanked(ciphertext[:start], 3))
+				cracker.feed(ciphertext[start:].encode())
+				self.assertEqual(cracker.best(), instance.crack(ciphertext))
+				self.assertEqual(cracker.best()[0], 'lemon')
+
+		self.assertEqual(vigenere.Vigenere().incrementalCracker().best(), vigenere.Vigenere().crack(''))
+
+	def test_alphaStream(self):
+		self.assertEqual(alphaStream('a b, c!d'), 'abcd')
+		self.assertEqual(alphaStream('!!'), '')
+
+	def test_applyColumnMaps(self):
+		self.assertEqual(applyColumnMaps('aaaa', [(1,0), (1,1)]), 'abab')
+		self.assertEqual(applyColumnMaps('a a, a!a', [(1,0), (1,1)]), 'a b, a!b')  # Non-alpha chars don't use up the key
+		self.assertEqual(applyColumnMaps('  abc  ', [(-1,25)]), '  zyx  ')
+		self.assertEqual(applyColumnMaps('', [(1,3)]), '')
+		self.assertEqual(applyColumnMaps('A.b', [(1,1), (1,2)]), 'A.c')
+
+	def test_confidence(self):
+		import vigenere
+		import beaufort
+
+		for instance in [vigenere.Vigenere(), beaufort.Beaufort()]:
+			ciphertext = instance.encrypt(self.plaintext, 'lemon')
+			(key, chi2) = instance.crack(ciphertext)
+			self.assertGreater(instance.confidence(ciphertext, key, chi2), 0.99)
+
+			for wrongKey in ['lemoa', 'aemon', 'lxmon']:  # One of five wrong, the letters as a whole still look English
+				chi2 = instance.scoreKey(ciphertext, wrongKey)
+				self.assertLess(instance.confidence(ciphertext, wrongKey, chi2), 0.01)
+			self.assertGreater(utils.plaintextConfidence(instance.decrypt(ciphertext, 'lemoa')), 0.5)
+
+		counts = columnCounts(letterCodes(self.plaintext[:300]), 3)
+		self.assertTrue(all(shiftConfidences(counts) > 0.99))
+		self.assertTrue(all(shiftConfidences(np.roll(counts, 1, axis=1)) < 0.01))
+
+	def test_emptyKey(self):
+		import vigenere
+
+		with self.assertRaises(ValueError):
+			vigenere.Vigenere().encrypt('abc', '')
+		with self.assertRaises(ValueError):
+			vigenere.Vigenere().decryptChunks(['abc'], '')
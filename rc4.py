@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import utils
+import unittest
+import stream
+
+np = utils.lazyImport('numpy')
+
+class Rc4(stream.Stream):
+
+	minReadRate = 0.3  # Same as xor
+
+	def encrypt(self, plaintext, key):
+		state = self.initState(key)
+		return super().applyPrf(plaintext, state)
+
+	def decrypt(self, ciphertext, key):
+		return self.encrypt(ciphertext, key)  # Symmetric
+
+	def initState(self, seed):  # Key scheduling, seed is the key as str or bytes
+		key = seed.encode('latin-1') if isinstance(seed, str) else bytes(seed)
+		if not 1 <= len(key) <= 256:
+			raise ValueError('RC4 key must be 1-256 bytes, got %d' % len(key))
+
+		S = list(range(256))
+		j = 0
+		for i in range(256):
+			j = (j + S[i] + key[i % len(key)]) & 0xff
+			(S[i], S[j]) = (S[j], S[i])
+
+		return (S, 0, 0)
+
+	def prf(self, state):
+		(nextBytes, state) = self.keystream(state, 1)
+		return (nextBytes[0], state)
+
+	def keystream(self, state, n):
+		(S, i, j) = state
+		S = list(S)  # The caller's state is left alone, so it can be reused
+		out = bytearray(n)
+
+		for k in range(n):
+			i = (i + 1) & 0xff
+			j = (j + S[i]) & 0xff
+			(S[i], S[j]) = (S[j], S[i])
+			out[k] = S[(S[i] + S[j]) & 0xff]
+
+		return (bytes(out), (S, i, j))
+
+	def decryptBatch(self, codes, keys):
+		keystreams = [self.keystream(self.initState(key), len(codes))[0] for key in keys]
+		return codes[None,:] ^ np.frombuffer(b''.join(keystreams), dtype=np.uint8).reshape(len(keys), len(codes))
+
+	def genKeys(self):
+		return (bytes([k]) for k in range(256))  # Only the weakest keys, anything longer is out of reach
+
+	def genKeyRange(self, start, end=None):
+		return (bytes([k]) for k in range(start, 256 if end == None else min(end, 256)))
+
+	def countKeys(self):
+		return 256
+
+	def crack(self, ciphertext):
+		return super().bruteForce(ciphertext, self.minReadRate)
+
+	def getNameOfCipher(self, key=None):
+		return 'RC4 (Stream)'
+
+	def usage(self):
+		print('Key is a string (or bytes) 1-256 bytes long')
+
+class Rc4Test(unittest.TestCase):
+
+	def setUp(self):
+		self.rc4Instance = Rc4()
+
+	def test_encrypt(self):
+		self.assertEqual(self.rc4Instance.encrypt(b'Plaintext', 'Key'), bytes.fromhex('bbf316e8d940af0ad3'))
+		self.assertEqual(self.rc4Instance.encrypt(b'pedia', b'Wiki'), bytes.fromhex('1021bf0420'))
+		self.assertEqual(self.rc4Instance.encrypt('Attack at dawn', 'Secret'), bytes.fromhex('45a01f645fc35b383552544b9bf5').decode('latin-1'))
+
+		with self.assertRaises(ValueError):
+			self.rc4Instance.encrypt('abc', '')
+
+	def test_identity(self):
+		plaintext = 'some text to encrypt'
+		self.assertEqual(self.rc4Instance.decrypt(self.rc4Instance.encrypt(plaintext, 'key'), 'key'), plaintext)
+
+	def test_keystream(self):
+		state = self.rc4Instance.initState('Key')
+		(whole, _) = self.rc4Instance.keystream(state, 10)
+		(first, middle) = self.rc4Instance.keystream(state, 4)
+		(second, _) = self.rc4Instance.keystream(middle, 6)
+		self.assertEqual(first+second, whole)
+		self.assertEqual(self.rc4Instance.prf(state)[0], whole[0])
+
+	def test_decryptChunks(self):
+		ciphertext = self.rc4Instance.encrypt(b'Attack at dawn', 'Secret')
+		chunks = [ciphertext[:3], ciphertext[3:4], ciphertext[4:]]
+		self.assertEqual(b''.join(self.rc4Instance.decryptChunks(chunks, 'Secret')), b'Attack at dawn')
+
+	def test_crack(self):
+		plaintext = 'this is a reasonably long english sentence, which should be simple to find the key for.'
+		ciphertext = self.rc4Instance.encrypt(plaintext, b'\x9c')
+		(key, _) = self.rc4Instance.crack(ciphertext)
+		self.assertEqual(key, b'\x9c')
+
+	def test_genKeyRange(self):
+		self.assertEqual(list(self.rc4Instance.genKeyRange(250)), list(self.rc4Instance.genKeys())[250:])
+		self.assertEqual(self.rc4Instance.countKeys(), 256)
+
+	def test_halving(self):
+		plaintext = 'this is a reasonably long english sentence, which should be simple to find the key for. '*8
+		ciphertext = self.rc4Instance.encrypt(plaintext, b'\x9c')
+		ranked = self.rc4Instance.bruteForceRanked(ciphertext, self.rc4Instance.minReadRate, 3)
+
+		self.rc4Instance.halving = True
+		self.assertEqual(self.rc4Instance.bruteForceRanked(ciphertext, self.rc4Instance.minReadRate, 3), ranked)
+		self.assertEqual(self.rc4Instance.crack(ciphertext), ranked[0])
+
+	def test_acceptConfidence(self):
+		plaintext = 'this is a reasonably long english sentence, which should be simple to find the key for.'
+		ciphertext = self.rc4Instance.encrypt(plaintext, b'\x1c')
+		(key, chi2) = self.rc4Instance.crack(ciphertext)
+		self.assertGreater(self.rc4Instance.confidence(ciphertext, key, chi2), 0.99)
+
+		self.rc4Instance.acceptConfidence = 0.99
+		self.assertEqual(self.rc4Instance.crack(ciphertext), (key, chi2))
+		self.assertEqual(self.rc4Instance.confidence(ciphertext, None, float('inf')), 0.0)
+
+	def test_incrementalCracker(self):
+		plaintext = 'this is a reasonably long english sentence, which should be simple to find the key for.'
+		ciphertext = self.rc4Instance.encrypt(plaintext.encode(), b'\x9c')
+		cracker = self.rc4Instance.incrementalCracker()  # Nothing to keep running, so it's just the text
+		cracker.feed(ciphertext[:40])
+		cracker.feed(ciphertext[40:])
+		self.assertEqual(cracker.best(), self.rc4Instance.crack(ciphertext.decode('latin-1')))
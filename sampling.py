@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# Cracking on a sample of a big ciphertext.  Key recovery stops getting better long before the end of a big input,
+# so the sample starts small and doubles until the best key is clearly and consistently ahead
+
+import math
+import random
+import unittest
+import utils
+
+INITIAL_SAMPLE_SIZE = 1024
+MAX_SAMPLE_SIZE = 1 << 18  # If it isn't stable by here (usually the wrong cipher), more text won't help much
+NUM_WINDOWS = 8  # Samples are spread over this many windows, so one odd part of the input can't skew them
+MARGIN_Z = 3.0  # The runner up has to be this many standard deviations (of a chi-squared) behind
+STABLE_ROUNDS = 2  # and the best key the same for this many sample sizes in a row
+
+# Standard deviation of a chi-squared with ALPHABET_SIZE-1 degrees of freedom
+_CHI2_STD = math.sqrt(2*(utils.ALPHABET_SIZE-1))
+
+# size chars of data as a str.  When the cipher can decrypt any piece on its own, they come from windows spread evenly
+# over data, otherwise it has to be the start.  data can be a str, bytes or an mmap
+def takeSample(data, size, positionIndependent=True, windows=NUM_WINDOWS):
+    n = len(data)
+    if size >= n:
+        pieces = [data[:]]
+    elif not positionIndependent or windows <= 1:
+        pieces = [data[:size]]
+    else:
+        windowSize = size // windows
+        stride = n // windows
+        pieces = [data[i*stride:i*stride+windowSize] for i in range(windows)]
+
+    if isinstance(data, str):
+        return ''.join(pieces)
+    return b''.join(pieces).decode('latin-1')
+
+def sampleCrack(cipher, data, initialSize=INITIAL_SAMPLE_SIZE, maxSize=MAX_SAMPLE_SIZE, z=MARGIN_Z, stableRounds=STABLE_ROUNDS):
+    """Cracks data with cipher on a sample that grows until the best key is stable.  Returns (key, chi2, sampleSize),
+    where chi2 is that of the final sample, so the full input only needs decrypting once the key is known"""
+    size = initialSize
+    lastKey = None
+    streak = 0
+
+    while True:
+        sample = takeSample(data, size, cipher.isPositionIndependent())
+        if cipher.onlyLowerCase():
+            sample = sample.lower()
+
+        ranked = cipher.crackRanked(sample, 2)
+        if len(ranked) == 0:
+            ranked = [(None, math.inf)]  # Nothing readable, which is just as good an answer if it keeps happening
+
+        (key, chi2) = ranked[0]
+        margin = ranked[1][1]-chi2 if len(ranked) > 1 else math.inf
+
+        if key == lastKey and margin >= z*_CHI2_STD:
+            streak += 1
+        else:
+            streak = 1 if margin >= z*_CHI2_STD else 0
+        lastKey = key
+
+        if streak >= stableRounds or size >= min(len(data), maxSize):
+            return (key, chi2, min(size, len(data)))
+
+        size *= 2
+
+
+class SamplingTest(unittest.TestCase):
+
+    words = 'the of and to in is you that it he was for on are as with his they at be this have from or one had by word but not what all were we when your can said there use an each which she do how their if will up other about out many then them these so some her would make like him into time has look two more write go see number no way could people my than first water been call who oil its now find long down day did get come made may part'.split()
+    plaintext = ' '.join(random.Random(1).choices(words, k=40000))  # Big, and without any repeating period
+
+    def test_takeSample(self):
+        data = 'abcdefghijklmnopqrstuvwxyz'
+        self.assertEqual(takeSample(data, 8, True, 4), 'abghmnst')
+        self.assertEqual(takeSample(data, 8, False, 4), 'abcdefgh')
+        self.assertEqual(takeSample(data.encode(), 100), data)
+
+    def test_sampleCrack(self):
+        import affine
+        import vigenere
+
+        affineInstance = affine.Affine()
+        ciphertext = affineInstance.encrypt(self.plaintext, (7,2))
+        (key, _, sampleSize) = sampleCrack(affineInstance, ciphertext.encode())
+        self.assertEqual(key, (7,2))
+        self.assertLess(sampleSize, len(ciphertext)//10)
+
+        vigenereInstance = vigenere.Vigenere()
+        ciphertext = vigenereInstance.encrypt(self.plaintext, 'lemon')
+        (key, _, sampleSize) = sampleCrack(vigenereInstance, ciphertext)
+        self.assertEqual(key, 'lemon')
+        self.assertLess(sampleSize, len(ciphertext)//10)
+
+        (_, _, sampleSize) = sampleCrack(affineInstance, ciphertext, 1024, 4096, z=1e9)  # Never sure enough
+        self.assertEqual(sampleSize, 4096)
+
+        # Too short to ever be sure, so it just uses everything
+        (key, _, sampleSize) = sampleCrack(affineInstance, affineInstance.encrypt('hello there', (7,2)))
+        self.assertEqual(sampleSize, len('hello there'))
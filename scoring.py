@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+# Scorers rate candidate plaintexts, lower is better (like chi2).  The ciphers rank every key by the letter chi2, since
+# that's the one their fast paths can work out for thousands of keys at once (from histograms, column counts...).  But
+# a low chi2 can be bogus (a handful of letters among junk, or a short text that happens to fit), so a Cascade takes
+# the best few by chi2 and ranks them again with costlier scorers (trigrams, whole words), each stage keeping fewer.
+# The expensive scorers only ever see a few dozen candidates, however many keys there were.  A cascade only changes
+# the order, the chi2 each key is reported with stays the same.  So results from ciphers with and without a cascade
+# still compare with each other, and with chi2s cached before there was one (see cache.py)
+
+from abc import ABC, abstractmethod
+import os
+import re
+import tempfile
+import unittest
+
+import utils
+import ngram
+
+np = utils.lazyImport('numpy')
+
+CASCADE_WIDTH = 32  # How many of the best by chi2 go on to the next scorer
+STAGE_KEEP = 8  # and how many each scorer after that keeps
+
+# Most common English words, enough that real text is mostly hits and a wrong key almost never is
+COMMON_WORDS = frozenset('''
+a about after all also an and any are as at be because been but by can come could day do even first for from get give
+go good have he her him his how i if in into is it its just know like look make me most my new no not now of on one
+only or other our out over people say see she so some take than that the their them then there these they think this
+time to two up us use want was way we well what when which who will with would year you your
+'''.split())
+
+_words = re.compile('[a-z]+')
+
+class Scorer(ABC):
+    """Rates a candidate plaintext, lower is better"""
+
+    name = None  # What the scorer is called on the command line (see makeCascade)
+
+    @abstractmethod
+    def score(self, text):
+        """The score of one plaintext (str)"""
+
+    def scoreMany(self, texts):
+        return [self.score(text) for text in texts]
+
+    def check(self):
+        """Raises ValueError if the scorer can't be used (its data isn't there), so that's known before any cracking"""
+
+    def __repr__(self):
+        return self.name
+
+class ChiSquaredScorer(Scorer):
+    """Letter frequencies against the language model, what everything has always been scored on"""
+    name = 'chi2'
+
+    def score(self, text):
+        return utils.calcChiSquared(text)
+
+class TrigramScorer(Scorer):
+    """Trigram log likelihood per letter (see ngram.py), negated so lower is better.  Only the model's file name is
+    kept, so ciphers with a cascade can still be pickled to worker processes"""
+    name = 'trigrams'
+
+    def __init__(self, filename=ngram.TRIGRAMS_FILE):
+        self.filename = filename
+
+    def score(self, text):
+        return -ngram.getNgramModel(self.filename).fitness(text)
+
+    def scoreMany(self, texts):  # The candidates are usually all as long as the ciphertext, so they go as one matrix
+        codes = [utils.textToCodes(utils.textOf(text)) for text in texts]
+        if len(codes) == 0 or any(row is None or len(row) != len(codes[0]) for row in codes):
+            return super().scoreMany(texts)
+
+        return (-ngram.getNgramModel(self.filename).fitnessMany(np.stack(codes))).tolist()
+
+    def check(self):  # The model isn't shipped, it has to be built with ngram.py
+        try:
+            ngram.getNgramModel(self.filename)
+        except OSError as err:
+            raise ValueError('No trigram model (%s), build one with ngram.py' % err) from err
+
+class WordScorer(Scorer):
+    """How much of the text is made of common words, negated so lower is better.  Cheap and very hard to fool, but it
+    needs the spaces to still be there"""
+    name = 'words'
+
+    def __init__(self, words=COMMON_WORDS):
+        self.words = words
+
+    def score(self, text):
+        words = _words.findall(utils.textOf(text).lower())
+        numLetters = sum(len(word) for word in words)
+        if numLetters == 0:
+            return 0.0
+
+        return -sum(len(word) for word in words if word in self.words)/numLetters
+
+SCORERS = {scorer.name: scorer for scorer in [ChiSquaredScorer, TrigramScorer, WordScorer]}
+
+class Cascade:
+    """Scorers from cheapest to costliest.  The first is always chi2, which the ciphers rank every key by themselves,
+    so the cascade takes over from the best width of those.  Each later scorer ranks what's left and keeps keep"""
+
+    def __init__(self, scorers, width=CASCADE_WIDTH, keep=STAGE_KEEP):
+        self.scorers = [scorer for scorer in scorers if not isinstance(scorer, ChiSquaredScorer)]
+        self.width = width
+        self.keep = keep
+
+    def __repr__(self):  # Part of a cipher's settings, so it goes into cache.cipherName
+        return 'Cascade(%r, %d, %d)' % (self.scorers, self.width, self.keep)
+
+    def rerank(self, candidates, plaintextOf):
+        """candidates are best first by chi2 (at most width of them are looked at).  plaintextOf(candidate) decrypts
+        one, it's only called once per candidate.  Returns what's left, best first"""
+        candidates = list(candidates[:self.width])
+        plaintexts = [plaintextOf(candidate) for candidate in candidates]
+
+        for scorer in self.scorers:
+            scores = scorer.scoreMany(plaintexts)
+            order = sorted(range(len(candidates)), key=lambda i: scores[i])[:self.keep]  # Stable, ties stay in chi2 order
+            candidates = [candidates[i] for i in order]
+            plaintexts = [plaintexts[i] for i in order]
+
+        return candidates
+
+# A cascade from scorer names ('words,trigrams'), chi2 first whether it's listed or not
+def makeCascade(names, width=CASCADE_WIDTH, keep=STAGE_KEEP):
+    scorers = []
+    for name in names.split(','):
+        if name not in SCORERS:
+            raise ValueError('Unknown scorer %s, they are %s' % (name, ', '.join(SCORERS)))
+        scorers.append(SCORERS[name]())
+        scorers[-1].check()
+
+    return Cascade(scorers, width, keep)
+
+
+class ScoringTest(unittest.TestCase):
+
+    def test_scorers(self):
+        self.assertEqual(ChiSquaredScorer().score('hello there'), utils.calcChiSquared('hello there'))
+        self.assertEqual(WordScorer().score('the cat, and the hat'), -9/15)
+        self.assertEqual(WordScorer().score('!!!'), 0.0)
+        self.assertLess(WordScorer().score('it was the best of times'), WordScorer().score('qt wzs tge besx gf tjmez'))
+
+    def test_cascade(self):
+        cascade = makeCascade('chi2,words', 3, 2)
+        self.assertEqual(repr(cascade), 'Cascade([words], 3, 2)')
+        with self.assertRaises(ValueError):
+            makeCascade('chi2,guess')
+        with self.assertRaises(ValueError):
+            TrigramScorer('data/no_such_trigrams.bin').check()
+
+        plaintexts = {'a': 'xq zt vb', 'b': 'so it is', 'c': 'the end', 'd': 'it is the end'}
+        candidates = [('a', 1.0), ('b', 2.0), ('c', 3.0), ('d', 4.0)]  # d is past the width, so never looked at
+        self.assertEqual(cascade.rerank(candidates, lambda candidate: plaintexts[candidate[0]]), [('b', 2.0), ('c', 3.0)])
+
+    def test_trigramScorer(self):
+        import polyalphabetic
+
+        plaintext = polyalphabetic.PolyalphabeticTest.plaintext
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'trigrams.bin')
+            ngram.NgramModel.fromCounts({plaintext[i:i+3]: 1 for i in range(len(plaintext)-2)}).save(filename)
+            scorer = TrigramScorer(filename)
+
+            for texts in [['the end is near', 'Qx zv, wt nope!', 'a b            '], ['the end is near', 'qxzvw', '\u263a the end']]:
+                scores = scorer.scoreMany(texts)  # As one matrix, then one at a time (lengths differ, or not all bytes)
+                for (text, score) in zip(texts, scores):
+                    self.assertAlmostEqual(score, scorer.score(text), 5)
+            self.assertEqual(scorer.scoreMany([]), [])
+
+    # Short texts where the lowest chi2 is a bogus key, which words put right
+    def test_crack(self):
+        import affine
+        import xor
+
+        for (cipher, plaintext, key) in [(xor.Xor(), 'i will do it', 0x42), (affine.Affine(), 'what is it', (5,7))]:
+            ciphertext = cipher.encrypt(plaintext, key)
+            self.assertNotEqual(cipher.crack(ciphertext)[0], key)
+
+            cipher.cascade = makeCascade('words')
+            (crackedKey, chi2) = cipher.crack(ciphertext)
+            self.assertEqual(crackedKey, key)
+            self.assertAlmostEqual(chi2, cipher.scoreKey(ciphertext, key, cipher.minReadRate))
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+# Long running decrypt service.  Starting python and loading the ciphers and language models costs far more than cracking
+# a short message, so this does it once and then takes requests over a socket: one JSON object per line in, one per line
+# back out.  Requests are
+#   {"id": ..., "op": "crack", "ciphertext": ...}                                (the result is the same as decrypt.py -b's)
+#   {"id": ..., "op": "decrypt", "ciphertext": ..., "cipher": ..., "key": ...}   (key as a python literal, like -k)
+# and anything that goes wrong comes back as {"id": ..., "error": ...}.  Cracking is done in a pool of processes, each
+# crack on its own so they spread over every worker, and the cheap requests that come in together go to it as one batch
+
+import asyncio
+import concurrent.futures
+import getopt
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import cache
+import decrypt
+
+DEFAULT_ADDRESS = '127.0.0.1:8737'
+BATCH_WINDOW = 0.002  # Seconds a request waits for others to go in the same batch
+MAX_BATCH = 64
+WARM_UP_CIPHERTEXT = 'uryyb gurer, gur svefg erdhrfg fubhyqa\'g unir gb jnvg'  # Cracked by each worker as it starts
+STREAM_LIMIT = 1 << 26  # Longest request line, asyncio's default of 64K is too short for a real ciphertext
+
+def main(argv):
+    address = DEFAULT_ADDRESS
+    workers = None
+    resultCache = None
+
+    try:
+        opts, args = getopt.getopt(argv, "ha:p:C:")
+    except getopt.GetoptError as err:
+        print(err)
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit()
+        elif opt == '-a':
+            address = arg
+        elif opt == '-p':
+            workers = int(arg)
+        elif opt == '-C':
+            resultCache = cache.ResultCache(arg)
+
+    asyncio.run(serve(address, workers, resultCache))
+
+def usage():
+    print('Usage: ./service.py [-a <host:port | unix socket path>] [-p <workers>] [-C <cache file>]')
+    print('Then ./decrypt.py -r <address> ... to use it')
+
+# host:port is TCP, anything else is the path of a unix socket
+def parseAddress(address):
+    (host, _, port) = address.rpartition(':')
+    if host and port.isdigit():
+        return ('tcp', (host, int(port)))
+    return ('unix', address)
+
+# Run once in each worker process, so the first request doesn't pay for it.  numpy and the parts of it the ciphers use
+# (numpy.fft...) are only imported when they're first used (see utils.lazyImport), so a short crack is the surest way
+# to load everything a real one will.  The slow cipher modules too, as a decrypt can name them
+def warmUp():
+    decrypt.crackRecord((None, WARM_UP_CIPHERTEXT))
+    for name in decrypt.cipherNames():
+        decrypt.findCipher(name)
+
+def handleRequest(request, resultCache=None):
+    op = request.get('op', 'crack')
+    if op == 'crack':
+        return decrypt.crackRecord((request.get('id'), request['ciphertext']), resultCache)
+    elif op == 'decrypt':
+        cipher = decrypt.findCipher(request.get('cipher'))
+        if cipher == None:
+            raise ValueError('Unknown cipher %s' % request.get('cipher'))
+        key = request['key']
+        if isinstance(key, str):
+            key = decrypt.parseKey(key)
+        return {'id': request.get('id'), 'plaintext': decrypt.decryptWith(cipher, request['ciphertext'], key)}
+    else:
+        raise ValueError('Unknown op %s' % op)
+
+# Cracks are CPU bound, so each one is a job of its own and they spread over every worker.  Everything else (decrypts
+# with a known key) is cheaper than sending it off, so those all go as one job.  Jobs are lists of indices into requests
+def splitJobs(requests):
+    isCrack = [request.get('op', 'crack') == 'crack' for request in requests]
+    cheap = [i for i in range(len(requests)) if not isCrack[i]]
+    return [[i] for i in range(len(requests)) if isCrack[i]] + ([cheap] if cheap else [])
+
+# What a worker gets: a job (see splitJobs), answered in the same order.  One bad request doesn't spoil the rest
+def handleRequests(requests, resultCache=None):
+    responses = []
+    for request in requests:
+        try:
+            responses.append(handleRequest(request, resultCache))
+        except Exception as err:
+            responses.append(errorResponse(request, err))
+
+    return responses
+
+def errorResponse(request, err):
+    requestId = request.get('id') if isinstance(request, dict) else None
+    return {'id': requestId, 'error': '%s: %s' % (type(err).__name__, err)}
+
+class DecryptService:
+
+    def __init__(self, workers=None, batchWindow=BATCH_WINDOW, maxBatch=MAX_BATCH, resultCache=None):
+        self.executor = concurrent.futures.ProcessPoolExecutor(workers, initializer=warmUp)
+        self.resultCache = resultCache
+        self.batchWindow = batchWindow
+        self.maxBatch = maxBatch
+        self.queue = asyncio.Queue()
+        self.batcher = None
+        self.server = None
+
+    async def start(self, address):
+        self.batcher = asyncio.ensure_future(self.batchRequests())
+
+        (kind, where) = parseAddress(address)
+        if kind == 'tcp':
+            self.server = await asyncio.start_server(self.handleConnection, *where, limit=STREAM_LIMIT)
+        else:
+            if os.path.exists(where):
+                os.unlink(where)  # Left over from a service that didn't get to clean up
+            self.server = await asyncio.start_unix_server(self.handleConnection, where, limit=STREAM_LIMIT)
+
+        return self.server
+
+    async def close(self):
+        if self.server != None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.batcher != None:
+            self.batcher.cancel()
+        self.executor.shutdown(cancel_futures=True)
+
+    async def submit(self, request):
+        """Queues the request for the next batch, and returns its response once it's done"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future))
+        return await future
+
+    # Takes whatever arrives within batchWindow of the first request (up to maxBatch) and sends it off in jobs (see
+    # splitJobs).  The batches run concurrently, so it's straight back to collecting the next one
+    async def batchRequests(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batchWindow
+            while len(batch) < self.maxBatch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            asyncio.ensure_future(self.runBatch(batch))
+
+    async def runBatch(self, batch):
+        requests = [request for (request, _) in batch]
+        await asyncio.gather(*(self.runJob([batch[i] for i in job]) for job in splitJobs(requests)))
+
+    async def runJob(self, batch):
+        requests = [request for (request, _) in batch]
+        try:
+            responses = await asyncio.get_running_loop().run_in_executor(self.executor, handleRequests, requests, self.resultCache)
+        except Exception as err:  # The whole job failed (a worker died...), so every request did
+            responses = [errorResponse(request, err) for request in requests]
+
+        for ((_, future), response) in zip(batch, responses):
+            if not future.done():
+                future.set_result(response)
+
+    # A connection can send many requests without waiting, the responses come back as they're ready (match them by id)
+    async def handleConnection(self, reader, writer):
+        pending = set()
+        lock = asyncio.Lock()
+
+        async def answer(request):
+            response = await self.submit(request)
+            async with lock:
+                writer.write((json.dumps(response) + '\n').encode('utf-8'))
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('Request should be a JSON object')
+                except ValueError as err:
+                    async with lock:
+                        writer.write((json.dumps(errorResponse(None, err)) + '\n').encode('utf-8'))
+                    continue
+
+                task = asyncio.ensure_future(answer(request))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        finally:
+            writer.close()
+
+async def serve(address=DEFAULT_ADDRESS, workers=None, resultCache=None):
+    service = DecryptService(workers, resultCache=resultCache)
+    server = await service.start(address)
+    print('Serving on %s' % address)
+    sys.stdout.flush()
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+# The client side, plain blocking sockets since it's just one request and one response
+def requestService(address, request, timeout=None):
+    (kind, where) = parseAddress(address)
+    if kind == 'tcp':
+        sock = socket.create_connection(where, timeout)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(where)
+
+    with sock, sock.makefile('rwb') as stream:
+        stream.write((json.dumps(request) + '\n').encode('utf-8'))
+        stream.flush()
+        line = stream.readline()
+
+    if not line:
+        raise ConnectionError('No response from %s' % address)
+    return json.loads(line)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
+
+
+
+class ServiceTest(unittest.TestCase):
+
+    def test_parseAddress(self):
+        self.assertEqual(parseAddress('127.0.0.1:8737'), ('tcp', ('127.0.0.1', 8737)))
+        self.assertEqual(parseAddress('/tmp/decrypt.sock'), ('unix', '/tmp/decrypt.sock'))
+
+    def test_handleRequests(self):
+        responses = handleRequests([ {'id': 1, 'ciphertext': 'qbkkz yqbob kbyt tbb vg yqvt lbyt buroxeybw zo uzy mx hggvub.'}
+                                   , {'id': 2, 'op': 'decrypt', 'ciphertext': 'ihhwvc swfrcp', 'cipher': 'affine', 'key': '(5,8)'}
+                                   , {'id': 3, 'op': 'decrypt', 'ciphertext': 'abc', 'cipher': 'enigma', 'key': '1'}
+                                   ])
+        self.assertEqual(responses[0]['plaintext'], 'hello there lets see if this gets encrypted or not by affine.')
+        self.assertEqual(responses[1], {'id': 2, 'plaintext': 'affine cipher'})
+        self.assertEqual(responses[2]['id'], 3)
+        self.assertIn('enigma', responses[2]['error'])
+
+    def test_splitJobs(self):
+        requests = [{'ciphertext': 'a'}, {'op': 'decrypt'}, {'op': 'crack'}, {'op': 'decrypt'}]
+        self.assertEqual(splitJobs(requests), [[0], [2], [1, 3]])
+        self.assertEqual(splitJobs(requests[1:2]), [[0]])
+
+    def test_warmUp(self):  # In a fresh process, as this one has long since loaded everything
+        check = ('import sys, service; service.warmUp()\n'
+                 'print([name for name in ["numpy.fft", "vigenere", "lcg"] if name not in sys.modules])')
+        result = subprocess.run([sys.executable, '-c', check], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    def test_service(self):
+        async def run(address):
+            service = DecryptService(2)
+            await service.start(address)
+            try:
+                # Several at once on one connection, so they're batched together
+                (reader, writer) = await asyncio.open_unix_connection(address)
+                for i in range(5):
+                    writer.write((json.dumps({'id': i, 'op': 'decrypt', 'ciphertext': 'bcd', 'cipher': 'affine', 'key': [1, i]}) + '\n').encode())
+                writer.write(b'not json\n')
+                await writer.drain()
+                responses = [json.loads(await reader.readline()) for _ in range(6)]
+                writer.close()
+
+                crack = await asyncio.to_thread(requestService, address, {'id': 'a', 'ciphertext': 'ihhwvc swfrcp'})
+            finally:
+                await service.close()
+
+            return (responses, crack)
+
+        with tempfile.TemporaryDirectory() as directory:
+            (responses, crack) = asyncio.run(run(os.path.join(directory, 'decrypt.sock')))
+
+        errors = [response for response in responses if 'error' in response]
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(sorted((response['id'], response['plaintext']) for response in responses if 'error' not in response),
+                         [(0, 'bcd'), (1, 'abc'), (2, 'zab'), (3, 'yza'), (4, 'xyz')])
+        self.assertEqual(crack['id'], 'a')
+        self.assertIn('plaintext', crack)
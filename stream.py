@@ -2,18 +2,63 @@
 
 from abc import abstractmethod
 import cipher
+import utils
+import triage
+import unittest
 
 class Stream(cipher.AbstractBruteForceCipher):
 
+	# Takes str or anything bytes-like, and gives back the same kind (bytes for bytes-like)
 	def applyPrf(self, plaintext, state):
-		ciphertext = ''
+		return self.applyPrfAndState(plaintext, state)[0]
+
+	# Same, but also gives back the state at the end, so the next chunk can carry on from there
+	def applyPrfAndState(self, plaintext, state):
+		plaintext = utils.textOf(plaintext)
+		if not isinstance(plaintext, str):
+			return self.applyKeystream(plaintext, state)
+
+		try:
+			data = plaintext.encode('latin-1')  # One char per byte, so the keystream lines up
+		except UnicodeEncodeError:
+			return self.applyPrfToChars(plaintext, state)
+
+		(ciphertext, state) = self.applyKeystream(data, state)
+		return (ciphertext.decode('latin-1'), state)
+
+	# The old char by char way, only needed when some char doesn't fit in a byte
+	def applyPrfToChars(self, plaintext, state):
+		ciphertext = []
 
-		lowera = ord('a')
 		for c in plaintext:
 			(nextByte, state) = self.prf(state)
-			ciphertext += chr(ord(c) ^ nextByte)
+			ciphertext.append(chr(ord(c) ^ nextByte))
+
+		return (''.join(ciphertext), state)
 
-		return ciphertext
+	# Every stream cipher here encrypts (and decrypts) by XORing with the keystream from initState(key)
+	def encryptChunks(self, chunks, key):
+		state = self.initState(key)
+		for chunk in chunks:
+			(ciphertext, state) = self.applyPrfAndState(chunk, state)
+			yield ciphertext
+
+	def decryptChunks(self, chunks, key):
+		return self.encryptChunks(chunks, key)
+
+	def applyKeystream(self, data, state):
+		"""XORs a bytes-like buffer with the keystream from state on.  Returns the result as bytes, and the new state"""
+		(keystream, state) = self.keystream(state, len(data))
+		return (utils.xorBytes(data, keystream), state)
+
+	def keystream(self, state, n):
+		"""Returns n bytes of keystream starting at state, and the state after them.  Subclasses should override this
+		with something that makes the whole block at once, this default just calls prf once per byte"""
+		out = bytearray(n)
+		for i in range(n):
+			(out[i], state) = self.prf(state)
+
+		return (bytes(out), state)
 
 	@abstractmethod
 	def initState(self, seed):
@@ -27,3 +72,59 @@ class Stream(cipher.AbstractBruteForceCipher):
 	def onlyLowerCase(self):
 		return False
 
+	def isPositionIndependent(self):
+		return False  # The keystream moves on with every byte
+
+	# A keystream looks like random bytes, and xoring with it leaves very little printable and the bytes all about as
+	# common as each other
+	def triage(self, stats):
+		if stats.length >= triage.MIN_BYTES and stats.printableRate >= triage.RANDOM_PRINTABLE_RATE:
+			return (triage.RULED_OUT, '%.0f%% printable, a keystream would have scrambled that' % (100*stats.printableRate))
+		if stats.length >= triage.MIN_ENTROPY_BYTES and stats.entropy <= triage.MAX_TEXT_ENTROPY:
+			return (triage.RULED_OUT, 'entropy of %.2f bits per byte is too low for a keystream' % stats.entropy)
+		if stats.length >= triage.MIN_BYTES and stats.printableRate < triage.MIN_PRINTABLE_RATE:
+			return (triage.LIKELY, 'only %.0f%% printable' % (100*stats.printableRate))
+
+		return (triage.POSSIBLE, None)
+
+
+class StreamTest(unittest.TestCase):
+
+	class Counter(Stream):  # Smallest possible PRF, the keystream is just 0, 1, 2...
+		def encrypt(self, plaintext, key):
+			return self.applyPrf(plaintext, self.initState(key))
+		def decrypt(self, ciphertext, key):
+			return self.encrypt(ciphertext, key)
+		def initState(self, seed):
+			return seed
+		def prf(self, state):
+			return (state % 256, state+1)
+		def genKeys(self):
+			return range(256)
+		def crack(self, ciphertext):
+			return self.bruteForce(ciphertext)
+		def getNameOfCipher(self, key=None):
+			return 'Counter'
+		def usage(self):
+			pass
+
+	def setUp(self):
+		self.counterInstance = StreamTest.Counter()
+
+	def test_keystream(self):
+		self.assertEqual(self.counterInstance.keystream(254, 4), (b'\xfe\xff\x00\x01', 258))
+
+		# Carrying the state over gives the same as doing it in one go
+		(first, state) = self.counterInstance.applyKeystream(b'hello ', 7)
+		(second, _) = self.counterInstance.applyKeystream(memoryview(b'there'), state)
+		self.assertEqual(first+second, self.counterInstance.applyKeystream(bytearray(b'hello there'), 7)[0])
+
+	def test_encryptChunks(self):
+		chunks = ['hello', b' there', '', 'x']
+		whole = self.counterInstance.encrypt('hello there'+'x', 3)
+		self.assertEqual(list(self.counterInstance.encryptChunks(chunks, 3)), [whole[:5], whole[5:11].encode('latin-1'), '', whole[11:]])
+
+	def test_applyPrf(self):
+		self.assertEqual(self.counterInstance.encrypt('\x00\x00\x03', 1), '\x01\x02\x00')
+		self.assertEqual(self.counterInstance.encrypt(b'\x00\x00\x03', 1), b'\x01\x02\x00')
+		self.assertEqual(self.counterInstance.encrypt('☃\x00', 1), '☂\x02')  # Doesn't fit in a byte
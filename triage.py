@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+# Cheap look at a ciphertext before anything gets cracked.  A few statistics are worked out once (letter index of
+# coincidence, alphabet coverage, byte entropy, how printable it is, a hint at a period), then every cipher says from
+# those alone whether it's a likely fit, a possible one, or couldn't have made this ciphertext (see
+# AbstractCipher.triage).  Ruled out ciphers aren't cracked at all, and the likely ones go first.  Each cipher's verdict
+# is O(1) given the stats, so the stats are the only pass over the text however many ciphers there are
+
+import logging
+import unittest
+
+import utils
+
+np = utils.lazyImport('numpy')
+
+log = logging.getLogger(__name__)
+
+LIKELY = 0
+POSSIBLE = 1
+RULED_OUT = 2
+VERDICT_NAMES = ['likely', 'possible', 'ruled out']
+
+# Below these the statistics are too noisy to rule anything out on
+MIN_LETTERS = 200  # For the letter statistics (coincidence, period)
+MIN_BYTES = 32  # For the printable rate
+MIN_ENTROPY_BYTES = 256  # For the byte entropy, a short text can't show more than log2(length) bits
+
+# Letter index of coincidence (normalized, so 1.0 is random letters).  English is about 1.73, and the polyalphabetic
+# ciphers bring it down towards 1.0 as the key gets longer (about 1.38 for two letters)
+MONOALPHABETIC_IOC = 1.55  # At least this, the letters have all been through the same substitution
+POLYALPHABETIC_IOC = 1.3  # Below this, they can't have been
+
+MIN_PRINTABLE_RATE = 0.75  # Ciphers that leave non-letters alone can't have made anything less printable than this
+RANDOM_PRINTABLE_RATE = 0.9  # Random bytes are about 37% printable, so a keystream's output never gets this high
+MAX_TEXT_ENTROPY = 6.0  # Bits per byte.  English is about 4.5, random bytes almost 8
+
+MAX_PERIOD = 20  # Same as polyalphabetic's KEY_LENGTH_UPPER_BOUND
+MIN_COLUMN_LETTERS = 20  # Same as polyalphabetic's too, fewer than this a column's coincidence means little
+PERIOD_SAMPLE = 4096  # Letters the period hint looks at
+
+_printableCodes = [ord(c) for c in '\t\n\r'] + list(range(32, 127))
+
+class TextStats:
+    """What triage knows about a ciphertext.  ioc and period are None if there aren't MIN_LETTERS letters to go on, and
+    period is only looked for when the letters as a whole don't look monoalphabetic"""
+
+    __slots__ = ('length', 'numLetters', 'ioc', 'coverage', 'entropy', 'printableRate', 'isBytes', 'period')
+
+    def __init__(self, ciphertext):
+        prepared = utils.prepare(ciphertext)
+        lowered = prepared.lowered()  # Case doesn't matter to the letter statistics
+
+        (byteCounts, length) = prepared.histogram
+        self.length = length
+        self.isBytes = prepared.codes is not None
+        self.printableRate = float(byteCounts[_printableCodes].sum())/length if length > 0 else 1.0
+
+        probabilities = byteCounts[byteCounts > 0]/max(1, length)
+        self.entropy = float(-(probabilities*np.log2(probabilities)).sum())
+
+        letterCounts = np.array(lowered.letterCounts, dtype=np.int64)
+        self.numLetters = int(letterCounts.sum())
+        self.coverage = int((letterCounts > 0).sum())/utils.ALPHABET_SIZE
+
+        self.ioc = None
+        self.period = None
+        if self.numLetters >= MIN_LETTERS:
+            self.ioc = coincidence(letterCounts)
+            if self.ioc < MONOALPHABETIC_IOC:  # Otherwise every period's columns look monoalphabetic too
+                self.period = findPeriod(lowered.letters[:PERIOD_SAMPLE].astype(np.intp))
+
+    def __repr__(self):
+        ioc = 'None' if self.ioc == None else '%.2f' % self.ioc
+        return ('length %d, %d letters, ioc %s, coverage %.2f, entropy %.2f bits, printable %.2f, period %s'
+                % (self.length, self.numLetters, ioc, self.coverage, self.entropy, self.printableRate, self.period))
+
+# Normalized index of coincidence of one set of letter counts
+def coincidence(counts):
+    total = int(counts.sum())
+    if total < 2:
+        return 0.0
+    return utils.ALPHABET_SIZE*float((counts*(counts-1)).sum())/(total*(total-1))
+
+# The shortest period whose columns all look monoalphabetic, or None.  Multiples of the real period score just as well,
+# hence the shortest
+def findPeriod(codes):
+    for period in range(2, min(MAX_PERIOD, len(codes)//MIN_COLUMN_LETTERS) + 1):
+        columns = np.arange(len(codes)) % period
+        counts = np.bincount(columns*utils.ALPHABET_SIZE + codes, minlength=period*utils.ALPHABET_SIZE).reshape(period, utils.ALPHABET_SIZE)
+        if np.mean([coincidence(column) for column in counts]) >= MONOALPHABETIC_IOC:
+            return period
+
+    return None
+
+def triage(ciphers, ciphertext, exhaustive=False):
+    """[(cipher, verdict, reason)] for every cipher, in the same order.  With exhaustive nothing is ruled out (the
+    verdicts are still worked out and logged).  If every cipher would be ruled out, none of them are, it's better to
+    crack something"""
+    stats = TextStats(ciphertext)
+    log.info('Triage: %r', stats)
+
+    verdicts = [(cipher,) + tuple(cipher.triage(stats)) for cipher in ciphers]
+    for (cipher, verdict, reason) in verdicts:
+        log.info('Triage: %s is %s%s', cipher.getNameOfCipher(), VERDICT_NAMES[verdict], '' if reason == None else ' (%s)' % reason)
+
+    if exhaustive or all(verdict == RULED_OUT for (_, verdict, _) in verdicts):
+        if not exhaustive:
+            log.info('Triage: everything was ruled out, so nothing is')
+        verdicts = [(cipher, min(verdict, POSSIBLE), reason) for (cipher, verdict, reason) in verdicts]
+
+    return verdicts
+
+# For the ciphers that only touch letters: the plaintext was readable, so everything else in the ciphertext is too.
+# Why it can't be one of those, or None
+def unprintableReason(stats):
+    if stats.length >= MIN_BYTES and stats.printableRate < MIN_PRINTABLE_RATE:
+        return 'only %.0f%% printable' % (100*stats.printableRate)
+    return None
+
+# Indices into verdicts of the ciphers still in, likely ones first (otherwise in their original order)
+def crackOrder(verdicts):
+    kept = [i for i, (_, verdict, _) in enumerate(verdicts) if verdict != RULED_OUT]
+    return sorted(kept, key=lambda i: verdicts[i][1])
+
+
+class TriageTest(unittest.TestCase):
+
+    def test_stats(self):
+        import polyalphabetic
+
+        plaintext = polyalphabetic.PolyalphabeticTest.plaintext
+        stats = TextStats(plaintext)
+        self.assertGreater(stats.ioc, MONOALPHABETIC_IOC)
+        self.assertIsNone(stats.period)
+        self.assertEqual(stats.printableRate, 1.0)
+        self.assertLess(stats.entropy, MAX_TEXT_ENTROPY)
+
+        self.assertIsNone(TextStats('too short').ioc)
+        self.assertEqual(TextStats('').length, 0)
+
+    def test_triage(self):
+        import affine
+        import nothing
+        import polyalphabetic
+        import rc4
+        import vigenere
+        import xor
+
+        ciphers = [nothing.Nothing(), affine.Affine(), vigenere.Vigenere(), xor.Xor(), rc4.Rc4()]
+        plaintext = polyalphabetic.PolyalphabeticTest.plaintext
+
+        def verdictsOf(ciphertext):
+            return [verdict for (_, verdict, _) in triage(ciphers, ciphertext)]
+
+        self.assertEqual(verdictsOf(affine.Affine().encrypt(plaintext, (5,7))), [POSSIBLE, LIKELY, RULED_OUT, POSSIBLE, RULED_OUT])
+        self.assertEqual(verdictsOf(xor.Xor().encrypt(plaintext, 0x9c)), [POSSIBLE, RULED_OUT, RULED_OUT, LIKELY, RULED_OUT])  # Nothing is never ruled out
+        self.assertEqual(verdictsOf(rc4.Rc4().encrypt(plaintext, 'key')), [POSSIBLE, RULED_OUT, RULED_OUT, RULED_OUT, LIKELY])
+
+        ciphertext = vigenere.Vigenere().encrypt(plaintext, 'lemon')
+        self.assertEqual(TextStats(ciphertext).period, 5)
+        verdicts = triage(ciphers, ciphertext)
+        self.assertEqual([verdict for (_, verdict, _) in verdicts], [POSSIBLE, RULED_OUT, LIKELY, POSSIBLE, RULED_OUT])
+        self.assertEqual(crackOrder(verdicts), [2, 0, 3])
+
+        self.assertEqual(crackOrder(triage(ciphers, ciphertext, exhaustive=True)), [2, 0, 1, 3, 4])
+        self.assertEqual(crackOrder(triage(ciphers[4:], plaintext)), [0])  # Everything ruled out is as good as nothing
+        self.assertEqual(crackOrder(triage(ciphers, 'short')), [0, 1, 2, 3, 4])
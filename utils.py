@@ -2,33 +2,61 @@
 
 # General utilities used by multiple encryption algorithms
 
-from collections import defaultdict
 import unittest
-import scipy
-from scipy.stats import chisquare
-from scipy.stats import chisqprob
-from math import log10
+from array import array
+import importlib.util
 import string
+import functools
+import sys
+import os
+import math
+
+# A module that's only really imported the first time something in it is used.  numpy takes longer to import than most
+# runs of decrypt.py take to do their work, so every module that needs it starts with np = utils.lazyImport('numpy').
+# Nothing may touch np while a module is being imported (a table built at the top level, say), or that undoes it
+def lazyImport(name):
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+np = lazyImport('numpy')
 
 ALPHABET_SIZE = 26
-
-_trigraphFreqData = None
+LOWER_ALPHABET = string.ascii_lowercase
+
+EXPECTED_FREQS_FILE = 'englishAlphaFreqs.txt'
+CHUNK_SIZE = 1 << 20  # For anything that streams over files
+SCORER_VERSION = 1  # Bump whenever scores change, so cached results (see cache.py) aren't reused
+
+# Real English never fits the letter model exactly, which adds about this much to the chi2 per letter on top of chance
+ENGLISH_EXCESS_PER_LETTER = 0.15
+# The three below (and the excess, for plaintextConfidence) were fit to samples of English prose of 40 to 8000 chars,
+# and the best wrong Affine and Xor keys on them.  A wrong key can only be told from the right one by letter counts
+# when it garbles all the letters, see Polyalphabetic.confidence for keys that only get some of them wrong
+ENGLISH_DISPERSION = 1.4  # Letters come in words, so English's letter counts spread this much more than chance's do
+MIN_CONFIDENCE_LETTERS = 30  # Fewer letters than this say next to nothing, so they get no confidence at all
+# Past this many letters, how far a text is off the model per letter is down to what it's about more than to chance, so
+# longer texts are only given this many letters' worth of evidence
+CONFIDENCE_LETTERS = 250
+
+_languageModels = {}  # filename -> LanguageModel, so each table is only parsed once
+
+# Translate table sending each lower case letter x to a*x+b (mod 26), anything else is left alone
+@functools.lru_cache(maxsize=1024)
+def letterMapTable(a, b):
+    mapped = ''.join(chr(ord('a')+(a*x+b) % ALPHABET_SIZE) for x in range(ALPHABET_SIZE))
+    return str.maketrans(LOWER_ALPHABET, mapped)
 
 # text must be lower case (otherwise ignored!)
 def rot(text, shift):
-    shiftedText = ""
-
-    lowera = ord('a')
-
-    for c in text:	
-        d = ''
-        if isAlpha(c):
-            d = chr(((ord(c)-lowera+shift) % ALPHABET_SIZE)+lowera)
-        else:
-            d = c
-        shiftedText += d
-
-    return shiftedText
+    return text.translate(letterMapTable(1, shift % ALPHABET_SIZE))
 
 # Should really be called isLowerAlpha
 def isAlpha(c):
@@ -37,25 +65,20 @@ def isAlpha(c):
 def isPrintable(c):
     return c in string.printable  # But I eventually might want to do unicode...
 
-def calcFreqs(text):
-    counts = defaultdict(int)
+# Number of times each lower case letter appears, as a 26-slot list (index 0 is 'a')
+def calcCounts(text):
+    return [text.count(c) for c in LOWER_ALPHABET]  # 26 passes in C beat one pass in Python
 
-    total = 0
-    for c in text:
-        if isAlpha(c):
-            counts[c] += 1
-            total += 1
+def calcFreqs(text):
+    counts = calcCounts(text)
+    total = sum(counts)
 
     freqs = {}
-
-    lowera = ord('a')
-    for i in range(ALPHABET_SIZE):
-        c = chr(lowera+i)
-
+    for c, count in zip(LOWER_ALPHABET, counts):
         if total == 0:
             freqs[c] = 0
         else:
-            freqs[c] = counts[c] / total
+            freqs[c] = count / total
 
     return (freqs, total)
 
@@ -73,26 +96,240 @@ def readExpectedFreqs(filename):
 
         return freqs
 
-def calcChiSquared(text):
-    expectedFreqs = readExpectedFreqs('englishAlphaFreqs.txt')
-    actualFreqs, total = calcFreqs(text)
+class LanguageModel:
+    """Expected letter frequencies of a language, held in a 26-slot array (index 0 is 'a')"""
+
+    def __init__(self, expectedFreqs):
+        self.expectedFreqs = array('d', expectedFreqs)
+
+        if len(self.expectedFreqs) != ALPHABET_SIZE:
+            raise ValueError('Expected %d frequencies, got %d' % (ALPHABET_SIZE, len(self.expectedFreqs)))
+
+    @classmethod
+    def fromFile(cls, filename):
+        freqs = readExpectedFreqs(filename)
+        return cls(freqs[c] for c in LOWER_ALPHABET)
+
+    def chiSquared(self, counts):
+        """Chi-squared of a 26-slot count vector against the expected frequencies"""
+        total = sum(counts)
+        if total == 0:
+            return 0.0
+
+        chiSquared = 0.0
+        for count, expected in zip(counts, self.expectedFreqs):
+            chiSquared += ((count/total-expected)**2) / expected
+
+        return chiSquared * total  # Really, all the freqs above should've been multiplied by total, but this works out the same
+
+    def chiSquaredMany(self, counts):
+        """Same as chiSquared, but for a (rows x 26) matrix of counts.  Returns an array with one value per row"""
+        counts = np.asarray(counts, dtype=np.float64)
+        expected = np.frombuffer(self.expectedFreqs, dtype=np.float64)
 
-    chiSquared = 0.0
+        totals = counts.sum(axis=1)
+        safeTotals = np.where(totals == 0, 1, totals)  # Empty rows come out as 0, like chiSquared
+        freqs = counts / safeTotals[:, None]
 
-    lowera = ord('a')
-    for i in range(ALPHABET_SIZE):
-        c = chr(lowera+i)
-        chiSquared += ((actualFreqs[c]-expectedFreqs[c])**2) / expectedFreqs[c]
+        return (((freqs-expected)**2) / expected).sum(axis=1) * totals
 
-    chiSquared *= total  # Really, all the freqs above should've been multiplied by total, but this works out the same
+# Relative names are looked up next to this file, so it doesn't matter where we're run from
+def dataPath(filename):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
 
-    return chiSquared
+# Loads the model the first time it's asked for, after that it's just a dict lookup
+def getLanguageModel(filename=EXPECTED_FREQS_FILE):
+    model = _languageModels.get(filename)
+    if model == None:
+        model = LanguageModel.fromFile(dataPath(filename))
+        _languageModels[filename] = model
 
-# This doesn't currently work...
+    return model
+
+def calcChiSquared(text, model=None):
+    if model == None:
+        model = getLanguageModel()
+
+    if isinstance(text, PreparedCiphertext):
+        return model.chiSquared(text.letterCounts)
+    return model.chiSquared(calcCounts(text))
+
+class PreparedCiphertext:
+    """What the ciphers keep wanting to know about a ciphertext, all worked out in one go (see prepare).  Every
+    crack and scorer takes one of these wherever it takes a str.  Nothing in here should be changed once it's built"""
+
+    __slots__ = ('text', 'codes', 'isLetter', 'letters', 'histogram', 'letterCounts', '_lowered')
+
+    def __init__(self, text):
+        self.text = text
+
+        points = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        fitsInByte = len(points) == 0 or int(points.max()) < 256
+        self.codes = points.astype(np.uint8) if fitsInByte else None  # The raw bytes, like textToCodes
+
+        self.isLetter = (points - np.uint32(ord('a'))) < ALPHABET_SIZE  # Lower case letters only, anything else wraps around
+        self.letters = (points[self.isLetter] - ord('a')).astype(np.uint8)  # Letter indices, the non-letters taken out
+
+        # Same as calcHistogram and calcCounts
+        byteCounts = np.bincount(self.codes if fitsInByte else points[points < 256], minlength=256)
+        self.histogram = (byteCounts, len(text))
+        self.letterCounts = byteCounts[ord('a'):ord('a')+ALPHABET_SIZE].tolist()
+
+        self._lowered = None
+
+    def __len__(self):
+        return len(self.text)
+
+    def lowered(self):
+        """The prepared lower cased text, for the ciphers that only take lower case.  Only built once"""
+        if self._lowered == None:
+            lower = self.text.lower()
+            self._lowered = self if lower == self.text else PreparedCiphertext(lower)
+
+        return self._lowered
+
+# Prepares text (bytes are a char per byte), or just gives it back if it already is
+def prepare(text):
+    if isinstance(text, PreparedCiphertext):
+        return text
+    if isinstance(text, (bytes, bytearray)):
+        text = bytes(text).decode('latin-1')
+
+    return PreparedCiphertext(text)
+
+# The plain text of something that might be prepared
+def textOf(text):
+    return text.text if isinstance(text, PreparedCiphertext) else text
+
+# Char codes of text as a uint8 array, or None if some char doesn't fit in a byte
+def textToCodes(text):
+    try:
+        return np.frombuffer(text.encode('latin-1'), dtype=np.uint8)
+    except UnicodeEncodeError:
+        return None
+
+def codesToText(codes):
+    return codes.tobytes().decode('latin-1')
+
+# Scores every row of a (rows x length) uint8 matrix of char codes at once.  Rows below minReadRate come out as inf
+def calcChiSquaredMany(codes, minReadRate=0.0, model=None):
+    if model == None:
+        model = getLanguageModel()
+
+    (numRows, length) = codes.shape
+
+    letters = codes - np.uint8(ord('a'))  # Wraps around, so anything that isn't a lower case letter ends up >= 26
+    isLetter = letters < ALPHABET_SIZE
+
+    rowOffsets = np.arange(numRows, dtype=np.int64)[:, None] * ALPHABET_SIZE
+    counts = np.bincount((rowOffsets+letters)[isLetter], minlength=numRows*ALPHABET_SIZE).reshape(numRows, ALPHABET_SIZE)
+
+    chi2 = model.chiSquaredMany(counts)
+
+    if minReadRate > 0.0 and length > 0:
+        readRates = isLetter.sum(axis=1) / length
+        chi2[readRates < minReadRate] = np.inf
+
+    return chi2
+
+# Anything with a read(n), including mmap objects
+def readChunks(f, chunkSize=CHUNK_SIZE):
+    while True:
+        chunk = f.read(chunkSize)
+        if not chunk:
+            return
+        yield chunk
+
+# XOR of two equal length bytes-like buffers, done as one big int rather than byte by byte
+def xorBytes(a, b):
+    n = len(a)
+    return (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(n, 'little')
+
+# Byte histogram of text (256 bins) and its length.  Chars that don't fit in a byte are only counted in the length
+def calcHistogram(text):
+    codes = np.frombuffer(text.encode('latin-1', errors='ignore'), dtype=np.uint8)
+    return (np.bincount(codes, minlength=256), len(text))
+
+# For ciphers where a key only permutes the byte alphabet: tables is a (keys x 256) matrix giving the plaintext code of
+# each ciphertext code.  The plaintext letter counts are just the ciphertext histogram with its bins moved around, so
+# every key is scored without building any plaintext
+def calcChiSquaredFromTables(histogram, tables, minReadRate=0.0, model=None):
+    if model == None:
+        model = getLanguageModel()
+
+    (hist, length) = histogram
+    numRows = tables.shape[0]
+
+    letters = tables - np.uint8(ord('a'))
+    isLetter = letters < ALPHABET_SIZE
+
+    rowOffsets = np.arange(numRows, dtype=np.int64)[:, None] * ALPHABET_SIZE
+    weights = np.broadcast_to(hist, tables.shape)[isLetter]
+    counts = np.bincount((rowOffsets+letters)[isLetter], weights=weights, minlength=numRows*ALPHABET_SIZE).reshape(numRows, ALPHABET_SIZE)
+
+    chi2 = model.chiSquaredMany(counts)
+
+    if minReadRate > 0.0 and length > 0:
+        readRates = counts.sum(axis=1) / length
+        chi2[readRates < minReadRate] = np.inf
+
+    return chi2
+
+# P(X >= x) for X chi-squared with a whole number of degrees of freedom, from the closed forms (a finite sum for even
+# degrees, plus the normal tail for odd ones).  Exact, and saves importing scipy, which is far too slow to import
+def chiSquaredSurvival(x, degreesOfFreedom=ALPHABET_SIZE-1):
+    if x <= 0:
+        return 1.0
+    if not x < math.inf:  # inf (or nan) would come out as inf*0 = nan, which min() below would turn into 1
+        return 0.0
+
+    if degreesOfFreedom % 2 == 0:  # e^(-x/2) * sum of (x/2)^j/j! for j < degreesOfFreedom/2
+        term = math.exp(-x/2)
+        total = term
+        for j in range(1, degreesOfFreedom//2):
+            term *= x/(2*j)
+            total += term
+    else:  # erfc(sqrt(x/2)) + sqrt(2x/pi) e^(-x/2) * sum of x^(j-1)/(1*3*...*(2j-1)) for j <= (degreesOfFreedom-1)/2
+        term = math.sqrt(2*x/math.pi)*math.exp(-x/2)
+        total = math.erfc(math.sqrt(x/2))
+        for j in range(1, (degreesOfFreedom+1)//2):
+            total += term
+            term *= x/(2*j+1)
+
+    return min(1.0, total)
+
+# How believable it is that text is English: the chance English would come out at least this far off the model.  The
+# rarest letters are lumped together until they'd be expected at least once (a single z in a short text shouldn't
+# count against it), and the chi2 is taken the way English spreads (see the constants above) before looking it up
+def plaintextConfidence(text, model=None):
+    if model == None:
+        model = getLanguageModel()
+
+    counts = text.letterCounts if isinstance(text, PreparedCiphertext) else calcCounts(text)
+    numLetters = sum(counts)
+    if numLetters < MIN_CONFIDENCE_LETTERS:
+        return 0.0
+
+    (chi2, bins, pooledCount, pooledExpected) = (0.0, 0, 0, 0.0)
+    for (count, expected) in sorted(zip(counts, model.expectedFreqs), key=lambda pair: pair[1]):
+        expected *= numLetters
+        if expected < 1 or pooledExpected < 1:
+            pooledCount += count
+            pooledExpected += expected
+        else:
+            chi2 += (count-expected)**2 / expected
+            bins += 1
+    if pooledExpected > 0:
+        chi2 += (pooledCount-pooledExpected)**2 / pooledExpected
+        bins += 1
+
+    chi2 -= ENGLISH_EXCESS_PER_LETTER*numLetters
+    chi2 *= min(1.0, CONFIDENCE_LETTERS/numLetters) / ENGLISH_DISPERSION
+    return chiSquaredSurvival(chi2, bins-1)
+
+# Whether text fits the expected frequencies, i.e. plaintextConfidence isn't below pVal
 def isPlaintextWithConfidence(text, pVal):
-    chi2 = calcChiSquared(text)
-    print(chisqprob(chi2, ALPHABET_SIZE-1))
-    return chisqprob(chi2, ALPHABET_SIZE-1) < pVal
+    return plaintextConfidence(text) >= pVal
 
 # Copied from Wikipedia
 def multInverse(a, n):
@@ -113,57 +350,10 @@ def multInverse(a, n):
 
     return t
 
-# Wih thanks to Practical Cryptography for the file: http://practicalcryptography.com/cryptanalysis/letter-frequencies-various-languages/english-letter-frequencies/
-# Note that we need to convert to lower-case and to freqs
-# Also, you need to check to see if your trigraph is a key (wouldn't be added if freq is 0)
-def readTrigraphFreqs(filename):
-    global _trigraphFreqData
-
-    if _trigraphFreqData != None:
-        return _trigraphFreqData  # We're kind of caching it
-
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-
-        total = 0
-        counts = dict()
-
-        for line in lines:
-            split = line.split()
-            trigraph = split[0].lower()
-            count = int(split[1])
-            counts[trigraph] = count
-            total += count
-
-        freqs = dict()
-        lowera = ord('a')
-        for trigraph, count in counts.items():
-            freqs[trigraph] = count / total
-
-        _trigraphFreqData = (freqs, total)  # Saving for later as well
-
-        return (freqs, total)
-
+# Average log10 probability per letter of text's trigrams, see ngram.py.  Higher is more like English
 def calcTrigraphFitness(text):
-    text = text.lower()  # Upper case characters should be allowed
-
-    (freqs, total) = readTrigraphFreqs('data/english_trigrams.txt')
-
-    # Now, we need to filter for only lower-case alphabet characters.  There could be some tweaking...
-    strippedText = ''.join([c for c in text if isAlpha(c)])
-
-    minLog = log10(0.01/total)  # We're basically giving a lower bound on the probability of a trigraph appearing
-    
-    fitness = 0
-    for i in range(0, len(strippedText)-2):  # Iterating through trigraphs in text
-        trigraph = strippedText[i:i+3]
-        freq = freqs.get(trigraph, 0)  # 0 if not in the freqs
-        if freq == 0:
-            fitness += minLog
-        else:
-            fitness += log10(freq)
-
-    return fitness/len(strippedText)  # We divide by the length to allow us to compare different text sizes...
+    import ngram  # ngram needs utils, so it can't be imported at the top
+    return ngram.getNgramModel().fitness(text)
 
 
 
@@ -185,6 +375,11 @@ class UtilTest(unittest.TestCase):
         self.assertEqual(rot('a1c', 2), 'c1e')
         self.assertEqual(rot('aAc', 2), 'cAe')
 
+    def test_letterMapTable(self):
+        self.assertEqual('abz A!'.translate(letterMapTable(1, 1)), 'bca A!')
+        self.assertEqual('abz'.translate(letterMapTable(-1, 25)), 'zya')  # Atbash
+        self.assertIs(letterMapTable(3, 2), letterMapTable(3, 2))
+
     def test_calcFreqs(self):
         freqs, _ = calcFreqs('abca')
         self.assertAlmostEqual(freqs['a'], 0.5)
@@ -196,6 +391,57 @@ class UtilTest(unittest.TestCase):
         self.assertEqual(freqs['c'], 0.02782)
         self.assertEqual(freqs['z'], 0.00074)        
 
+    def test_calcCounts(self):
+        counts = calcCounts('abca zZ!')
+        self.assertEqual(len(counts), ALPHABET_SIZE)
+        self.assertEqual(counts[0], 2)
+        self.assertEqual(counts[1], 1)
+        self.assertEqual(counts[25], 1)
+        self.assertEqual(sum(counts), 5)
+
+    def test_languageModel(self):
+        model = getLanguageModel()
+        self.assertIs(model, getLanguageModel())  # Only loaded once
+        self.assertAlmostEqual(model.expectedFreqs[2], 0.02782)
+        self.assertAlmostEqual(model.chiSquared(calcCounts('abcdefghijklmnopqrstuvwxyz')), 148.894749139)
+        self.assertEqual(model.chiSquared([0]*ALPHABET_SIZE), 0.0)
+
+        with self.assertRaises(ValueError):
+            LanguageModel([0.5, 0.5])
+
+    def test_calcChiSquaredMany(self):
+        texts = ['abcdefghijklmnopqrstuvwxyz', 'hello there, this is english', 'zzzzzzzzzzzzzzzzzzzzzzzzzzzz']
+        codes = np.array([textToCodes(text[:26]) for text in texts])
+        chi2 = calcChiSquaredMany(codes)
+        for i, text in enumerate(texts):
+            self.assertAlmostEqual(chi2[i], calcChiSquared(text[:26]))
+
+        chi2 = calcChiSquaredMany(textToCodes('a!!!!!!!!!').reshape(1, -1), 0.5)
+        self.assertEqual(chi2[0], float('inf'))
+
+    def test_calcChiSquaredFromTables(self):
+        text = 'hello there, this is english \u0100'
+        identity = np.arange(256, dtype=np.uint8)
+        swapped = identity.copy()
+        swapped[[ord('e'), ord('z')]] = swapped[[ord('z'), ord('e')]]
+
+        chi2 = calcChiSquaredFromTables(calcHistogram(text), np.array([identity, swapped]))
+        self.assertAlmostEqual(chi2[0], calcChiSquared(text))
+        self.assertAlmostEqual(chi2[1], calcChiSquared(text.replace('e', 'z')))
+
+        chi2 = calcChiSquaredFromTables(calcHistogram('a!!!!!!!!!'), np.array([identity]), 0.5)
+        self.assertEqual(chi2[0], float('inf'))
+
+    def test_xorBytes(self):
+        self.assertEqual(xorBytes(b'\x41\x42\x43', b'\x41\x41\x41'), b'\x00\x03\x02')
+        self.assertEqual(xorBytes(bytearray(b'\x00\xff'), memoryview(b'\xff\xff')), b'\xff\x00')
+        self.assertEqual(xorBytes(b'', b''), b'')
+
+    def test_textToCodes(self):
+        self.assertEqual(list(textToCodes('ab\xff')), [97, 98, 255])
+        self.assertEqual(codesToText(textToCodes('hi there')), 'hi there')
+        self.assertIsNone(textToCodes('\u0100'))
+
     def test_calcChiSquared(self):
         x2 = calcChiSquared('this should be a valid english text, and so the p value should be fairly low, hopefully.')
         self.assertAlmostEqual(x2, 39.515306094)
@@ -203,6 +449,58 @@ class UtilTest(unittest.TestCase):
         x2 = calcChiSquared('abcdefghijklmnopqrstuvwxyz')
         self.assertAlmostEqual(x2, 148.894749139)
 
+    def test_chiSquaredSurvival(self):
+        self.assertEqual(chiSquaredSurvival(0.0), 1.0)
+        self.assertAlmostEqual(chiSquaredSurvival(37.6524841), 0.05)  # The usual critical values, 25 degrees of freedom
+        self.assertAlmostEqual(chiSquaredSurvival(44.3141049), 0.01)
+        self.assertAlmostEqual(chiSquaredSurvival(24.3366), 0.5, 4)
+        self.assertAlmostEqual(chiSquaredSurvival(2.0, 2), math.exp(-1))
+        self.assertAlmostEqual(chiSquaredSurvival(3.8414588, 1), 0.05)
+        self.assertEqual(chiSquaredSurvival(1e6), 0.0)
+        self.assertEqual(chiSquaredSurvival(float('inf')), 0.0)
+        self.assertEqual(chiSquaredSurvival(float('inf'), 2), 0.0)
+
+    def test_plaintextConfidence(self):
+        text = ('frequency analysis is the study of how often letters turn up in a piece of writing. in english the letter e is '
+                'by far the most common, followed by t, a, o and n, while letters such as q, x and z are seldom seen at all. a '
+                'simple substitution keeps those counts, only moving them to other letters, so anyone with enough ciphertext '
+                'can line the two up and read the message. longer messages give better counts, and so an easier break. ')
+        for english in [text[:60], text[:120], text[:250], text, text*4, text*16]:  # 50 to over 5000 letters
+            self.assertGreater(plaintextConfidence(english), 0.99)
+            self.assertLess(max(plaintextConfidence(rot(english, shift)) for shift in range(1, ALPHABET_SIZE)), 0.5)
+        self.assertLess(max(plaintextConfidence(rot(text[:120], shift)) for shift in range(1, ALPHABET_SIZE)), 0.001)
+
+        self.assertEqual(plaintextConfidence('\x0c\x9en\xf2\x9f\xf9at'), 0.0)  # Too few letters to say
+        self.assertEqual(plaintextConfidence('!!!! 1234 ????'), 0.0)
+
+    def test_isPlaintextWithConfidence(self):
+        self.assertTrue(isPlaintextWithConfidence('hello there lets see if this gets encrypted or not by affine.', 0.05))
+        self.assertFalse(isPlaintextWithConfidence('abcdefghijklmnopqrstuvwxyz', 0.05))
+
+    def test_prepare(self):
+        text = 'Hi there, ça va? \u263a xyz'
+        prepared = prepare(text)
+        self.assertIs(prepare(prepared), prepared)
+        self.assertIsNone(prepared.codes)  # The smiley doesn't fit in a byte
+        self.assertEqual(codesToText(prepared.letters + np.uint8(ord('a'))), 'ithereavaxyz')
+        self.assertEqual(prepared.isLetter.sum(), 12)
+        self.assertEqual(prepared.letterCounts, calcCounts(text))
+        self.assertEqual(calcChiSquared(prepared), calcChiSquared(text))
+        self.assertEqual(prepared.histogram[1], calcHistogram(text)[1])
+        self.assertEqual(prepared.histogram[0].tolist(), calcHistogram(text)[0].tolist())
+
+        lowered = prepared.lowered()
+        self.assertEqual(lowered.text, text.lower())
+        self.assertIs(lowered.lowered(), lowered)
+        self.assertEqual(textOf(lowered), text.lower())
+        self.assertEqual(textOf('abc'), 'abc')
+        self.assertEqual(prepare(b'ab\xff').codes.tolist(), [97, 98, 255])
+        self.assertEqual(len(prepare('')), 0)
+
+    def test_lazyImport(self):
+        self.assertIs(lazyImport('os'), os)  # Already imported, so it's just that
+        self.assertEqual(np.arange(3).sum(), 3)
+
     def test_multInverse(self):
         self.assertEqual(multInverse(7,26), 15)
         self.assertEqual(multInverse(8953851,26), 17)
@@ -1,150 +1,26 @@
 #!/usr/bin/env python3
 
 import utils
-import cipher
+import polyalphabetic
 import unittest
+import io
 
-KEY_LENGTH_UPPER_BOUND = 20  # Unlikely that higher? ^^^ 
+KEY_LENGTH_UPPER_BOUND = polyalphabetic.KEY_LENGTH_UPPER_BOUND
 
 
-class Vigenere(cipher.AbstractCipher):
+class Vigenere(polyalphabetic.Polyalphabetic):
 
-	def encrypt(self, plaintext, key):
-		ciphertext = ''
+	def encryptMap(self, shift):
+		return (1, shift)
 
-		lowera = ord('a')
-		keylen = len(key)
-		keyIndex = 0
-		for c in plaintext:
-			if utils.isAlpha(c):
-				shift = ord(key[keyIndex]) - lowera
-				ciphertext += chr(((ord(c) - lowera + shift) % utils.ALPHABET_SIZE) + lowera) 
-
-				keyIndex = (keyIndex + 1) % keylen  # Updating the key
-			else:
-				ciphertext += c  # key not updated
-
-		return ciphertext
-
-	def decrypt(self, ciphertext, key):
-		plaintext = ''
-
-		lowera = ord('a')
-		keylen = len(key)
-		keyIndex = 0
-		for c in ciphertext:
-			if utils.isAlpha(c):
-				shift = ord(key[keyIndex]) - lowera
-				plaintext += chr(((ord(c) - lowera - shift + utils.ALPHABET_SIZE) % utils.ALPHABET_SIZE) + lowera) 
-
-				keyIndex = (keyIndex + 1) % keylen  # Updating the key
-			else:
-				plaintext += c  # key not updated
-
-		return plaintext
-
-	def crack(self, ciphertext):
-		keyLen = self.findKeyLength(ciphertext, KEY_LENGTH_UPPER_BOUND)
-
-		key = ''
-		lowera = ord('a')
-		for i in range(keyLen):  # gets each Caesar text embedded in the ciphertext
-			subtext = ''
-
-			j = i
-			while j < len(ciphertext):
-				c = ciphertext[j]
-				if utils.isAlpha(c):
-					subtext += c
-
-				j += keyLen
-
-			lowestShift = 0
-			lowestChi2 = 100000
-
-			for j in range(min(utils.ALPHABET_SIZE, len(ciphertext))):
-				maybePlaintext = self.rot(subtext, j)
-				chi2 = utils.calcChiSquared(maybePlaintext)
-				if chi2 < lowestChi2:
-					lowestShift = j
-					lowestChi2 = chi2
-
-			keyShift = 0
-			if lowestShift != 0:
-				keyShift = 26-lowestShift  # We found the amount to shift for decryption, now we want the encryption key
-
-			key += chr(keyShift+lowera)
-
-		key = self.refineKey(key)
-
-		plaintext = self.decrypt(ciphertext, key)
-		chi2 = utils.calcChiSquared(plaintext)
-
-		return (key, chi2)
-
-	# It's possible that we found the key to be lemonlemon, but really it should just be lemon.  This function refines it
-	def refineKey(self, maybeRepeatKey):
-		length = len(maybeRepeatKey)
-
-		for i in range(1, length):
-			if length % i == 0:
-				if maybeRepeatKey[0:i]*(length//i) == maybeRepeatKey:
-					return maybeRepeatKey[0:i]  # We don't need to look further, this is the best one
-
-		return maybeRepeatKey  # No refining possible
-
-	def findKeyLength(self, ciphertext, keyLengthUpperBound):
-		highestIOC = -1.0  # Highest index of coincidence found so far
-		shiftForHighest = 1
-
-		for i in range(1,keyLengthUpperBound):
-			shiftedString = self.shiftString(ciphertext, i)
-
-			indexOfCoincidence = self.calcIndexOfCoincidence(ciphertext, shiftedString)
-
-			if indexOfCoincidence > highestIOC:
-				highestIOC = indexOfCoincidence
-				shiftForHighest = i
-
-		return shiftForHighest   # This shift gave the highest COI, which implies that it's the keylength
-
-	# Calculates how many times the lined up characters of the two texts match, then uses the index of coincidence formula
-	def calcIndexOfCoincidence(self, text1, text2):
-		numOccurs = {}  # Dictionary mapping alphabet chars to number of times it matches in the two texts
-		for i in range(len(text1)):
-			c = text1[i]
-			if c == text2[i]:
-				numOccurs[c] = numOccurs.setdefault(c, 0) + 1
-
-		summation = 0.0
-		for x in numOccurs.values():
-			summation += x*(x-1)
-
-		text1Len = len(text1)
-		indexOfCoincidence = utils.ALPHABET_SIZE*summation/(text1Len*(text1Len-1))  # Note this requires that the ciphertext must have multiple characters...
-
-		return indexOfCoincidence
-
-
-	# This is not rot.  It sends the ith character to the (i+shift)th spot, module len(str)
-	def shiftString(self, inStr, shift):
-		shift = shift % len(inStr)  # in case shift is greater (shouldn't be)
-		return inStr[-shift:]+inStr[:-shift] 
+	def decryptMap(self, shift):
+		return (1, -shift)
 
 	def rot(self, plaintext, shift):
-		ciphertext = ''
-
-		lowera = ord('a')
-		for c in plaintext:
-			if utils.isAlpha(c):
-				ciphertext += chr(((ord(c)-lowera+shift) % utils.ALPHABET_SIZE)+lowera)
-			else:
-				ciphertext += c
-
-		return ciphertext
+		return utils.rot(plaintext, shift)
 
 	def getNameOfCipher(self, key=None):
-		if len(key) == 1:
+		if key != None and len(key) == 1:
 			return 'Caesar (Vigenere)'  # Should technically also handle rot13
 		else:
 			return 'Vigenere'
@@ -190,6 +66,21 @@ class VigenereTest(unittest.TestCase):
 		ciphertext = 'ks me hz bbl ks me mpog aj xse jcsflzsy'
 		self.assertEqual(self.vigenereInstance.decrypt(ciphertext, 'relations'), 'to be or not to be that is the question')
 
+	def test_decryptChunks(self):
+		ciphertext = 'ks me hz bbl ks me mpog aj xse jcsflzsy'
+		chunks = [ciphertext[i:i+4] for i in range(0, len(ciphertext), 4)]
+		self.assertEqual(''.join(self.vigenereInstance.decryptChunks(chunks, 'relations')), 'to be or not to be that is the question')
+
+		plaintext = 'to be or not to be that is the question'
+		chunks = [plaintext[:1], plaintext[1:3], '', plaintext[3:]]
+		self.assertEqual(''.join(self.vigenereInstance.encryptChunks(chunks, 'relations')), ciphertext)
+
+	def test_decryptFile(self):
+		infile = io.BytesIO(b'KS me hz bbl ks me mpog aj xse jcsflzsy\n\xe2\x98\x83')
+		outfile = io.BytesIO()
+		self.vigenereInstance.decryptFile(infile, outfile, 'relations', 5)
+		self.assertEqual(outfile.getvalue(), b'to be or not to be that is the question\n\xe2\x98\x83')
+
 	def test_identity(self):
 		text = 'hello there!'
 		key = 'key'
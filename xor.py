@@ -3,9 +3,13 @@
 import binascii
 import utils
 import cipher
+import triage
 import unittest
+import io
 import stream
 
+np = utils.lazyImport('numpy')
+
 class Xor(stream.Stream):
 
 	minReadRate = 0.3  # Eh, this should be good enough
@@ -23,9 +27,40 @@ class Xor(stream.Stream):
 	def prf(self, state):
 		return (state, state)  # returning the byte as the first arg, state as the second arg
 
+	def keystream(self, state, n):
+		return (bytes([state])*n, state)
+
+	def decryptTables(self, keys):
+		return self.decryptBatch(np.arange(256, dtype=np.uint8), keys)
+
+	def decryptBatch(self, codes, keys):
+		return codes[None,:] ^ np.array(keys, dtype=np.uint8)[:,None]
+
+	def isPermutation(self):
+		return True
+
+	def isPositionIndependent(self):
+		return True  # Same byte all the way through
+
+	# Xoring every byte with the same key just relabels them, so the byte entropy is the plaintext's.  Unlike the other
+	# stream ciphers it can stay printable (a key of 0x20 just flips the case)
+	def triage(self, stats):
+		if stats.length >= triage.MIN_ENTROPY_BYTES and stats.entropy > triage.MAX_TEXT_ENTROPY:
+			return (triage.RULED_OUT, 'entropy of %.2f bits per byte is too high for one key byte' % stats.entropy)
+		if stats.length >= triage.MIN_BYTES and stats.printableRate < triage.MIN_PRINTABLE_RATE:
+			return (triage.LIKELY, 'only %.0f%% printable' % (100*stats.printableRate))
+
+		return (triage.POSSIBLE, None)
+
 	def genKeys(self):
 		return range(256)
 
+	def genKeyRange(self, start, end=None):
+		return range(start, 256 if end == None else min(end, 256))
+
+	def countKeys(self):
+		return 256
+
 	def crack(self, ciphertext):
 		return super().bruteForce(ciphertext, self.minReadRate)  # can I define this method at higher level?...
 
@@ -57,3 +92,35 @@ class XorTest(unittest.TestCase):
 		ciphertext = '\x00\x03\x02'
 
 		self.assertEqual(self.xorInstance.decrypt(self.xorInstance.encrypt(plaintext, 0x41), 0x41), plaintext)
+
+	def test_bytes(self):
+		self.assertEqual(self.xorInstance.encrypt(b'\x41\x42\x43', 0x41), b'\x00\x03\x02')
+		self.assertEqual(self.xorInstance.decrypt(bytearray(b'\x00\x03\x02'), 0x41), b'\x41\x42\x43')
+		self.assertEqual(self.xorInstance.decrypt(memoryview(b'\x00\x03\x02'), 0x41), b'\x41\x42\x43')
+		self.assertEqual(self.xorInstance.keystream(7, 3), (b'\x07\x07\x07', 7))
+
+	def test_decryptFile(self):
+		infile = io.BytesIO(b'\x00\x03\x02'*5)
+		outfile = io.BytesIO()
+		self.xorInstance.decryptFile(infile, outfile, 0x41, 4)
+		self.assertEqual(outfile.getvalue(), b'\x41\x42\x43'*5)
+
+	def test_genKeyRange(self):
+		self.assertEqual(list(self.xorInstance.genKeyRange(10, 13)), [10, 11, 12])
+		self.assertEqual(self.xorInstance.countKeys(), len(list(self.xorInstance.genKeys())))
+
+	def test_decryptBatch(self):
+		ciphertext = 'Some text, to xor!\x00\xff'
+		keys = list(self.xorInstance.genKeys())
+		plaintexts = self.xorInstance.decryptBatch(utils.textToCodes(ciphertext), keys)
+		for key, row in zip(keys, plaintexts):
+			self.assertEqual(utils.codesToText(row), self.xorInstance.decrypt(ciphertext, key))
+
+	def test_crack(self):
+		plaintext = 'this is a reasonably long english sentence, which should be simple to find the key for.'
+		ciphertext = self.xorInstance.encrypt(plaintext, 0x2a)
+		(key, _) = self.xorInstance.crack(ciphertext)
+		self.assertEqual(key, 0x2a)
+
+		(key, _) = self.xorInstance.crack(ciphertext + '\u2603')  # Doesn't fit in a byte, so only counts towards the length
+		self.assertEqual(key, 0x2a)